@@ -0,0 +1,10 @@
+#!/bin/bash
+# one worker with a single process per lane keeps the tasks of a lane in order
+lanes=${COPY_LANES:-16}
+for i in $(seq 0 $((lanes - 1))); do
+    celery -A copy_trade worker -c 1 --prefetch-multiplier 1 -O fair -l INFO \
+        -Q copy_lane_$i -n copy_lane_$i@%h &
+done
+# restart the container when any lane worker exits
+wait -n
+exit 1
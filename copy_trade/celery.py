@@ -32,6 +32,7 @@ app.conf.update(
         'exchange_binance.tasks.open_position_signal': {'queue': 'binance'},
         'exchange_binance.tasks.open_position_manually': {'queue': 'binance'},
         'exchange_binance.tasks.copy_trade_order': {'queue': 'binance'},
+        'exchange_binance.tasks.copy_trade_orders': {'queue': 'binance'},
         'exchange_binance.tasks.copy_trade_account': {'queue': 'binance'},
         'exchange_binance.tasks.price_change_percent_strategy': {'queue': 'binance'},
         'exchange_binance.tasks.placing_orders_after_opening_position': {'queue': 'binance'},
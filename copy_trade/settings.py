@@ -283,6 +283,51 @@ FORMAT_MODULE_PATH = [
 
 BINANCE_RECV_WINDOW = 15000
 BINANCE_LIMIT_USAGE = 1000
+BINANCE_WEIGHT_LIMIT = int(os.environ.get('BINANCE_WEIGHT_LIMIT', 2400))
+# seconds a trade request waits for free weight before it fails
+BINANCE_WEIGHT_WAIT = float(os.environ.get('BINANCE_WEIGHT_WAIT', 1))
+BINANCE_ORDER_LIMIT_10S = int(os.environ.get('BINANCE_ORDER_LIMIT_10S', 300))
+BINANCE_ORDER_LIMIT_1M = int(os.environ.get('BINANCE_ORDER_LIMIT_1M', 1200))
+# share of the order limits that orders opening exposure may use
+BINANCE_ORDER_SHARE = float(os.environ.get('BINANCE_ORDER_SHARE', 0.8))
+# seconds an order waits for the order limit before it is sent anyway
+BINANCE_ORDER_WAIT = float(os.environ.get('BINANCE_ORDER_WAIT', 2))
 SIGNAL_SOURCE_IPS = os.environ.get('SIGNAL_SOURCE_IPS', [])
 BINANCE_WEBHOOK_URL = os.environ.get('BINANCE_WEBHOOK_URL')
 BINANCE_LEVERAGE = 20
+BINANCE_BASE_URL = os.environ.get('BINANCE_BASE_URL')
+BINANCE_WS_URL = os.environ.get('BINANCE_WS_URL')
+BINANCE_WS_API_URL = os.environ.get('BINANCE_WS_API_URL')
+BINANCE_CLIENT_POOL_MAXSIZE = int(os.environ.get('BINANCE_CLIENT_POOL_MAXSIZE', 50))
+BINANCE_CLIENT_IDLE_TIMEOUT = int(os.environ.get('BINANCE_CLIENT_IDLE_TIMEOUT', 600))
+BINANCE_CLIENT_POOL_PREWARM = bool(int(os.environ.get('BINANCE_CLIENT_POOL_PREWARM', 1)))
+
+WEBSOCKET_QUEUE_SIZE = int(os.environ.get('WEBSOCKET_QUEUE_SIZE', 10000))
+# milliseconds to wait for more order events before writing them in one statement
+ORDER_WRITER_WINDOW = int(os.environ.get('ORDER_WRITER_WINDOW', 5))
+ORDER_WRITER_BATCH_SIZE = int(os.environ.get('ORDER_WRITER_BATCH_SIZE', 500))
+
+# seconds, matches the update_balances schedule in copy_trade/celery.py
+BALANCE_REFRESH_INTERVAL = int(os.environ.get('BALANCE_REFRESH_INTERVAL', 5))
+BALANCE_REFRESH_IDLE_INTERVAL = int(os.environ.get('BALANCE_REFRESH_IDLE_INTERVAL', 60))
+BALANCE_REFRESH_MAX_WORKERS = int(os.environ.get('BALANCE_REFRESH_MAX_WORKERS', 10))
+
+FOLLOWER_STREAMS_MAX_WORKERS = int(os.environ.get('FOLLOWER_STREAMS_MAX_WORKERS', 20))
+FOLLOWER_STREAMS_SYNC_INTERVAL = int(os.environ.get('FOLLOWER_STREAMS_SYNC_INTERVAL', 30))
+FOLLOWER_STREAMS_FLUSH_INTERVAL = float(os.environ.get('FOLLOWER_STREAMS_FLUSH_INTERVAL', 0.5))
+# seconds to wait for the copy task to save an order before its stream updates are dropped
+FOLLOWER_STREAMS_PENDING_TTL = int(os.environ.get('FOLLOWER_STREAMS_PENDING_TTL', 10))
+
+COPY_TRADE_FAN_OUT = bool(int(os.environ.get('COPY_TRADE_FAN_OUT', 1)))
+COPY_TRADE_MAX_WORKERS = int(os.environ.get('COPY_TRADE_MAX_WORKERS', 50))
+COPY_TRADE_FOLLOWER_TIMEOUT = float(os.environ.get('COPY_TRADE_FOLLOWER_TIMEOUT', 5))
+CLOSE_POSITIONS_MAX_WORKERS = int(os.environ.get('CLOSE_POSITIONS_MAX_WORKERS', 50))
+CLOSE_POSITIONS_TIMEOUT = float(os.environ.get('CLOSE_POSITIONS_TIMEOUT', 10))
+# number of copy_lane_N queues, each must have one worker with concurrency 1, 0 uses the binance queue
+COPY_LANES = int(os.environ.get('COPY_LANES', 16))
+# rest or ws
+COPY_TRADE_TRANSPORT = os.environ.get('COPY_TRADE_TRANSPORT', 'rest')
+
+# seconds an api request waits for its task before answering 202 with a job id
+API_JOB_WAIT = float(os.environ.get('API_JOB_WAIT', 2))
+API_JOB_TTL = int(os.environ.get('API_JOB_TTL', 3600))
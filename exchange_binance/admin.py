@@ -7,6 +7,7 @@ from exchange_binance.models import (
 )
 from general.utils import get_pretty_dict
 from exchange_binance.filters import SymbolFilter, OrderSymbolFilter
+from exchange_binance.prices import get_market_prices
 
 
 logger = logging.getLogger(__name__)
@@ -30,7 +31,7 @@ class MasterAccountAdmin(admin.ModelAdmin):
 @admin.register(CopyTradeAccount)
 class CopyTradeAccountAdmin(admin.ModelAdmin):
     list_display = (
-        'id', 'name', 'use_proxy', 'api_key', 'api_secret', 'proxy', 'wallet_balance',
+        'id', 'name', 'is_active', 'use_proxy', 'api_key', 'api_secret', 'proxy', 'wallet_balance',
         'available_balance', 'margin_balance', 'cross_unrealized_pnl',
         'unrealized_profit', 'updated_at'
     )
@@ -49,6 +50,14 @@ class SymbolAdmin(admin.ModelAdmin):
     list_display_links = ('symbol',)
     list_filter = ('is_active',)
 
+    def get_changelist_instance(self, request):
+        changelist = super().get_changelist_instance(request)
+        symbols = list(changelist.result_list)
+        prices = get_market_prices([i.symbol for i in symbols])
+        for symbol in symbols:
+            symbol._market_price = prices[symbol.symbol]
+        return changelist
+
     @admin.display(description='Data')
     def pretty_data(self, obj) -> str:
         return get_pretty_dict(obj.data)
@@ -1,10 +1,96 @@
+import logging
+import threading
+import time
+from dataclasses import dataclass, asdict
+from decimal import Decimal
+from django.core.cache import cache
 from exchange_binance.models import Symbol, MainSettings, MasterAccount, CopyTradeAccount
-from decimal import Decimal, ROUND_DOWN
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SymbolRules:
+    symbol: str
+    tick_size: Decimal
+    price_precision: int
+    quantity_precision: int
+    tick_digits: int
+    tick_scale: int
+    tick_units: int
+
+    @classmethod
+    def from_data(cls, data: dict) -> 'SymbolRules':
+        filters = {i['filterType']: i for i in data.get('filters', [])}
+        price_filter = filters.get('PRICE_FILTER') or data['filters'][0]
+        # normalize keeps the zeros of integer ticks, '10' is 1E+1 and not 1
+        tick_size = Decimal(price_filter['tickSize']).normalize()
+        tick_digits = max(-tick_size.as_tuple().exponent, 0)
+        tick_scale = 10 ** tick_digits
+        return cls(
+            symbol=data['symbol'],
+            tick_size=tick_size,
+            price_precision=data['pricePrecision'],
+            quantity_precision=data['quantityPrecision'],
+            tick_digits=tick_digits,
+            tick_scale=tick_scale,
+            tick_units=int(tick_size * tick_scale)
+        )
+
+
+class SymbolRulesCache():
+    key = 'symbol_rules_v2'
+    version_key = 'symbol_rules_version'
+    check_interval = 60
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.version = None
+        self.checked_at = 0.0
+        self.rules: dict[str, SymbolRules] = {}
+
+    def _refresh(self, now: float) -> None:
+        with self.lock:
+            self.checked_at = now
+            version = cache.get(self.version_key, 0)
+            if version == self.version:
+                return
+            rules = cache.get(self.key) or {}
+            self.rules = {k: SymbolRules(**v) for k, v in rules.items()}
+            self.version = version
+            logger.debug(f'Loaded rules for {len(self.rules)} symbols, {version=}')
+
+    def get(self, symbol: Symbol | str) -> SymbolRules:
+        now = time.monotonic()
+        if now - self.checked_at > self.check_interval:
+            self._refresh(now)
+        rules = self.rules.get(getattr(symbol, 'symbol', symbol))
+        if rules:
+            return rules
+        if not isinstance(symbol, Symbol):
+            symbol = Symbol.objects.get(symbol=symbol)
+        rules = SymbolRules.from_data(symbol.data)
+        self.rules[symbol.symbol] = rules
+        return rules
+
+    def compile(self, data: list[dict]) -> None:
+        rules = {i['symbol']: asdict(SymbolRules.from_data(i)) for i in data}
+        cache.set(self.key, rules, timeout=None)
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, timeout=None)
+        self.checked_at = 0.0
+        logger.info(f'Compiled rules for {len(rules)} symbols')
+
+
+symbol_rules = SymbolRulesCache()
 
 
 def get_quantity_from_usdt(symbol: Symbol, usdt: float) -> float:
     quantity = (usdt * symbol.leverage) / symbol.market_price
-    return round(quantity, symbol.data['quantityPrecision'])
+    return round(quantity, symbol.rules.quantity_precision)
 
 
 # def price_to_precision(symbol: Symbol, price: float) -> str:
@@ -16,16 +102,31 @@ def get_quantity_from_usdt(symbol: Symbol, usdt: float) -> float:
 
 
 def price_to_precision(symbol: Symbol, price: float) -> str:
-    tick_size = symbol.data['filters'][0]['tickSize'].rstrip('0').rstrip('.')
-    price_str = str(
-        Decimal(price).quantize(Decimal(tick_size), rounding=ROUND_DOWN)
-    )
-    return price_str.rstrip('0').rstrip('.')
+    # Truncates to a multiple of tick_size with integer arithmetic on the exact
+    # value of the float, the price is counted in units of 10 ** -tick_digits
+    rules = symbol.rules
+    if isinstance(price, str):
+        price = Decimal(price)
+    numerator, denominator = price.as_integer_ratio()
+    sign = ''
+    if numerator < 0:
+        sign = '-'
+        numerator = -numerator
+        price = -price
+    ticks, rest = divmod(numerator * rules.tick_scale, denominator * rules.tick_units)
+    # 0.3 is stored as 0.29999..., when the next multiple of the tick is the
+    # same float as the price, the price is that multiple
+    if rest and (ticks + 1) * rules.tick_units / rules.tick_scale == price:
+        ticks += 1
+    units, fraction = divmod(ticks * rules.tick_units, rules.tick_scale)
+    if not fraction:
+        return f'{sign}{units}'
+    fraction = str(fraction).rjust(rules.tick_digits, '0').rstrip('0')
+    return f'{sign}{units}.{fraction}'
 
 
 def quantity_to_precision(symbol: Symbol, quantity: float) -> str:
-    precision = symbol.data['quantityPrecision']
-    quantity_str = f'{quantity:.{precision}f}'
-    if '.' in quantity_str:
-        return quantity_str.rstrip('0').rstrip('.')
-    return quantity_str
+    precision = symbol.rules.quantity_precision
+    if precision:
+        return f'{quantity:.{precision}f}'.rstrip('0').rstrip('.')
+    return f'{quantity:.0f}'
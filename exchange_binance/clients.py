@@ -0,0 +1,123 @@
+import logging
+import threading
+import time
+from types import SimpleNamespace as Namespace
+from django.conf import settings
+from binance.um_futures import UMFutures
+from exchange_binance.credentials import binance
+from exchange_binance.limits import LimitedAdapter, get_egress
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_base_url(testnet: bool) -> str:
+    if settings.BINANCE_BASE_URL:
+        return settings.BINANCE_BASE_URL
+    if testnet:
+        return 'https://testnet.binancefuture.com'
+    return 'https://fapi.binance.com'
+
+
+class ClientPool():
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.clients: dict[tuple, Namespace] = {}
+        self.evicted_at = time.monotonic()
+
+    def _create(
+        self,
+        api_key: str,
+        api_secret: str,
+        proxy: str | None,
+        testnet: bool,
+        timeout: float | None
+    ) -> UMFutures:
+        client = UMFutures(
+            key=api_key,
+            secret=api_secret,
+            base_url=get_base_url(testnet),
+            timeout=timeout
+        )
+        if proxy:
+            client.proxies = {'https': proxy, 'http': proxy}
+        adapter = LimitedAdapter(
+            get_egress(proxy),
+            pool_connections=1,
+            pool_maxsize=settings.BINANCE_CLIENT_POOL_MAXSIZE
+        )
+        client.session.mount('https://', adapter)
+        client.session.mount('http://', adapter)
+        return client
+
+    def _evict_idle(self, now: float) -> None:
+        if now - self.evicted_at < 60:
+            return
+        self.evicted_at = now
+        for key, entry in list(self.clients.items()):
+            if now - entry.used_at > settings.BINANCE_CLIENT_IDLE_TIMEOUT:
+                entry.client.session.close()
+                del self.clients[key]
+                logger.debug(f'Evicted idle client {key[0][:8]}')
+
+    def get(
+        self,
+        api_key: str,
+        api_secret: str,
+        proxy: str | None = None,
+        testnet: bool = False,
+        timeout: float | None = None
+    ) -> UMFutures:
+        key = (api_key, proxy, testnet)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None or entry.api_secret != api_secret:
+                if entry:
+                    entry.client.session.close()
+                    logger.info(f'Credentials changed, rebuilt client {api_key[:8]}')
+                client = self._create(api_key, api_secret, proxy, testnet, timeout)
+                entry = Namespace(client=client, api_secret=api_secret, used_at=now)
+                self.clients[key] = entry
+            entry.used_at = now
+            self._evict_idle(now)
+        return entry.client
+
+    def master(self) -> UMFutures:
+        credentials = binance.get_credentials()
+        return self.get(
+            credentials.api_key, credentials.api_secret, testnet=credentials.testnet
+        )
+
+    def for_account(self, account) -> UMFutures:
+        if account.is_master:
+            return self.master()
+        return self.get(
+            account.api_key,
+            account.api_secret,
+            proxy=account.proxy if account.use_proxy else None,
+            timeout=settings.COPY_TRADE_FOLLOWER_TIMEOUT
+        )
+
+    def warm(self, accounts: list) -> None:
+        # only the master and one client per egress are built and send a time request,
+        # which opens the connection and resolves the proxy, the other followers
+        # get their clients on first use, idle ones would be evicted anyway
+        try:
+            self.master().time()
+            connected = {get_egress(None)}
+            for account in accounts:
+                egress = get_egress(account.proxy if account.use_proxy else None)
+                if egress in connected:
+                    continue
+                connected.add(egress)
+                try:
+                    self.for_account(account).time()
+                except Exception as e:
+                    logger.warning(f'Warm up request through {egress} failed: {e!r}')
+            logger.info(f'Client pool warmed up, {len(connected)} egresses connected')
+        except Exception as e:
+            logger.exception(e)
+
+
+pool = ClientPool()
@@ -1,36 +1,78 @@
+import logging
+import threading
+from typing import NamedTuple
+from django.core.cache import cache
+from django.db import transaction
 from exchange_binance.models import MasterAccount
 
 
+logger = logging.getLogger(__name__)
+
+
+class Credentials(NamedTuple):
+    api_key: str
+    api_secret: str
+    testnet: bool
+
+
 class Binance():
-    def _get_api_key(self):
-        key = MasterAccount.objects.values_list('api_key', flat=True).first()
-        if not key:
-            raise ValueError('API Key is not set in Master Account')
-        return key
+    version_key = 'master_account_version'
 
-    def _get_api_secret(self):
-        secret = MasterAccount.objects.values_list('api_secret', flat=True).first()
-        if not secret:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.version = None
+        self._credentials: Credentials | None = None
+
+    def _load(self) -> Credentials:
+        version = cache.get(self.version_key, 0)
+        credentials = self._credentials
+        if credentials and version == self.version:
+            return credentials
+        with self.lock:
+            if not self._credentials or version != self.version:
+                values = MasterAccount.objects.values_list(
+                    'api_key', 'api_secret', 'testnet'
+                ).first()
+                self._credentials = Credentials(*(values or ('', '', False)))
+                self.version = version
+                logger.debug(f'Loaded master account credentials, {version=}')
+            return self._credentials
+
+    def get_credentials(self) -> Credentials:
+        credentials = self._load()
+        if not credentials.api_key:
+            raise ValueError('API Key is not set in Master Account')
+        if not credentials.api_secret:
             raise ValueError('API Secret is not set in Master Account')
-        return secret
+        return credentials
+
+    def invalidate(self) -> None:
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, timeout=None)
+        logger.debug('Invalidated master account credentials')
 
-    def _get_testnet(self):
-        testnet = MasterAccount.objects.values_list('testnet', flat=True).first()
-        if testnet is None:
-            return False
-        return testnet
+    def rotate(self, api_key: str, api_secret: str) -> MasterAccount:
+        with transaction.atomic():
+            master_account = MasterAccount.objects.select_for_update().first()
+            master_account.api_key = api_key
+            master_account.api_secret = api_secret
+            master_account.save(update_fields=['api_key', 'api_secret', 'updated_at'])
+        logger.warning('Master account credentials rotated')
+        return master_account
 
     @property
     def api_key(self):
-        return self._get_api_key()
+        return self.get_credentials().api_key
 
     @property
     def api_secret(self):
-        return self._get_api_secret()
+        return self.get_credentials().api_secret
 
     @property
     def testnet(self):
-        return self._get_testnet()
+        return bool(self._load().testnet)
 
 
 binance = Binance()
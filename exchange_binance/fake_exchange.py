@@ -0,0 +1,832 @@
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import random
+import struct
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+
+logger = logging.getLogger(__name__)
+
+WS_MAGIC = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+# symbol: (price, tick size, step size, price precision, quantity precision)
+SYMBOLS = {
+    'BTCUSDT': (60000.0, '0.10', '0.001', 2, 3),
+    'ETHUSDT': (3000.0, '0.01', '0.001', 2, 3),
+    'BNBUSDT': (600.0, '0.010', '0.01', 3, 2),
+    'SOLUSDT': (150.0, '0.0100', '1', 4, 0),
+    'XRPUSDT': (0.6, '0.0001', '0.1', 4, 1),
+    'DOGEUSDT': (0.15, '0.000010', '1', 6, 0),
+}
+# request weight per endpoint, the rest cost 1
+WEIGHTS = {
+    ('POST', '/fapi/v1/batchOrders'): 5,
+    ('GET', '/fapi/v3/account'): 5,
+    ('GET', '/fapi/v3/positionRisk'): 5,
+    ('GET', '/fapi/v1/openOrders'): 40,
+    ('GET', '/fapi/v1/ticker/24hr'): 40,
+}
+# endpoints that cost 1 when a symbol is given
+SYMBOL_WEIGHTS = {('GET', '/fapi/v1/openOrders'), ('GET', '/fapi/v1/ticker/24hr')}
+PUBLIC_ENDPOINTS = {'/fapi/v1/exchangeInfo', '/fapi/v1/time', '/fapi/v1/ticker/24hr'}
+ORDER_ENDPOINTS = {
+    ('POST', '/fapi/v1/order'), ('PUT', '/fapi/v1/order'), ('POST', '/fapi/v1/batchOrders')
+}
+
+
+class FakeExchangeError(Exception):
+    def __init__(self, status: int, code: int, msg: str) -> None:
+        super().__init__(msg)
+        self.status = status
+        self.code = code
+        self.msg = msg
+
+
+class WebSocketConnection():
+    def __init__(self, rfile, wfile) -> None:
+        self.rfile = rfile
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _read(self, size: int) -> bytes:
+        data = self.rfile.read(size)
+        if len(data) < size:
+            raise ConnectionError('Connection closed')
+        return data
+
+    def _send(self, payload: bytes, opcode: int) -> None:
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 65536:
+            header += bytes([126]) + struct.pack('>H', length)
+        else:
+            header += bytes([127]) + struct.pack('>Q', length)
+        with self.lock:
+            if self.closed:
+                return
+            try:
+                self.wfile.write(header + payload)
+            except OSError:
+                self.closed = True
+
+    def send(self, message: dict | list) -> None:
+        self._send(json.dumps(message).encode(), 0x1)
+
+    def recv(self) -> str | None:
+        message = b''
+        try:
+            while not self.closed:
+                head = self._read(2)
+                fin, opcode = head[0] & 0x80, head[0] & 0x0f
+                length = head[1] & 0x7f
+                if length == 126:
+                    length = struct.unpack('>H', self._read(2))[0]
+                elif length == 127:
+                    length = struct.unpack('>Q', self._read(8))[0]
+                mask = self._read(4) if head[1] & 0x80 else None
+                payload = self._read(length)
+                if mask:
+                    payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+                if opcode == 0x8:
+                    self._send(payload[:2], 0x8)
+                    self.closed = True
+                    return None
+                if opcode == 0x9:
+                    self._send(payload, 0xA)
+                    continue
+                if opcode == 0xA:
+                    continue
+                message += payload
+                if fin:
+                    return message.decode()
+        except (ConnectionError, OSError):
+            self.closed = True
+        return None
+
+
+class CombinedStream():
+    def __init__(self, ws: WebSocketConnection, listen_key: str) -> None:
+        self.ws = ws
+        self.listen_key = listen_key
+
+    def send(self, message: dict) -> None:
+        self.ws.send({'stream': self.listen_key, 'data': message})
+
+
+class FakeExchange():
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        weight_limit: int = 2400,
+        order_limit: int = 300,
+        balance: float = 10000.0,
+        extra_symbols: int = 0
+    ) -> None:
+        # latency and jitter are in milliseconds, order_limit is per 10 seconds
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.weight_limit = weight_limit
+        self.order_limit = order_limit
+        self.balance = balance
+        self.lock = threading.Lock()
+        self.symbols = dict(SYMBOLS)
+        for i in range(extra_symbols):
+            self.symbols[f'SYM{i}USDT'] = (1.0, '0.0001', '1', 4, 0)
+        self.prices = {symbol: i[0] for symbol, i in self.symbols.items()}
+        self.order_ids = itertools.count(int(time.time() * 1000))
+        self.orders: dict[str, dict[int, dict]] = defaultdict(dict)
+        self.positions: dict[str, dict[str, dict]] = defaultdict(dict)
+        self.leverage: dict[tuple, int] = {}
+        self.listen_keys: dict[str, str] = {}
+        self.user_streams: dict[str, set] = defaultdict(set)
+        self.market_streams: set = set()
+        self.weight = {'minute': 0, 'used': 0}
+        self.order_times: dict[str, deque] = defaultdict(deque)
+        self.stats = defaultdict(int)
+
+    def reset(self) -> None:
+        with self.lock:
+            self.orders.clear()
+            self.positions.clear()
+            self.leverage.clear()
+            self.order_times.clear()
+            self.stats.clear()
+            self.weight = {'minute': 0, 'used': 0}
+
+    def configure(self, **kwargs) -> dict:
+        for name in ('latency', 'jitter', 'error_rate', 'weight_limit', 'order_limit', 'balance'):
+            if name in kwargs:
+                setattr(self, name, type(getattr(self, name))(kwargs[name]))
+        return self.get_config()
+
+    def get_config(self) -> dict:
+        return {
+            'latency': self.latency,
+            'jitter': self.jitter,
+            'error_rate': self.error_rate,
+            'weight_limit': self.weight_limit,
+            'order_limit': self.order_limit,
+            'balance': self.balance,
+        }
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                'requests': dict(self.stats),
+                'accounts': len(self.orders),
+                'open_orders': sum(
+                    1 for i in self.orders.values() for o in i.values() if o['status'] == 'NEW'
+                ),
+                'user_streams': sum(len(i) for i in self.user_streams.values()),
+                'market_streams': len(self.market_streams),
+                'used_weight': self.weight['used'],
+            }
+
+    def simulate(self) -> None:
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay / 1000)
+        if self.error_rate and random.random() < self.error_rate:
+            with self.lock:
+                self.stats['errors'] += 1
+            raise FakeExchangeError(
+                503, -1001, 'Internal error; unable to process your request. Please try again.'
+            )
+
+    def use_weight(self, weight: int) -> dict:
+        minute = int(time.time() // 60)
+        with self.lock:
+            if self.weight['minute'] != minute:
+                self.weight = {'minute': minute, 'used': 0}
+            self.weight['used'] += weight
+            used = self.weight['used']
+        headers = {'X-MBX-USED-WEIGHT-1M': str(used)}
+        if used > self.weight_limit:
+            raise FakeExchangeError(
+                429, -1003, f'Too many requests; current limit is {self.weight_limit} '
+                'requests per minute.'
+            )
+        return headers
+
+    def use_order_count(self, api_key: str, count: int = 1) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            times = self.order_times[api_key]
+            while times and now - times[0] > 60:
+                times.popleft()
+            times.extend([now] * count)
+            last_10s = sum(1 for i in times if now - i <= 10)
+            last_1m = len(times)
+        headers = {
+            'X-MBX-ORDER-COUNT-10S': str(last_10s),
+            'X-MBX-ORDER-COUNT-1M': str(last_1m)
+        }
+        if last_10s > self.order_limit:
+            raise FakeExchangeError(
+                429, -1015, f'Too many new orders; current limit is {self.order_limit} '
+                'orders per 10 SECONDS.'
+            )
+        return headers
+
+    def tick_prices(self) -> list[dict]:
+        now = int(time.time() * 1000)
+        data = []
+        with self.lock:
+            for symbol, price in self.prices.items():
+                price *= 1 + random.uniform(-0.0005, 0.0005)
+                self.prices[symbol] = price
+                data.append({
+                    'e': 'markPriceUpdate', 'E': now, 's': symbol,
+                    'p': self.format_price(symbol, price), 'i': str(price),
+                    'P': str(price), 'r': '0.00010000', 'T': now + 3600000
+                })
+        return data
+
+    def format_price(self, symbol: str, price: float) -> str:
+        return f'{price:.{self.symbols[symbol][3]}f}'
+
+    def emit(self, api_key: str, event: dict) -> None:
+        for ws in list(self.user_streams.get(api_key, ())):
+            ws.send(event)
+
+    def _order_event(self, order: dict, now: int) -> dict:
+        o = {
+            's': order['symbol'], 'c': order['clientOrderId'], 'S': order['side'],
+            'o': order['type'], 'f': order['timeInForce'], 'q': order['origQty'],
+            'p': order['price'], 'ap': order['avgPrice'], 'sp': order['stopPrice'],
+            'x': 'TRADE' if order['status'] == 'FILLED' else order['status'],
+            'X': order['status'], 'i': order['orderId'], 'l': order['executedQty'],
+            'z': order['executedQty'], 'L': order['avgPrice'], 'n': '0', 'N': 'USDT',
+            'T': now, 't': 0, 'b': '0', 'a': '0', 'm': False, 'R': order['reduceOnly'],
+            'wt': order['workingType'], 'ot': order['origType'], 'ps': 'BOTH',
+            'cp': order['closePosition'], 'rp': '0', 'pP': False, 'si': 0, 'ss': 0,
+            'V': 'NONE', 'pm': 'NONE', 'gtd': 0
+        }
+        if order['type'] == 'TRAILING_STOP_MARKET':
+            o.update(AP=order['activatePrice'], cr=order['priceRate'])
+        if order['status'] == 'NEW':
+            o['x'] = 'NEW'
+        return {'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now, 'o': o}
+
+    def _position_event(self, api_key: str, symbol: str, now: int) -> dict:
+        p = self.positions[api_key].get(symbol, {'amt': 0.0, 'entry': 0.0})
+        return {
+            'e': 'ACCOUNT_UPDATE', 'E': now, 'T': now,
+            'a': {
+                'm': 'ORDER',
+                'B': [{'a': 'USDT', 'wb': str(self.balance), 'cw': str(self.balance), 'bc': '0'}],
+                'P': [{
+                    's': symbol, 'pa': str(p['amt']), 'ep': str(p['entry']),
+                    'bep': str(p['entry']), 'cr': '0', 'up': '0', 'mt': 'cross',
+                    'iw': '0', 'ps': 'BOTH'
+                }]
+            }
+        }
+
+    def _fill(self, api_key: str, order: dict) -> None:
+        quantity = float(order['origQty'])
+        price = self.prices[order['symbol']]
+        position = self.positions[api_key].setdefault(
+            order['symbol'], {'amt': 0.0, 'entry': 0.0}
+        )
+        amt = quantity if order['side'] == 'BUY' else -quantity
+        new_amt = round(position['amt'] + amt, 8)
+        if position['amt'] == 0 or (position['amt'] > 0) != (new_amt > 0):
+            position['entry'] = price if new_amt else 0.0
+        elif abs(new_amt) > abs(position['amt']):
+            position['entry'] = (
+                position['entry'] * abs(position['amt']) + price * quantity
+            ) / abs(new_amt)
+        position['amt'] = new_amt
+        order.update(
+            status='FILLED', avgPrice=self.format_price(order['symbol'], price),
+            executedQty=order['origQty'], cumQty=order['origQty'],
+            cumQuote=str(round(price * quantity, 8))
+        )
+
+    def place_order(self, api_key: str, params: dict) -> dict:
+        symbol = params.get('symbol', '')
+        if symbol not in self.symbols:
+            raise FakeExchangeError(400, -1121, 'Invalid symbol.')
+        for name in ('side', 'type'):
+            if not params.get(name):
+                raise FakeExchangeError(
+                    400, -1102, f"Mandatory parameter '{name}' was not sent, "
+                    'was empty/null, or malformed.'
+                )
+        if str(params.get('closePosition')).lower() != 'true' and not params.get('quantity'):
+            raise FakeExchangeError(
+                400, -1102, "Mandatory parameter 'quantity' was not sent, "
+                'was empty/null, or malformed.'
+            )
+        now = int(time.time() * 1000)
+        order = {
+            'orderId': next(self.order_ids),
+            'symbol': symbol,
+            'status': 'NEW',
+            'clientOrderId': params.get('newClientOrderId') or uuid.uuid4().hex[:22],
+            'price': params.get('price', '0'),
+            'avgPrice': '0',
+            'origQty': params.get('quantity', '0'),
+            'executedQty': '0',
+            'cumQty': '0',
+            'cumQuote': '0',
+            'timeInForce': params.get('timeInForce', 'GTC'),
+            'type': params['type'],
+            'reduceOnly': str(params.get('reduceOnly', 'false')).lower() == 'true',
+            'closePosition': str(params.get('closePosition', 'false')).lower() == 'true',
+            'side': params['side'],
+            'positionSide': 'BOTH',
+            'stopPrice': params.get('stopPrice', '0'),
+            'workingType': params.get('workingType', 'CONTRACT_PRICE'),
+            'priceProtect': False,
+            'origType': params['type'],
+            'priceMatch': 'NONE',
+            'selfTradePreventionMode': 'NONE',
+            'goodTillDate': 0,
+            'updateTime': now
+        }
+        if params['type'] == 'TRAILING_STOP_MARKET':
+            order.update(
+                activatePrice=params.get('activationPrice', '0'),
+                priceRate=params.get('callbackRate', '0')
+            )
+        with self.lock:
+            self.orders[api_key][order['orderId']] = order
+            self.stats['orders'] += 1
+            events = [self._order_event(order, now)]
+            if params['type'] == 'MARKET':
+                self._fill(api_key, order)
+                events.append(self._order_event(order, now))
+                events.append(self._position_event(api_key, symbol, now))
+            result = dict(order)
+        for event in events:
+            self.emit(api_key, event)
+        # like the real exchange, the REST ack of a market order is NEW,
+        # the fill arrives on the user data stream
+        if params['type'] == 'MARKET':
+            result.update(status='NEW', avgPrice='0', executedQty='0', cumQty='0', cumQuote='0')
+        return result
+
+    def _find_order(self, api_key: str, params: dict) -> dict:
+        orders = self.orders.get(api_key, {})
+        order = None
+        if params.get('orderId'):
+            order = orders.get(int(params['orderId']))
+        elif params.get('origClientOrderId'):
+            order = next(
+                (i for i in orders.values() if i['clientOrderId'] == params['origClientOrderId']),
+                None
+            )
+        if not order or order['symbol'] != params.get('symbol'):
+            raise FakeExchangeError(400, -2011, 'Unknown order sent.')
+        return order
+
+    def cancel_order(self, api_key: str, params: dict) -> dict:
+        now = int(time.time() * 1000)
+        with self.lock:
+            order = self._find_order(api_key, params)
+            if order['status'] != 'NEW':
+                raise FakeExchangeError(400, -2011, 'Unknown order sent.')
+            order.update(status='CANCELED', updateTime=now)
+            self.stats['cancels'] += 1
+            event = self._order_event(order, now)
+            result = dict(order)
+        self.emit(api_key, event)
+        return result
+
+    def modify_order(self, api_key: str, params: dict) -> dict:
+        now = int(time.time() * 1000)
+        with self.lock:
+            order = self._find_order(api_key, params)
+            if order['status'] != 'NEW' or order['type'] != 'LIMIT':
+                raise FakeExchangeError(400, -2013, 'Order does not exist.')
+            order.update(
+                price=params.get('price', order['price']),
+                origQty=params.get('quantity', order['origQty']),
+                updateTime=now
+            )
+            event = self._order_event(order, now)
+            event['o']['x'] = 'AMENDMENT'
+            result = dict(order)
+        self.emit(api_key, event)
+        return result
+
+    def cancel_open_orders(self, api_key: str, params: dict) -> dict:
+        symbol = params.get('symbol')
+        now = int(time.time() * 1000)
+        with self.lock:
+            events = []
+            for order in self.orders.get(api_key, {}).values():
+                if order['symbol'] == symbol and order['status'] == 'NEW':
+                    order.update(status='CANCELED', updateTime=now)
+                    events.append(self._order_event(order, now))
+        for event in events:
+            self.emit(api_key, event)
+        return {'code': 200, 'msg': 'The operation of cancel all open order is done.'}
+
+    def _batch(self, method, api_key: str, items: list[dict]) -> list[dict]:
+        result = []
+        for params in items:
+            try:
+                result.append(method(api_key, params))
+            except FakeExchangeError as e:
+                result.append({'code': e.code, 'msg': e.msg})
+        return result
+
+    def new_batch_order(self, api_key: str, params: dict) -> list[dict]:
+        items = json.loads(params.get('batchOrders', '[]'))
+        if len(items) > 5:
+            raise FakeExchangeError(400, -1130, 'Data sent for parameter batchOrders is not valid.')
+        items = [{k: str(v) for k, v in i.items()} for i in items]
+        return self._batch(self.place_order, api_key, items)
+
+    def cancel_batch_order(self, api_key: str, params: dict) -> list[dict]:
+        items = [
+            {'symbol': params.get('symbol'), 'orderId': i}
+            for i in json.loads(params.get('orderIdList') or '[]')
+        ] + [
+            {'symbol': params.get('symbol'), 'origClientOrderId': i}
+            for i in json.loads(params.get('origClientOrderIdList') or '[]')
+        ]
+        return self._batch(self.cancel_order, api_key, items)
+
+    def get_orders(self, api_key: str, params: dict) -> list[dict]:
+        with self.lock:
+            return [
+                dict(i) for i in self.orders.get(api_key, {}).values()
+                if i['status'] == 'NEW' and params.get('symbol') in (None, i['symbol'])
+            ]
+
+    def change_leverage(self, api_key: str, params: dict) -> dict:
+        symbol = params.get('symbol')
+        if symbol not in self.symbols:
+            raise FakeExchangeError(400, -1121, 'Invalid symbol.')
+        leverage = int(params.get('leverage', 20))
+        self.leverage[(api_key, symbol)] = leverage
+        return {'leverage': leverage, 'maxNotionalValue': '1000000', 'symbol': symbol}
+
+    def get_account(self, api_key: str, params: dict) -> dict:
+        balance = str(self.balance)
+        return {
+            'totalWalletBalance': balance,
+            'totalMarginBalance': balance,
+            'availableBalance': balance,
+            'assets': [{
+                'asset': 'USDT', 'walletBalance': balance, 'marginBalance': balance,
+                'availableBalance': balance, 'crossUnPnl': '0', 'unrealizedProfit': '0',
+                'crossWalletBalance': balance, 'maxWithdrawAmount': balance,
+                'updateTime': int(time.time() * 1000)
+            }],
+            'positions': self.get_positions(api_key, params)
+        }
+
+    def get_positions(self, api_key: str, params: dict) -> list[dict]:
+        now = int(time.time() * 1000)
+        result = []
+        with self.lock:
+            for symbol, p in self.positions.get(api_key, {}).items():
+                if not p['amt']:
+                    continue
+                mark_price = self.prices[symbol]
+                result.append({
+                    'symbol': symbol, 'positionSide': 'BOTH', 'positionAmt': str(p['amt']),
+                    'entryPrice': str(p['entry']), 'breakEvenPrice': str(p['entry']),
+                    'markPrice': str(mark_price),
+                    'unRealizedProfit': str((mark_price - p['entry']) * p['amt']),
+                    'liquidationPrice': '0', 'notional': str(mark_price * p['amt']),
+                    'marginAsset': 'USDT', 'updateTime': now
+                })
+        return result
+
+    def exchange_info(self, api_key: str, params: dict) -> dict:
+        symbols = []
+        for symbol, (price, tick_size, step_size, pp, qp) in self.symbols.items():
+            symbols.append({
+                'symbol': symbol, 'pair': symbol, 'contractType': 'PERPETUAL',
+                'status': 'TRADING', 'baseAsset': symbol[:-4], 'quoteAsset': 'USDT',
+                'marginAsset': 'USDT', 'pricePrecision': pp, 'quantityPrecision': qp,
+                'filters': [
+                    {'filterType': 'PRICE_FILTER', 'tickSize': tick_size,
+                     'minPrice': tick_size, 'maxPrice': str(price * 100)},
+                    {'filterType': 'LOT_SIZE', 'stepSize': step_size,
+                     'minQty': step_size, 'maxQty': '1000000'},
+                    {'filterType': 'MARKET_LOT_SIZE', 'stepSize': step_size,
+                     'minQty': step_size, 'maxQty': '100000'},
+                    {'filterType': 'MAX_NUM_ORDERS', 'limit': 200},
+                    {'filterType': 'MIN_NOTIONAL', 'notional': '5'},
+                ],
+                'orderTypes': [
+                    'LIMIT', 'MARKET', 'STOP', 'STOP_MARKET', 'TAKE_PROFIT',
+                    'TAKE_PROFIT_MARKET', 'TRAILING_STOP_MARKET'
+                ],
+                'timeInForce': ['GTC', 'IOC', 'FOK', 'GTX', 'GTD']
+            })
+        return {
+            'timezone': 'UTC',
+            'serverTime': int(time.time() * 1000),
+            'rateLimits': [
+                {'rateLimitType': 'REQUEST_WEIGHT', 'interval': 'MINUTE',
+                 'intervalNum': 1, 'limit': self.weight_limit},
+                {'rateLimitType': 'ORDERS', 'interval': 'SECOND',
+                 'intervalNum': 10, 'limit': self.order_limit},
+            ],
+            'symbols': symbols
+        }
+
+    def leverage_brackets(self, api_key: str, params: dict) -> list[dict]:
+        return [
+            {'symbol': symbol, 'brackets': [{
+                'bracket': 1, 'initialLeverage': 125, 'notionalCap': 50000,
+                'notionalFloor': 0, 'maintMarginRatio': 0.004, 'cum': 0.0
+            }]}
+            for symbol in self.symbols
+        ]
+
+    def ticker_24hr(self, api_key: str, params: dict) -> list[dict] | dict:
+        result = [
+            {'symbol': symbol, 'priceChange': '0', 'priceChangePercent': f'{random.uniform(-10, 10):.3f}',
+             'lastPrice': str(price), 'volume': '0', 'quoteVolume': '0'}
+            for symbol, price in self.prices.items()
+        ]
+        if params.get('symbol'):
+            return next(i for i in result if i['symbol'] == params['symbol'])
+        return result
+
+    def server_time(self, api_key: str, params: dict) -> dict:
+        return {'serverTime': int(time.time() * 1000)}
+
+    def new_listen_key(self, api_key: str, params: dict) -> dict:
+        listen_key = next((k for k, v in self.listen_keys.items() if v == api_key), None)
+        if not listen_key:
+            listen_key = uuid.uuid4().hex + uuid.uuid4().hex
+            self.listen_keys[listen_key] = api_key
+        return {'listenKey': listen_key}
+
+    def renew_listen_key(self, api_key: str, params: dict) -> dict:
+        return {}
+
+    def close_listen_key(self, api_key: str, params: dict) -> dict:
+        listen_key = next((k for k, v in self.listen_keys.items() if v == api_key), None)
+        self.listen_keys.pop(listen_key, None)
+        return {}
+
+    def get_routes(self) -> dict:
+        return {
+            ('POST', '/fapi/v1/order'): self.place_order,
+            ('DELETE', '/fapi/v1/order'): self.cancel_order,
+            ('PUT', '/fapi/v1/order'): self.modify_order,
+            ('DELETE', '/fapi/v1/allOpenOrders'): self.cancel_open_orders,
+            ('POST', '/fapi/v1/batchOrders'): self.new_batch_order,
+            ('DELETE', '/fapi/v1/batchOrders'): self.cancel_batch_order,
+            ('GET', '/fapi/v1/openOrders'): self.get_orders,
+            ('POST', '/fapi/v1/leverage'): self.change_leverage,
+            ('GET', '/fapi/v3/account'): self.get_account,
+            ('GET', '/fapi/v3/positionRisk'): self.get_positions,
+            ('GET', '/fapi/v1/exchangeInfo'): self.exchange_info,
+            ('GET', '/fapi/v1/leverageBracket'): self.leverage_brackets,
+            ('GET', '/fapi/v1/ticker/24hr'): self.ticker_24hr,
+            ('GET', '/fapi/v1/time'): self.server_time,
+            ('POST', '/fapi/v1/listenKey'): self.new_listen_key,
+            ('PUT', '/fapi/v1/listenKey'): self.renew_listen_key,
+            ('DELETE', '/fapi/v1/listenKey'): self.close_listen_key,
+        }
+
+    def ws_api(self, ws: WebSocketConnection, message: str) -> None:
+        try:
+            request = json.loads(message)
+        except json.decoder.JSONDecodeError:
+            ws.send({'id': None, 'status': 400, 'error': {'code': -1100, 'msg': 'Invalid JSON.'}})
+            return
+        params = {
+            k: ('true' if v is True else 'false' if v is False else str(v))
+            for k, v in request.get('params', {}).items()
+        }
+        api_key = params.get('apiKey', '')
+        methods = {
+            'order.place': self.place_order,
+            'order.cancel': self.cancel_order,
+            'order.modify': self.modify_order,
+            'userDataStream.start': self.new_listen_key,
+            'userDataStream.ping': self.new_listen_key,
+            'userDataStream.stop': self.close_listen_key,
+        }
+        response = {'id': request.get('id')}
+        try:
+            method = methods.get(request.get('method'))
+            if not method:
+                raise FakeExchangeError(400, -1102, f'Unknown method {request.get("method")}')
+            with self.lock:
+                self.stats[f'WS {request["method"]}'] += 1
+            self.simulate()
+            headers = self.use_weight(1)
+            if request['method'].startswith('order.'):
+                headers.update(self.use_order_count(api_key))
+            response.update(status=200, result=method(api_key, params), rateLimits=[
+                {'rateLimitType': 'REQUEST_WEIGHT', 'interval': 'MINUTE', 'intervalNum': 1,
+                 'limit': self.weight_limit, 'count': int(headers['X-MBX-USED-WEIGHT-1M'])}
+            ])
+        except FakeExchangeError as e:
+            response.update(status=e.status, error={'code': e.code, 'msg': e.msg})
+        ws.send(response)
+
+    def broadcast_prices(self, stop: threading.Event) -> None:
+        while not stop.wait(1):
+            if not self.market_streams:
+                continue
+            data = self.tick_prices()
+            for ws in list(self.market_streams):
+                if ws.closed:
+                    self.market_streams.discard(ws)
+                else:
+                    ws.send(data)
+
+
+class FakeExchangeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    exchange: FakeExchange = None
+
+    def log_message(self, format, *args) -> None:
+        logger.trace(format % args)
+
+    def _send_json(self, status: int, data, headers: dict = None) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _get_params(self) -> dict:
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            body = self.rfile.read(length).decode()
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                params['_json'] = json.loads(body or '{}')
+            else:
+                params.update(parse_qsl(body))
+        return params
+
+    def _handle(self, method: str) -> None:
+        path = urlparse(self.path).path
+        if self.headers.get('Upgrade', '').lower() == 'websocket':
+            return self._upgrade(path)
+        params = self._get_params()
+        if path.startswith('/_fake/'):
+            return self._control(method, path, params)
+        exchange = self.exchange
+        route = exchange.get_routes().get((method, path))
+        if not route:
+            return self._send_json(404, {'code': -5000, 'msg': f'Path {path}, Method {method} is invalid'})
+        with exchange.lock:
+            exchange.stats[f'{method} {path}'] += 1
+        api_key = self.headers.get('X-MBX-APIKEY', '')
+        headers = {}
+        try:
+            if path not in PUBLIC_ENDPOINTS and not api_key:
+                raise FakeExchangeError(401, -2015, 'Invalid API-key, IP, or permissions for action.')
+            weight = WEIGHTS.get((method, path), 1)
+            if (method, path) in SYMBOL_WEIGHTS and params.get('symbol'):
+                weight = 1
+            headers.update(exchange.use_weight(weight))
+            if (method, path) in ORDER_ENDPOINTS:
+                count = 1
+                if 'batchOrders' in params:
+                    count = len(json.loads(params['batchOrders']))
+                headers.update(exchange.use_order_count(api_key, count))
+            exchange.simulate()
+            self._send_json(200, route(api_key, params), headers)
+        except FakeExchangeError as e:
+            self._send_json(e.status, {'code': e.code, 'msg': e.msg}, headers)
+
+    def _control(self, method: str, path: str, params: dict) -> None:
+        exchange = self.exchange
+        data = params.get('_json', {})
+        if path == '/_fake/stats':
+            return self._send_json(200, exchange.get_stats())
+        if path == '/_fake/config':
+            if method == 'POST':
+                return self._send_json(200, exchange.configure(**data))
+            return self._send_json(200, exchange.get_config())
+        if path == '/_fake/reset' and method == 'POST':
+            exchange.reset()
+            return self._send_json(200, {})
+        if path == '/_fake/user_event' and method == 'POST':
+            api_key = data.get('api_key') or next(iter(exchange.user_streams), '')
+            exchange.emit(api_key, data['event'])
+            return self._send_json(200, {'api_key': api_key})
+        self._send_json(404, {'code': -5000, 'msg': f'Path {path} is invalid'})
+
+    def _upgrade(self, path: str) -> None:
+        key = self.headers.get('Sec-WebSocket-Key', '')
+        accept = base64.b64encode(hashlib.sha1((key + WS_MAGIC).encode()).digest()).decode()
+        self.send_response(101, 'Switching Protocols')
+        self.send_header('Upgrade', 'websocket')
+        self.send_header('Connection', 'Upgrade')
+        self.send_header('Sec-WebSocket-Accept', accept)
+        self.end_headers()
+        self.close_connection = True
+        ws = WebSocketConnection(self.rfile, self.wfile)
+        exchange = self.exchange
+        if path.startswith('/ws-fapi'):
+            while (message := ws.recv()) is not None:
+                threading.Thread(target=exchange.ws_api, args=(ws, message), daemon=True).start()
+            return
+        listen_key = path.rstrip('/').split('/')[-1] if path.count('/') > 1 else ''
+        if listen_key:
+            api_key = exchange.listen_keys.get(listen_key)
+            if not api_key:
+                ws._send(struct.pack('>H', 1008), 0x8)
+                return
+            exchange.user_streams[api_key].add(ws)
+            try:
+                while ws.recv() is not None:
+                    pass
+            finally:
+                exchange.user_streams[api_key].discard(ws)
+            return
+        # listen keys subscribed on /stream, events are wrapped with the stream name
+        combined: dict[str, tuple[str, CombinedStream]] = {}
+        while (message := ws.recv()) is not None:
+            try:
+                request = json.loads(message)
+            except json.decoder.JSONDecodeError:
+                continue
+            params = request.get('params', [])
+            listen_keys = [i for i in params if i in exchange.listen_keys]
+            if request.get('method') == 'SUBSCRIBE':
+                for i in listen_keys:
+                    stream = CombinedStream(ws, i)
+                    combined[i] = (exchange.listen_keys[i], stream)
+                    exchange.user_streams[exchange.listen_keys[i]].add(stream)
+                if len(listen_keys) < len(params):
+                    exchange.market_streams.add(ws)
+            elif request.get('method') == 'UNSUBSCRIBE':
+                for i in params:
+                    if i in combined:
+                        api_key, stream = combined.pop(i)
+                        exchange.user_streams[api_key].discard(stream)
+                if len(listen_keys) < len(params):
+                    exchange.market_streams.discard(ws)
+            ws.send({'result': None, 'id': request.get('id')})
+        exchange.market_streams.discard(ws)
+        for api_key, stream in combined.values():
+            exchange.user_streams[api_key].discard(stream)
+
+    def do_GET(self) -> None:
+        self._handle('GET')
+
+    def do_POST(self) -> None:
+        self._handle('POST')
+
+    def do_PUT(self) -> None:
+        self._handle('PUT')
+
+    def do_DELETE(self) -> None:
+        self._handle('DELETE')
+
+
+class FakeExchangeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def __init__(self, address: tuple, exchange: FakeExchange) -> None:
+        handler = type('Handler', (FakeExchangeHandler,), {'exchange': exchange})
+        super().__init__(address, handler)
+        self.exchange = exchange
+        self.stop_event = threading.Event()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self) -> 'FakeExchangeServer':
+        threading.Thread(
+            target=self.exchange.broadcast_prices, args=(self.stop_event,), daemon=True
+        ).start()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.shutdown()
+        self.server_close()
@@ -1,7 +1,15 @@
 import logging
-from django.core.cache import cache
-from exchange_binance.models import Order, Symbol, Position, CopyTradeAccount
+from django.conf import settings
+from django.db import DatabaseError
+from exchange_binance.models import Order, Symbol, Position
 from exchange_binance import tasks
+from exchange_binance.registry import followers
+from exchange_binance.prices import set_market_prices
+from exchange_binance.ingest import order_writer
+from exchange_binance.position_index import open_positions
+from exchange_binance import latency
+from exchange_binance import lanes
+from exchange_binance.trade import CLOSE_WITH_FOLLOWERS_PREFIX
 from general.data import DataOrder, DataPosition
 
 
@@ -9,50 +17,87 @@ logger = logging.getLogger(__name__)
 
 
 def update_all_market_prices(data: list[dict]) -> None:
-    for i in data:
-        symbol = i['s']
-        price = i['p']
-        cache.set(f'market_price_{symbol}', price, timeout=5)
+    set_market_prices(data)
     logger.trace(f'Updated market price for {len(data)} symbols')
 
 
 def copy_trade(data: dict) -> None:
     if data['e'] == 'ORDER_TRADE_UPDATE':
-        accounts = CopyTradeAccount.objects.all()
-        for account in accounts:
-            tasks.copy_trade_order.delay(account.id, data['o'])
+        if data['o']['X'] == 'NEW':
+            # copy trade orders reference the master order row
+            order_writer.flush()
+        if data['o'].get('c', '').startswith(CLOSE_WITH_FOLLOWERS_PREFIX):
+            # the followers are closed by the same close_positions call
+            return
+        stamps = {
+            'event': data['E'],
+            'transaction': data['T'],
+            'received': data.get('_received'),
+            'dispatched': latency.now()
+        }
+        symbol = data['o']['s']
+        if settings.COPY_TRADE_FAN_OUT:
+            for queue, account_ids in lanes.group_accounts(followers.accounts(), symbol).items():
+                tasks.copy_trade_orders.apply_async(
+                    (data['o'], stamps, account_ids if queue else None), queue=queue
+                )
+            return
+        for account in followers.accounts():
+            tasks.copy_trade_order.apply_async(
+                (account.id, data['o'], stamps), queue=lanes.get_queue(account.id, symbol)
+            )
     elif data['e'] == 'ACCOUNT_CONFIG_UPDATE':
-        accounts = CopyTradeAccount.objects.all()
-        for account in accounts:
-            tasks.copy_trade_account.delay(account.id, data['ac'])
+        for account in followers.accounts():
+            tasks.copy_trade_account.apply_async(
+                (account.id, data['ac']),
+                queue=lanes.get_queue(account.id, data['ac'].get('s'))
+            )
 
 
 def positions(data: dict) -> None:
     if data['e'] != 'ACCOUNT_UPDATE':
         return
-    for i in data['a']['P']:
+    order_writer.flush()
+    items = data['a']['P']
+    symbols = {i['s'] for i in items}
+    entries = open_positions.get_many(symbols)
+    stored = Symbol.objects.in_bulk(symbols, field_name='symbol')
+    for i in items:
         p: DataPosition = DataPosition(**i)
         p.update_time = data['E']
         p.transaction_time = data['T']
-        p.symbol: Symbol = Symbol.objects.get(symbol=p.symbol)
-        if p.position_amt != 0:
-            p.position_side = 'LONG' if p.position_amt > 0 else 'SHORT'
-            p.side = 'BUY' if p.position_side == 'LONG' else 'SELL'
-            p.is_open = True
-        else:
-            p.is_open = False
-            p.mark_price = p.symbol.market_price
-        position = p.symbol.get_last_open_position()
-        if position:
-            extra = dict(symbol=p.symbol, side=position.side, id=position.id)
-            if p.position_amt == 0:
-                position.is_open = False
-                position.save()
+        entry = entries.get(p.symbol)
+        if entry and p.position_amt == 0:
+            # the index entry is trusted, the row is only written
+            position = Position(
+                id=entry['id'],
+                symbol=stored[p.symbol],
+                position_side=entry['position_side'],
+                side=entry['side'],
+                transaction_time=entry['transaction_time'],
+                is_open=False
+            )
+            try:
+                position.save(update_fields=['is_open', 'updated_at'])
+            except DatabaseError:
+                # the entry outlived its row, the position is created again
+                open_positions.remove(position)
+                entry = None
+            else:
+                extra = dict(symbol=p.symbol, side=position.side, id=position.id)
                 logger.warning(
                     f'Closed position in database {p.acummulated_realized=}',
                     extra=extra
                 )
-        else:
+        if not entry:
+            p.symbol: Symbol = stored[p.symbol]
+            if p.position_amt != 0:
+                p.position_side = 'LONG' if p.position_amt > 0 else 'SHORT'
+                p.side = 'BUY' if p.position_side == 'LONG' else 'SELL'
+                p.is_open = True
+            else:
+                p.is_open = False
+                p.mark_price = p.symbol.market_price
             position = Position.objects.create(**p.to_dict())
             extra = {'symbol': p.symbol, 'side': position.side, 'id': position.id}
             logger.warning(
@@ -76,18 +121,4 @@ def orders(data: dict) -> None:
         return
     o: DataOrder = DataOrder(**data['o'])
     o.transaction_time = data['T']
-    extra = {'symbol': o.symbol, 'side': o.side, 'id': o.order_id}
-    if Order.objects.filter(order_id=o.order_id).exists():
-        Order.objects.filter(order_id=o.order_id).update(**o.to_dict())
-        logger.info(
-            f'Updated order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
-            extra=extra
-        )
-    else:
-        o.symbol = Symbol.objects.get(symbol=o.symbol)
-        o.position = o.symbol.get_last_open_position()
-        Order.objects.create(**o.to_dict())
-        logger.debug(
-            f'Created order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
-            extra=extra
-        )
+    order_writer.add(o)
@@ -0,0 +1,107 @@
+import logging
+import threading
+import time
+from django.conf import settings
+from exchange_binance.models import Order
+from exchange_binance.position_index import open_positions
+from general.data import DataOrder
+
+
+logger = logging.getLogger(__name__)
+
+
+class OrderWriter():
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.pending = threading.Event()
+        self.buffer: dict[int, dict] = {}
+        self.thread = None
+
+    def _start(self) -> None:
+        if self.thread and self.thread.is_alive():
+            return
+        self.thread = threading.Thread(target=self._run, name='order_writer', daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self.pending.wait()
+            time.sleep(settings.ORDER_WRITER_WINDOW / 1000)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(e)
+
+    def add(self, o: DataOrder) -> None:
+        fields = o.to_dict()
+        fields['symbol_id'] = str(fields.pop('symbol'))
+        if 'position' in fields:
+            position = fields.pop('position')
+            fields['position_id'] = position.id if position else None
+        with self.lock:
+            # later events of the same order overwrite the earlier values
+            self.buffer.setdefault(fields['order_id'], {}).update(fields)
+            size = len(self.buffer)
+            self.pending.set()
+            self._start()
+        if size >= settings.ORDER_WRITER_BATCH_SIZE:
+            self.flush()
+
+    def _write(self, rows: list[dict]) -> None:
+        positions = open_positions.get_ids({i['symbol_id'] for i in rows})
+        groups: dict[frozenset, list[Order]] = {}
+        for fields in rows:
+            update_fields = frozenset(fields) - {'order_id'}
+            if 'position_id' not in fields:
+                # only a new order gets the open position, an existing keeps its own
+                fields = dict(fields, position_id=positions.get(fields['symbol_id']))
+            groups.setdefault(update_fields, []).append(Order(**fields))
+        for update_fields, orders in groups.items():
+            try:
+                Order.objects.bulk_create(
+                    orders,
+                    update_conflicts=True,
+                    unique_fields=['order_id'],
+                    update_fields=sorted(update_fields)
+                )
+            except Exception as e:
+                logger.warning(f'Batch upsert of {len(orders)} orders failed: {e}')
+                self._write_one_by_one(orders, sorted(update_fields))
+        for fields in rows:
+            logger.debug(
+                f'Upserted order in database status={fields.get("status")!r} '
+                f'orig_qty={fields.get("orig_qty")} orig_type={fields.get("orig_type")!r}',
+                extra={'symbol': fields['symbol_id'], 'side': fields.get('side'), 'id': fields['order_id']}
+            )
+
+    def _write_one_by_one(self, orders: list[Order], update_fields: list[str]) -> None:
+        for order in orders:
+            try:
+                Order.objects.bulk_create(
+                    [order],
+                    update_conflicts=True,
+                    unique_fields=['order_id'],
+                    update_fields=update_fields
+                )
+            except Exception as e:
+                logger.exception(
+                    e, extra={'symbol': order.symbol_id, 'side': order.side, 'id': order.order_id}
+                )
+
+    def flush(self) -> int:
+        with self.write_lock:
+            with self.lock:
+                rows = list(self.buffer.values())
+                self.buffer = {}
+                self.pending.clear()
+            if rows:
+                start = time.monotonic()
+                self._write(rows)
+                logger.trace(
+                    f'Flushed {len(rows)} orders in {time.monotonic() - start:.4f}s'
+                )
+            return len(rows)
+
+
+order_writer = OrderWriter()
@@ -0,0 +1,84 @@
+import logging
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+from general.utils import connection
+
+
+logger = logging.getLogger(__name__)
+
+JOB_KEY = 'job'
+JOB_HEADER = 'api_job'
+
+
+def _get_key(job_id: str) -> str:
+    return f'{JOB_KEY}:{job_id}'
+
+
+def _get_done_key(job_id: str) -> str:
+    return f'{JOB_KEY}:{job_id}:done'
+
+
+def submit(task, *args, **kwargs) -> str:
+    job_id = str(uuid.uuid4())
+    cache.set(
+        _get_key(job_id),
+        {'job_id': job_id, 'task': task.name, 'status': 'PENDING'},
+        timeout=settings.API_JOB_TTL
+    )
+    # the result is read from the cache, so nothing is sent back to the rpc backend
+    task.apply_async(
+        args, kwargs, task_id=job_id, ignore_result=True, headers={JOB_HEADER: 1}
+    )
+    return job_id
+
+
+def is_job(request) -> bool:
+    # custom headers are request attributes on a worker and stay in headers when eager
+    return bool(
+        getattr(request, JOB_HEADER, None) or
+        (getattr(request, 'headers', None) or {}).get(JOB_HEADER)
+    )
+
+
+def get(job_id: str) -> dict | None:
+    job = cache.get(_get_key(job_id))
+    if (
+        job and job['status'] == 'STARTED' and job.get('time_limit') and
+        time.time() > job['started_at'] + job['time_limit'] + 1
+    ):
+        # a task killed by its hard time limit never reports back
+        return dict(job, status='FAILURE', detail='Timeout error')
+    return job
+
+
+def wait(job_id: str, timeout: float) -> dict | None:
+    # the worker pushes to the done list when the task finishes
+    if timeout > 0:
+        connection.blpop([_get_done_key(job_id)], timeout=timeout)
+    return get(job_id)
+
+
+def set_started(job_id: str, time_limit: int | None) -> None:
+    job = cache.get(_get_key(job_id))
+    if not job:
+        return
+    job.update(status='STARTED', started_at=time.time(), time_limit=time_limit)
+    cache.set(_get_key(job_id), job, timeout=settings.API_JOB_TTL)
+
+
+def set_finished(job_id: str, state: str, retval) -> None:
+    job = cache.get(_get_key(job_id))
+    if not job:
+        return
+    job['status'] = state
+    if state == 'SUCCESS':
+        job['result'] = retval
+    else:
+        job['detail'] = str(retval)
+    cache.set(_get_key(job_id), job, timeout=settings.API_JOB_TTL)
+    pipe = connection.pipeline(transaction=False)
+    pipe.lpush(_get_done_key(job_id), 1)
+    pipe.expire(_get_done_key(job_id), 60)
+    pipe.execute()
@@ -0,0 +1,48 @@
+import bisect
+import hashlib
+from django.conf import settings
+
+
+LANE_QUEUE_PREFIX = 'copy_lane'
+VIRTUAL_NODES = 64
+
+
+class LaneRing():
+    def __init__(self, lanes: int) -> None:
+        # virtual nodes spread the keys evenly, and changing the number of lanes
+        # only moves the keys of the added or removed lanes
+        points = sorted(
+            (self._hash(f'{LANE_QUEUE_PREFIX}_{lane}#{i}'), lane)
+            for lane in range(lanes) for i in range(VIRTUAL_NODES)
+        )
+        self.points = [i[0] for i in points]
+        self.lanes = [i[1] for i in points]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], 'big')
+
+    def get(self, key: str) -> int:
+        index = bisect.bisect(self.points, self._hash(key)) % len(self.points)
+        return self.lanes[index]
+
+
+_rings: dict[int, LaneRing] = {}
+
+
+def get_queue(account_id: int, symbol: str) -> str | None:
+    # all copy tasks of one (follower, symbol) go to the same queue, which is
+    # consumed by a single worker process, so they run in the order they were sent
+    lanes = settings.COPY_LANES
+    if not lanes:
+        return None
+    if lanes not in _rings:
+        _rings[lanes] = LaneRing(lanes)
+    return f'{LANE_QUEUE_PREFIX}_{_rings[lanes].get(f"{account_id}:{symbol}")}'
+
+
+def group_accounts(accounts: list, symbol: str) -> dict[str | None, list[int]]:
+    groups = {}
+    for account in accounts:
+        groups.setdefault(get_queue(account.id, symbol), []).append(account.id)
+    return groups
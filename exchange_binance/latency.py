@@ -0,0 +1,107 @@
+import logging
+import time
+from general.utils import connection
+
+
+logger = logging.getLogger(__name__)
+
+LATENCY_KEY = 'latency'
+LATENCY_TIMEOUT = 60 * 60 * 24 * 7
+# upper bounds of the histogram buckets in milliseconds, the last one is open
+BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000]
+# stage name: (from stamp, to stamp)
+STAGES = {
+    'receive': ('event', 'received'),
+    'dispatch': ('received', 'dispatched'),
+    'queue': ('dispatched', 'task_start'),
+    'prepare': ('task_start', 'sent'),
+    'exchange': ('sent', 'ack'),
+    'total': ('event', 'ack'),
+}
+
+
+def now() -> float:
+    return time.time() * 1000
+
+
+def stamp(stamps: dict | None, name: str) -> None:
+    if stamps is not None:
+        stamps[name] = now()
+
+
+def get_bucket(value: float) -> int:
+    for index, bound in enumerate(BUCKETS):
+        if value <= bound:
+            return index
+    return len(BUCKETS)
+
+
+def get_durations(stamps: dict) -> dict[str, float]:
+    durations = {}
+    for stage, (start, end) in STAGES.items():
+        if stamps.get(start) and stamps.get(end):
+            durations[stage] = max(stamps[end] - stamps[start], 0)
+    return durations
+
+
+def record(account_id: int, symbol: str, stamps: dict, egress: str = None) -> None:
+    durations = get_durations(stamps)
+    if not durations:
+        return
+    scopes = ['all', f'account:{account_id}', f'symbol:{symbol}']
+    if egress:
+        scopes.append(f'egress:{egress}')
+    try:
+        pipe = connection.pipeline(transaction=False)
+        for scope in scopes:
+            for stage, value in durations.items():
+                key = f'{LATENCY_KEY}:{scope}:{stage}'
+                pipe.hincrby(key, get_bucket(value), 1)
+                pipe.hincrby(key, 'count', 1)
+                pipe.hincrbyfloat(key, 'sum', value)
+                pipe.expire(key, LATENCY_TIMEOUT)
+        pipe.execute()
+    except Exception as e:
+        logger.exception(e, extra={'account': account_id, 'symbol': symbol})
+
+
+def get_percentile(counts: list[int], total: int, q: float) -> float:
+    rank = q * total
+    cumulative = 0
+    for index, count in enumerate(counts):
+        if count and cumulative + count >= rank:
+            lower = BUCKETS[index - 1] if index else 0
+            upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+            return round(lower + (upper - lower) * (rank - cumulative) / count, 3)
+        cumulative += count
+    return float(BUCKETS[-1])
+
+
+def get_histogram(key: str) -> dict:
+    data = {k.decode(): v for k, v in connection.hgetall(key).items()}
+    total = int(data.get('count', 0))
+    counts = [int(data.get(str(i), 0)) for i in range(len(BUCKETS) + 1)]
+    if not total:
+        return {'count': 0}
+    return {
+        'count': total,
+        'avg': round(float(data.get('sum', 0)) / total, 3),
+        'p50': get_percentile(counts, total, 0.50),
+        'p95': get_percentile(counts, total, 0.95),
+        'p99': get_percentile(counts, total, 0.99),
+    }
+
+
+def get_report(scope: str = '') -> dict:
+    report = {}
+    for key in connection.scan_iter(match=f'{LATENCY_KEY}:{scope}*', count=1000):
+        key = key.decode()
+        _, *name, stage = key.split(':')
+        report.setdefault(':'.join(name), {})[stage] = get_histogram(key)
+    return dict(sorted(report.items()))
+
+
+def reset() -> None:
+    keys = list(connection.scan_iter(match=f'{LATENCY_KEY}:*', count=1000))
+    if keys:
+        connection.delete(*keys)
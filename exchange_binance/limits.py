@@ -0,0 +1,285 @@
+import hashlib
+import json
+import logging
+import time
+from urllib.parse import urlsplit, parse_qsl
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from general.utils import connection
+from general.exceptions import LimitUsageException
+
+
+logger = logging.getLogger(__name__)
+
+WEIGHT_KEY = 'binance_weight'
+DIRECT = 'direct'
+# share of the weight limit each priority may use, lower priorities are throttled first
+PRIORITIES = {
+    'critical': 1.0,
+    'trade': 0.9,
+    'poll': 0.7,
+}
+PROTECTIVE_TYPES = {
+    'STOP', 'STOP_MARKET', 'TAKE_PROFIT', 'TAKE_PROFIT_MARKET', 'TRAILING_STOP_MARKET'
+}
+# (method, path): (weight, weight without symbol)
+WEIGHTS = {
+    ('POST', '/fapi/v1/order'): (0, 0),
+    ('POST', '/fapi/v1/batchOrders'): (5, 5),
+    ('GET', '/fapi/v1/openOrders'): (1, 40),
+    ('GET', '/fapi/v1/allOrders'): (5, 5),
+    ('GET', '/fapi/v1/ticker/24hr'): (1, 40),
+    ('GET', '/fapi/v1/ticker/price'): (1, 2),
+    ('GET', '/fapi/v1/userTrades'): (5, 5),
+    ('GET', '/fapi/v1/income'): (30, 30),
+    ('GET', '/fapi/v2/account'): (5, 5),
+    ('GET', '/fapi/v3/account'): (5, 5),
+    ('GET', '/fapi/v2/balance'): (5, 5),
+    ('GET', '/fapi/v3/balance'): (5, 5),
+    ('GET', '/fapi/v2/positionRisk'): (5, 5),
+    ('GET', '/fapi/v3/positionRisk'): (5, 5),
+}
+# sliding window over the current and the previous minute,
+# returns the estimated weight that was used, negative when the request is denied
+ACQUIRE_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local weight = tonumber(ARGV[1])
+local allowed = tonumber(ARGV[2])
+local used = current + previous * (1 - tonumber(ARGV[3]))
+if weight > 0 and used + weight > allowed then
+    return -math.floor(used) - 1
+end
+redis.call('INCRBY', KEYS[1], weight)
+redis.call('EXPIRE', KEYS[1], 120)
+return math.floor(used + weight)
+"""
+# fixed windows of 10 seconds and 1 minute per account, like binance counts them,
+# returns 0 when the orders are reserved or the number of ms until the first full window ends
+ORDER_ACQUIRE_SCRIPT = """
+local count = tonumber(ARGV[1])
+for i = 1, 2 do
+    local used = tonumber(redis.call('GET', KEYS[i]) or '0')
+    if used + count > tonumber(ARGV[i + 1]) then
+        return tonumber(ARGV[i + 3])
+    end
+end
+for i = 1, 2 do
+    redis.call('INCRBY', KEYS[i], count)
+    redis.call('EXPIRE', KEYS[i], 120)
+end
+return 0
+"""
+UPDATE_SCRIPT = """
+for i, key in ipairs(KEYS) do
+    local current = tonumber(redis.call('GET', key) or '0')
+    if tonumber(ARGV[i]) > current then
+        redis.call('SET', key, ARGV[i], 'EX', 120)
+    end
+end
+"""
+ORDER_PATHS = {'/fapi/v1/order', '/fapi/v1/batchOrders'}
+
+
+def get_egress(proxy: str | None) -> str:
+    if not proxy:
+        return DIRECT
+    url = urlsplit(proxy if '://' in proxy else f'http://{proxy}')
+    return f'{url.hostname}:{url.port}' if url.port else str(url.hostname)
+
+
+def get_account_egress(account) -> str:
+    if account.is_master:
+        return DIRECT
+    return get_egress(account.proxy if account.use_proxy else None)
+
+
+def is_protective(params: dict) -> bool:
+    return (
+        str(params.get('reduceOnly')).lower() == 'true' or
+        str(params.get('closePosition')).lower() == 'true' or
+        params.get('type') in PROTECTIVE_TYPES
+    )
+
+
+def get_priority(method: str, path: str, params: dict) -> str:
+    if method == 'DELETE':
+        return 'critical'
+    if path == '/fapi/v1/batchOrders' and method == 'POST':
+        try:
+            orders = json.loads(params.get('batchOrders', '[]'))
+        except json.decoder.JSONDecodeError:
+            orders = []
+        if orders and all(is_protective(i) for i in orders):
+            return 'critical'
+        return 'trade'
+    if path == '/fapi/v1/order' and method in ('POST', 'PUT'):
+        return 'critical' if is_protective(params) else 'trade'
+    if method in ('POST', 'PUT') or path == '/fapi/v1/order':
+        return 'trade'
+    return 'poll'
+
+
+def get_weight(method: str, path: str, params: dict) -> int:
+    weight, weight_all = WEIGHTS.get((method, path), (1, 1))
+    return weight if params.get('symbol') else weight_all
+
+
+class WeightLimiter():
+    def __init__(self) -> None:
+        self.acquire_script = connection.register_script(ACQUIRE_SCRIPT)
+        self.update_script = connection.register_script(UPDATE_SCRIPT)
+
+    @staticmethod
+    def _get_keys(egress: str, now: float) -> list[str]:
+        minute = int(now // 60)
+        return [f'{WEIGHT_KEY}:{egress}:{minute}', f'{WEIGHT_KEY}:{egress}:{minute - 1}']
+
+    def try_acquire(self, egress: str, weight: int, priority: str) -> int:
+        now = time.time()
+        allowed = settings.BINANCE_WEIGHT_LIMIT * PRIORITIES[priority]
+        return self.acquire_script(
+            keys=self._get_keys(egress, now), args=[weight, allowed, now % 60 / 60]
+        )
+
+    def acquire(self, egress: str, weight: int, priority: str) -> None:
+        # trade requests wait a little for the window to slide, polling gives up at once
+        deadline = time.monotonic() + (
+            settings.BINANCE_WEIGHT_WAIT if priority == 'trade' else 0
+        )
+        while True:
+            try:
+                used = self.try_acquire(egress, weight, priority)
+            except Exception as e:
+                logger.warning(f'Weight limiter is unavailable: {e!r}')
+                return
+            if used >= 0 or priority == 'critical':
+                return
+            if time.monotonic() >= deadline:
+                raise LimitUsageException(
+                    f'Weight limit for {priority} requests is reached on {egress}: '
+                    f'used {-used - 1} of {settings.BINANCE_WEIGHT_LIMIT}'
+                )
+            time.sleep(0.05)
+
+    def update(self, egress: str, used: int) -> None:
+        try:
+            self.update_script(keys=self._get_keys(egress, time.time())[:1], args=[used])
+        except Exception as e:
+            logger.warning(f'Weight limiter is unavailable: {e!r}')
+
+    def get_usage(self, egress: str = DIRECT) -> int:
+        now = time.time()
+        current, previous = connection.mget(self._get_keys(egress, now))
+        return int(int(current or 0) + int(previous or 0) * (1 - now % 60 / 60))
+
+
+limiter = WeightLimiter()
+
+
+class OrderRateLimiter():
+    def __init__(self) -> None:
+        self.acquire_script = connection.register_script(ORDER_ACQUIRE_SCRIPT)
+        self.update_script = connection.register_script(UPDATE_SCRIPT)
+
+    @staticmethod
+    def _get_keys(api_key: str, now: float) -> list[str]:
+        account = hashlib.sha1(api_key.encode()).hexdigest()[:16]
+        return [
+            f'binance_orders:{account}:10s:{int(now // 10)}',
+            f'binance_orders:{account}:1m:{int(now // 60)}',
+        ]
+
+    def acquire(self, api_key: str, count: int, reducing: bool) -> None:
+        # orders that open exposure leave headroom for the ones that reduce it.
+        # Excess orders wait for the window to roll over and are sent anyway
+        # after BINANCE_ORDER_WAIT, so a burst is delayed but not failed
+        share = 1.0 if reducing else settings.BINANCE_ORDER_SHARE
+        deadline = time.monotonic() + settings.BINANCE_ORDER_WAIT
+        while True:
+            now = time.time()
+            try:
+                wait = self.acquire_script(
+                    keys=self._get_keys(api_key, now),
+                    args=[
+                        count,
+                        int(settings.BINANCE_ORDER_LIMIT_10S * share),
+                        int(settings.BINANCE_ORDER_LIMIT_1M * share),
+                        int((10 - now % 10) * 1000) + 1,
+                        int((60 - now % 60) * 1000) + 1,
+                    ]
+                )
+            except Exception as e:
+                logger.warning(f'Order rate limiter is unavailable: {e!r}')
+                return
+            if not wait:
+                return
+            left = deadline - time.monotonic()
+            if left <= 0:
+                logger.warning(
+                    f'Order rate limit is reached, sending {count} orders anyway',
+                    extra={'symbol': api_key[:8]}
+                )
+                return
+            time.sleep(min(wait / 1000, left))
+
+    def update(self, api_key: str, count_10s: int | None, count_1m: int | None) -> None:
+        keys = self._get_keys(api_key, time.time())
+        counts = [count_10s, count_1m]
+        keys = [k for k, v in zip(keys, counts) if v is not None]
+        if not keys:
+            return
+        try:
+            self.update_script(keys=keys, args=[int(i) for i in counts if i is not None])
+        except Exception as e:
+            logger.warning(f'Order rate limiter is unavailable: {e!r}')
+
+    def update_from_rate_limits(self, api_key: str, rate_limits: list[dict]) -> None:
+        counts = {
+            (i.get('interval'), i.get('intervalNum')): i.get('count')
+            for i in rate_limits if i.get('rateLimitType') == 'ORDERS'
+        }
+        self.update(api_key, counts.get(('SECOND', 10)), counts.get(('MINUTE', 1)))
+
+
+order_limiter = OrderRateLimiter()
+
+
+def get_order_count(method: str, path: str, params: dict) -> int:
+    if method not in ('POST', 'PUT') or path not in ORDER_PATHS:
+        return 0
+    if path == '/fapi/v1/batchOrders':
+        try:
+            return len(json.loads(params.get('batchOrders', '[]')))
+        except json.decoder.JSONDecodeError:
+            return 0
+    return 1
+
+
+class LimitedAdapter(HTTPAdapter):
+    def __init__(self, egress: str, *args, **kwargs) -> None:
+        self.egress = egress
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        url = urlsplit(request.url)
+        params = dict(parse_qsl(url.query))
+        priority = get_priority(request.method, url.path, params)
+        api_key = request.headers.get('X-MBX-APIKEY')
+        orders = get_order_count(request.method, url.path, params)
+        if orders and api_key:
+            order_limiter.acquire(api_key, orders, priority == 'critical')
+        limiter.acquire(self.egress, get_weight(request.method, url.path, params), priority)
+        response = super().send(request, *args, **kwargs)
+        used = response.headers.get('X-MBX-USED-WEIGHT-1M')
+        if response.status_code in (418, 429):
+            used = settings.BINANCE_WEIGHT_LIMIT
+        if used:
+            limiter.update(self.egress, int(used))
+        if api_key and 'X-MBX-ORDER-COUNT-10S' in response.headers:
+            order_limiter.update(
+                api_key,
+                response.headers.get('X-MBX-ORDER-COUNT-10S'),
+                response.headers.get('X-MBX-ORDER-COUNT-1M')
+            )
+        return response
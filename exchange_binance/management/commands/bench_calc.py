@@ -0,0 +1,105 @@
+import time
+import timeit
+from decimal import Decimal, ROUND_DOWN
+from django.core.management.base import BaseCommand
+from exchange_binance.models import Symbol
+from exchange_binance import calc
+
+
+SYMBOL_DATA = {
+    'symbol': 'BTCUSDT',
+    'pricePrecision': 2,
+    'quantityPrecision': 3,
+    'filters': [
+        {'filterType': 'PRICE_FILTER', 'tickSize': '0.10', 'minPrice': '556.80', 'maxPrice': '4529764'},
+        {'filterType': 'LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001', 'maxQty': '1000'},
+        {'filterType': 'MARKET_LOT_SIZE', 'stepSize': '0.001', 'minQty': '0.001', 'maxQty': '120'},
+        {'filterType': 'MAX_NUM_ORDERS', 'limit': 200},
+        {'filterType': 'MIN_NOTIONAL', 'notional': '100'},
+    ]
+}
+
+
+def legacy_price_to_precision(symbol: Symbol, price: float) -> str:
+    tick_size = symbol.data['filters'][0]['tickSize'].rstrip('0').rstrip('.')
+    price_str = str(
+        Decimal(price).quantize(Decimal(tick_size), rounding=ROUND_DOWN)
+    )
+    return price_str.rstrip('0').rstrip('.')
+
+
+def reference_price_to_precision(tick_size: str, price: float) -> str:
+    # the decimal the float prints as, not its binary value
+    tick_size = Decimal(tick_size)
+    value = (Decimal(repr(price)) / tick_size).to_integral_value(rounding=ROUND_DOWN) * tick_size
+    return f'{value.normalize():f}'
+
+
+def legacy_quantity_to_precision(symbol: Symbol, quantity: float) -> str:
+    precision = symbol.data['quantityPrecision']
+    quantity_str = f'{quantity:.{precision}f}'
+    if '.' in quantity_str:
+        return quantity_str.rstrip('0').rstrip('.')
+    return quantity_str
+
+
+class Command(BaseCommand):
+    help = 'Compare precision helpers against the previous Symbol.data parsing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=100000, help='Calls per case')
+
+    def _report(self, name: str, legacy: float, compiled: float) -> None:
+        self.stdout.write(
+            f'{name:<24} legacy={legacy:.3f}s compiled={compiled:.3f}s '
+            f'speedup={legacy / compiled:.2f}x'
+        )
+
+    def _check_ticks(self) -> None:
+        # integer ticks and ticks below 1e-4, the legacy code stripped real zeros,
+        # 84410 came back as '8441' and a '10' tick was read as '1'
+        cases = [
+            ('0.10', 84412.37), ('0.01', 84412.3), ('0.1', 0.3), ('1', 84410.0),
+            ('1', 84412.37), ('10', 84412.37), ('100', 84412.37), ('0.05', 1.2399),
+            ('0.00001', 0.1234567), ('0.0000001', 0.000123456789),
+        ]
+        for tick_size, price in cases:
+            data = dict(
+                SYMBOL_DATA, symbol=f'TICK{tick_size}',
+                filters=[{'filterType': 'PRICE_FILTER', 'tickSize': tick_size}]
+            )
+            symbol = Symbol(symbol=data['symbol'], data=data)
+            calc.symbol_rules.rules[symbol.symbol] = calc.SymbolRules.from_data(data)
+            compiled = calc.price_to_precision(symbol, price)
+            expected = reference_price_to_precision(tick_size, price)
+            self.stdout.write(
+                f'tick={tick_size:<10} price={price:<16} expected={expected:<14} '
+                f'compiled={compiled:<14} legacy={legacy_price_to_precision(symbol, price):<14} '
+                f'{"ok" if compiled == expected else "MISMATCH"}'
+            )
+
+    def handle(self, *args, **options):
+        number = options['number']
+        symbol = Symbol(symbol=SYMBOL_DATA['symbol'], data=SYMBOL_DATA)
+        calc.symbol_rules.checked_at = time.monotonic() + 3600
+        calc.symbol_rules.rules[symbol.symbol] = calc.SymbolRules.from_data(symbol.data)
+        price = 67123.456789
+        quantity = 0.0123456
+        self._report(
+            'price_to_precision',
+            timeit.timeit(lambda: legacy_price_to_precision(symbol, price), number=number),
+            timeit.timeit(lambda: calc.price_to_precision(symbol, price), number=number)
+        )
+        self._report(
+            'quantity_to_precision',
+            timeit.timeit(lambda: legacy_quantity_to_precision(symbol, quantity), number=number),
+            timeit.timeit(lambda: calc.quantity_to_precision(symbol, quantity), number=number)
+        )
+        quantities = [quantity * (i + 1) for i in range(1000)]
+        mismatches = [
+            i for i in quantities
+            if reference_price_to_precision('0.1', i * 1000) != calc.price_to_precision(symbol, i * 1000)
+            or legacy_quantity_to_precision(symbol, i) != calc.quantity_to_precision(symbol, i)
+        ]
+        self.stdout.write(f'Mismatching results: {len(mismatches)}')
+        self._check_ticks()
@@ -0,0 +1,262 @@
+import itertools
+import json
+import statistics
+import time
+from datetime import datetime, timezone
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from copy_trade.celery import app
+from exchange_binance.models import (
+    Symbol, Order, MainSettings, CopyTradeAccount, CopyTradeOrder
+)
+from exchange_binance.fake_exchange import FakeExchange, FakeExchangeServer
+from exchange_binance.registry import followers
+from exchange_binance import handlers, latency
+
+
+BENCH_PREFIX = 'bench_'
+# far above real Binance order ids, so master orders never collide
+MASTER_ORDER_ID = 900_000_000_000_000
+OPS_KEYS = [
+    'POST /fapi/v1/order', 'DELETE /fapi/v1/order', 'WS order.place', 'WS order.cancel'
+]
+
+
+def make_event(order_id: int, status: str, order_type: str, side: str, **kwargs) -> dict:
+    now = int(time.time() * 1000)
+    return {
+        'e': 'ORDER_TRADE_UPDATE', 'E': now, 'T': now,
+        'o': {
+            's': kwargs.get('symbol', 'BTCUSDT'), 'c': f'{BENCH_PREFIX}{order_id}',
+            'S': side, 'o': order_type, 'f': 'GTC', 'q': kwargs.get('quantity', '0.010'),
+            'p': kwargs.get('price', '0'), 'ap': '0', 'sp': kwargs.get('stop_price', '0'),
+            'x': status, 'X': status, 'i': order_id, 'l': '0', 'z': '0', 'L': '0',
+            'n': '0', 'N': 'USDT', 'T': now, 't': 0, 'b': '0', 'a': '0', 'm': False,
+            'R': False, 'wt': 'CONTRACT_PRICE', 'ot': order_type, 'ps': 'BOTH',
+            'cp': False, 'rp': '0', 'pP': False, 'si': 0, 'ss': 0, 'V': 'NONE',
+            'pm': 'NONE', 'gtd': 0
+        }
+    }
+
+
+def make_script(rounds: int) -> list[dict]:
+    order_ids = itertools.count(MASTER_ORDER_ID + int(time.time()) * 1000)
+    script = []
+    for _ in range(rounds):
+        limit_id, market_id, stop_id = next(order_ids), next(order_ids), next(order_ids)
+        script += [
+            make_event(limit_id, 'NEW', 'LIMIT', 'BUY', price='50000'),
+            make_event(limit_id, 'CANCELED', 'LIMIT', 'BUY', price='50000'),
+            make_event(market_id, 'NEW', 'MARKET', 'BUY'),
+            make_event(stop_id, 'NEW', 'STOP_MARKET', 'SELL', stop_price='55000'),
+            make_event(stop_id, 'CANCELED', 'STOP_MARKET', 'SELL', stop_price='55000'),
+        ]
+    return script
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return round(values[min(int(q * len(values)), len(values) - 1)], 3)
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay scripted master ORDER_TRADE_UPDATE events into handlers.copy_trade '
+        'against the fake exchange and report throughput and latency per follower count'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, nargs='+', default=[10, 100, 1000, 5000])
+        parser.add_argument('--rounds', type=int, default=2, help='Each round is 5 events')
+        parser.add_argument(
+            '--exchange-url',
+            help='Use a running fake_exchange instead of starting one in process. '
+            'Required with --no-eager, the workers must point at the same exchange'
+        )
+        parser.add_argument('--latency', type=float, default=20.0, help='Milliseconds')
+        parser.add_argument('--jitter', type=float, default=10.0, help='Milliseconds')
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument(
+            '--no-eager', action='store_true',
+            help='Send tasks to the broker instead of running them in process'
+        )
+        parser.add_argument('--timeout', type=float, default=300, help='Seconds per event')
+        parser.add_argument('--output', default='bench_copy_trade.json')
+        parser.add_argument('--baseline', help='Previous result file to compare with')
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed throughput drop or p95 growth against the baseline'
+        )
+        parser.add_argument('--keep', action='store_true', help='Keep benchmark rows')
+
+    def get_stats(self, url: str) -> dict:
+        return requests.get(f'{url}/_fake/stats', timeout=5).json()
+
+    def get_ops(self, url: str) -> int:
+        requests_stats = self.get_stats(url)['requests']
+        return sum(requests_stats.get(i, 0) for i in OPS_KEYS)
+
+    def setup_symbol(self, url: str) -> None:
+        data = requests.get(f'{url}/fapi/v1/exchangeInfo', timeout=5).json()
+        data = next(i for i in data['symbols'] if i['symbol'] == 'BTCUSDT')
+        Symbol.objects.update_or_create(symbol='BTCUSDT', defaults={'data': data})
+        if not MainSettings.objects.exists():
+            MainSettings().save()
+
+    def setup_followers(self, count: int) -> None:
+        self.cleanup()
+        CopyTradeAccount.objects.bulk_create(
+            [
+                CopyTradeAccount(
+                    name=f'{BENCH_PREFIX}{i}',
+                    api_key=f'{BENCH_PREFIX}key_{i}',
+                    api_secret=f'{BENCH_PREFIX}secret_{i}'
+                )
+                for i in range(count)
+            ],
+            batch_size=1000
+        )
+        followers.invalidate()
+
+    def cleanup(self) -> None:
+        CopyTradeOrder.objects.filter(
+            copy_trade_account__name__startswith=BENCH_PREFIX
+        ).delete()
+        CopyTradeAccount.objects.filter(name__startswith=BENCH_PREFIX).delete()
+        Order.objects.filter(client_order_id__startswith=BENCH_PREFIX).delete()
+        followers.invalidate()
+
+    def run_scale(self, url: str, count: int, rounds: int, timeout: float) -> dict:
+        self.setup_followers(count)
+        latency.reset()
+        stats = self.get_stats(url)
+        script = make_script(rounds)
+        durations = []
+        failed_events = 0
+        started_at = time.monotonic()
+        for event in script:
+            expected = self.get_ops(url) + count
+            event['E'] = event['T'] = event['o']['T'] = int(time.time() * 1000)
+            event['_received'] = latency.now()
+            handlers.orders(event)
+            start = time.monotonic()
+            handlers.copy_trade(event)
+            deadline = start + timeout
+            while self.get_ops(url) < expected:
+                if time.monotonic() > deadline:
+                    failed_events += 1
+                    break
+                time.sleep(0.01)
+            durations.append((time.monotonic() - start) * 1000)
+        elapsed = time.monotonic() - started_at
+        end_stats = self.get_stats(url)
+        ops = sum(
+            end_stats['requests'].get(i, 0) - stats['requests'].get(i, 0) for i in OPS_KEYS
+        )
+        copied = CopyTradeOrder.objects.filter(
+            copy_trade_account__name__startswith=BENCH_PREFIX
+        ).count()
+        return {
+            'followers': count,
+            'events': len(script),
+            'follower_ops': ops,
+            'copied_orders': copied,
+            'errors': end_stats['requests'].get('errors', 0) - stats['requests'].get('errors', 0),
+            'timed_out_events': failed_events,
+            'elapsed': round(elapsed, 3),
+            'throughput': round(ops / elapsed, 2) if elapsed else 0,
+            'event_ms': {
+                'mean': round(statistics.mean(durations), 3),
+                'p50': percentile(durations, 0.50),
+                'p95': percentile(durations, 0.95),
+                'max': round(max(durations), 3),
+            },
+            'latency_ms': latency.get_report('all').get('all', {}),
+        }
+
+    def compare(self, results: list[dict], baseline: dict, threshold: float) -> list[str]:
+        previous = {i['followers']: i for i in baseline.get('results', [])}
+        regressions = []
+        for i in results:
+            old = previous.get(i['followers'])
+            if not old:
+                continue
+            if i['throughput'] < old['throughput'] * (1 - threshold):
+                regressions.append(
+                    f'{i["followers"]} followers: throughput '
+                    f'{old["throughput"]} -> {i["throughput"]} ops/s'
+                )
+            old_p95 = old['latency_ms'].get('total', {}).get('p95')
+            new_p95 = i['latency_ms'].get('total', {}).get('p95')
+            if old_p95 and new_p95 and new_p95 > old_p95 * (1 + threshold):
+                regressions.append(
+                    f'{i["followers"]} followers: total p95 {old_p95} -> {new_p95} ms'
+                )
+        return regressions
+
+    def handle(self, *args, **options):
+        others = CopyTradeAccount.objects.exclude(name__startswith=BENCH_PREFIX)
+        if others.filter(is_active=True).exists():
+            raise CommandError(
+                'Active copy trade accounts exist. Run the benchmark on a separate database'
+            )
+        if options['no_eager'] and not options['exchange_url']:
+            raise CommandError('--no-eager requires --exchange-url')
+        server = None
+        url = options['exchange_url']
+        if not url:
+            exchange = FakeExchange(
+                latency=options['latency'],
+                jitter=options['jitter'],
+                error_rate=options['error_rate'],
+                weight_limit=10 ** 9,
+                order_limit=10 ** 9
+            )
+            server = FakeExchangeServer(('127.0.0.1', 0), exchange).start()
+            url = server.url
+        settings.BINANCE_BASE_URL = url
+        app.conf.task_always_eager = not options['no_eager']
+        exchange_config = requests.get(f'{url}/_fake/config', timeout=5).json()
+        results = []
+        try:
+            self.setup_symbol(url)
+            for count in options['followers']:
+                self.stdout.write(f'Running {count} followers...')
+                result = self.run_scale(url, count, options['rounds'], options['timeout'])
+                results.append(result)
+                total = result['latency_ms'].get('total', {})
+                self.stdout.write(
+                    f'{count:>6} followers: {result["throughput"]:>9} ops/s, '
+                    f'event p50 {result["event_ms"]["p50"]} ms, '
+                    f'follower total p50 {total.get("p50")} p95 {total.get("p95")} '
+                    f'p99 {total.get("p99")} ms, errors {result["errors"]}'
+                )
+        finally:
+            if not options['keep']:
+                self.cleanup()
+            if server:
+                server.stop()
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'config': {
+                'fan_out': settings.COPY_TRADE_FAN_OUT,
+                'max_workers': settings.COPY_TRADE_MAX_WORKERS,
+                'transport': settings.COPY_TRADE_TRANSPORT,
+                'eager': not options['no_eager'],
+                'rounds': options['rounds'],
+                'exchange': exchange_config,
+            },
+            'results': results,
+        }
+        with open(options['output'], 'w') as f:
+            json.dump(report, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'Results are written to {options["output"]}'))
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                regressions = self.compare(results, json.load(f), options['threshold'])
+            if regressions:
+                raise CommandError('Regressions found:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
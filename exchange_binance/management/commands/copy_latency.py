@@ -0,0 +1,42 @@
+import json
+from django.core.management.base import BaseCommand
+from exchange_binance import latency
+
+
+class Command(BaseCommand):
+    help = 'Show copy trade latency percentiles per follower and per symbol'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scope', default='',
+            help='Filter by scope, e.g. "account", "account:1", "symbol:BTCUSDT", "egress"'
+        )
+        parser.add_argument(
+            '--stage', default='total', choices=list(latency.STAGES) + ['all'],
+        )
+        parser.add_argument('--json', action='store_true')
+        parser.add_argument('--reset', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            latency.reset()
+            self.stdout.write(self.style.SUCCESS('Latency histograms are reset'))
+            return
+        report = latency.get_report(options['scope'])
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        stages = list(latency.STAGES) if options['stage'] == 'all' else [options['stage']]
+        self.stdout.write(
+            f'{"scope":<24} {"stage":<10} {"count":>8} {"avg":>10} '
+            f'{"p50":>10} {"p95":>10} {"p99":>10}'
+        )
+        for scope, data in report.items():
+            for stage in stages:
+                i = data.get(stage)
+                if not i or not i['count']:
+                    continue
+                self.stdout.write(
+                    f'{scope:<24} {stage:<10} {i["count"]:>8} {i["avg"]:>10} '
+                    f'{i["p50"]:>10} {i["p95"]:>10} {i["p99"]:>10}'
+                )
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from exchange_binance.fake_exchange import FakeExchange, FakeExchangeServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local stand-in for the Binance USD-M futures REST, stream and '
+        'ws-fapi endpoints. Point BINANCE_BASE_URL, BINANCE_WS_URL and '
+        'BINANCE_WS_API_URL at it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8800)
+        parser.add_argument('--latency', type=float, default=0.0, help='Milliseconds')
+        parser.add_argument('--jitter', type=float, default=0.0, help='Milliseconds')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='From 0 to 1')
+        parser.add_argument('--weight-limit', type=int, default=2400, help='Per minute')
+        parser.add_argument('--order-limit', type=int, default=300, help='Per 10 seconds')
+        parser.add_argument('--balance', type=float, default=10000.0)
+        parser.add_argument('--extra-symbols', type=int, default=0)
+
+    def handle(self, *args, **options):
+        exchange = FakeExchange(
+            latency=options['latency'],
+            jitter=options['jitter'],
+            error_rate=options['error_rate'],
+            weight_limit=options['weight_limit'],
+            order_limit=options['order_limit'],
+            balance=options['balance'],
+            extra_symbols=options['extra_symbols']
+        )
+        host, port = options['host'], options['port']
+        server = FakeExchangeServer((host, port), exchange).start()
+        self.stdout.write(self.style.SUCCESS(
+            f'Fake exchange is listening on {host}:{port}\n'
+            f'BINANCE_BASE_URL=http://{host}:{port}\n'
+            f'BINANCE_WS_URL=ws://{host}:{port}/ws\n'
+            f'BINANCE_WS_API_URL=ws://{host}:{port}/ws-fapi/v1\n'
+            'Control: GET /_fake/stats, GET|POST /_fake/config, '
+            'POST /_fake/reset, POST /_fake/user_event'
+        ))
+        try:
+            server.stop_event.wait()
+        except KeyboardInterrupt:
+            server.stop()
@@ -0,0 +1,16 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from exchange_binance.streams import FollowerStreamManager
+
+
+class Command(BaseCommand):
+    help = (
+        'Hold a user data stream for every active copy trade account and write '
+        'their order updates and wallet balances to the database'
+    )
+
+    def handle(self, *args, **options):
+        try:
+            asyncio.run(FollowerStreamManager().run())
+        except KeyboardInterrupt:
+            pass
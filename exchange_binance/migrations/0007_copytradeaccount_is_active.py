@@ -0,0 +1,18 @@
+# Generated by Django 5.0.4 on 2026-10-17 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchange_binance', '0006_mainsettings_coefficient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='copytradeaccount',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Is active'),
+        ),
+    ]
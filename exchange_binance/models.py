@@ -1,5 +1,6 @@
+from functools import cached_property
 from django.db import models
-from django.core.cache import cache
+from exchange_binance.prices import get_market_price
 
 
 class BaseModel(models.Model):
@@ -25,8 +26,15 @@ class Symbol(BaseModel):
 
     @property
     def market_price(self) -> float:
-        market_price = cache.get(f'market_price_{self.symbol}')
-        return float(market_price) if market_price else 0.0
+        if hasattr(self, '_market_price'):
+            return self._market_price
+        return get_market_price(self.symbol)
+
+    @cached_property
+    def rules(self):
+        # calc imports the models, so it can only be imported here
+        from exchange_binance.calc import symbol_rules
+        return symbol_rules.get(self)
 
     def get_last_open_position(self):
         return self.positions.filter(is_open=True).last()
@@ -117,12 +125,18 @@ class CopyTradeAccount(BaseModel):
     api_secret = models.CharField('API secret', max_length=100, unique=True)
     proxy = models.CharField('Proxy', max_length=100, null=True, blank=True)
     use_proxy = models.BooleanField('Use proxy', default=False)
+    is_active = models.BooleanField('Is active', default=True)
     wallet_balance = models.FloatField('Wallet balance', default=0.0)
     available_balance = models.FloatField('Available balance', default=0.0)
     margin_balance = models.FloatField('Margin balance', default=0.0)
     cross_unrealized_pnl = models.FloatField('Cross unrealized PNL', default=0.0)
     unrealized_profit = models.FloatField('Unrealized PNL', default=0.0)
 
+    balance_fields = [
+        'wallet_balance', 'available_balance', 'margin_balance',
+        'cross_unrealized_pnl', 'unrealized_profit'
+    ]
+
     @property
     def is_master(self):
         return False
@@ -0,0 +1,121 @@
+import json
+import logging
+import threading
+from exchange_binance.models import Position
+from general.utils import connection
+
+
+logger = logging.getLogger(__name__)
+
+OPEN_POSITIONS_KEY = 'open_positions'
+SIDES = ['LONG', 'SHORT']
+
+
+class OpenPositionIndex():
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _get_field(symbol: str, position_side: str) -> str:
+        return f'{symbol}:{position_side}'
+
+    @staticmethod
+    def _to_entry(position: Position) -> dict:
+        return {
+            'id': position.id,
+            'symbol': position.symbol_id,
+            'position_side': position.position_side,
+            'side': position.side,
+            'transaction_time': position.transaction_time,
+        }
+
+    def _read_db(self, symbols: list[str] = None) -> dict[str, dict]:
+        positions = (
+            Position.objects.filter(is_open=True).prefetch_related(None)
+            .select_related(None).order_by('id')
+        )
+        if symbols is not None:
+            positions = positions.filter(symbol_id__in=symbols)
+        return {
+            self._get_field(i.symbol_id, i.position_side): self._to_entry(i)
+            for i in positions
+        }
+
+    def load(self) -> None:
+        # only the process that consumes the user data stream rebuilds the hash,
+        # every process, the owner included, reads it from redis
+        positions = self._read_db()
+        mapping = {k: json.dumps(v) for k, v in positions.items()}
+        mapping['_loaded'] = 1
+        with self.lock:
+            pipe = connection.pipeline(transaction=True)
+            pipe.delete(OPEN_POSITIONS_KEY)
+            pipe.hset(OPEN_POSITIONS_KEY, mapping=mapping)
+            pipe.execute()
+        logger.info(f'Loaded {len(positions)} open positions into index')
+
+    def _read(self) -> dict[str, dict]:
+        data = connection.hgetall(OPEN_POSITIONS_KEY)
+        if b'_loaded' not in data:
+            # not built yet, readers never write it
+            return self._read_db()
+        return {
+            k.decode(): json.loads(v) for k, v in data.items() if k != b'_loaded'
+        }
+
+    def add(self, position: Position) -> None:
+        field = self._get_field(position.symbol_id, position.position_side)
+        entry = self._to_entry(position)
+        with self.lock:
+            connection.hset(OPEN_POSITIONS_KEY, field, json.dumps(entry))
+
+    def remove(self, position: Position) -> None:
+        field = self._get_field(position.symbol_id, position.position_side)
+        with self.lock:
+            value = connection.hget(OPEN_POSITIONS_KEY, field)
+            if value and json.loads(value)['id'] == position.id:
+                connection.hdel(OPEN_POSITIONS_KEY, field)
+
+    def sync(self, position: Position) -> None:
+        if position.is_open:
+            self.add(position)
+        else:
+            self.remove(position)
+
+    def get_many(self, symbols: list[str], position_side: str = None) -> dict[str, dict]:
+        # only the fields of the requested symbols are read, the newest side wins
+        symbols = [str(i) for i in symbols]
+        sides = [position_side] if position_side in SIDES else SIDES
+        fields = [self._get_field(i, side) for i in symbols for side in sides]
+        if not fields:
+            return {}
+        loaded, *values = connection.hmget(OPEN_POSITIONS_KEY, ['_loaded', *fields])
+        if loaded is None:
+            # not built yet, readers never write it
+            positions = self._read_db(symbols)
+            entries = [positions.get(i) for i in fields]
+        else:
+            entries = [json.loads(i) if i else None for i in values]
+        result = {}
+        for entry in entries:
+            if not entry:
+                continue
+            current = result.get(entry['symbol'])
+            if not current or entry['id'] > current['id']:
+                result[entry['symbol']] = entry
+        return result
+
+    def get(self, symbol: str, position_side: str = None) -> dict | None:
+        return self.get_many([symbol], position_side).get(str(symbol))
+
+    def is_open(self, symbol: str) -> bool:
+        return self.get(symbol) is not None
+
+    def get_ids(self, symbols: list[str]) -> dict[str, int]:
+        return {k: v['id'] for k, v in self.get_many(symbols).items()}
+
+    def count(self, position_side: str) -> int:
+        return sum(1 for i in self._read().values() if i['position_side'] == position_side)
+
+
+open_positions = OpenPositionIndex()
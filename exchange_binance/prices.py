@@ -0,0 +1,35 @@
+import logging
+from general.utils import connection
+
+
+logger = logging.getLogger(__name__)
+
+MARKET_PRICES_KEY = 'market_prices'
+MARKET_PRICES_TIMEOUT = 5
+
+
+def set_market_prices(data: list[dict]) -> None:
+    mapping = {i['s']: i['p'] for i in data}
+    if not mapping:
+        return
+    pipe = connection.pipeline(transaction=True)
+    pipe.delete(MARKET_PRICES_KEY)
+    pipe.hset(MARKET_PRICES_KEY, mapping=mapping)
+    pipe.expire(MARKET_PRICES_KEY, MARKET_PRICES_TIMEOUT)
+    pipe.execute()
+
+
+def get_market_prices(symbols: list[str]) -> dict[str, float]:
+    symbols = [str(i) for i in symbols]
+    if not symbols:
+        return {}
+    values = connection.hmget(MARKET_PRICES_KEY, symbols)
+    return {
+        symbol: float(value) if value else 0.0
+        for symbol, value in zip(symbols, values)
+    }
+
+
+def get_market_price(symbol: str) -> float:
+    value = connection.hget(MARKET_PRICES_KEY, str(symbol))
+    return float(value) if value else 0.0
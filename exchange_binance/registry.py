@@ -0,0 +1,53 @@
+import logging
+import threading
+from django.core.cache import cache
+from exchange_binance.models import CopyTradeAccount
+
+
+logger = logging.getLogger(__name__)
+
+
+class FollowerRegistry():
+    version_key = 'copy_trade_accounts_version'
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.version = None
+        self._accounts: dict[int, CopyTradeAccount] = {}
+
+    def _get_version(self) -> int:
+        return cache.get(self.version_key, 0)
+
+    def _load(self) -> dict[int, CopyTradeAccount]:
+        version = self._get_version()
+        if version == self.version:
+            return self._accounts
+        with self.lock:
+            if version != self.version:
+                self._accounts = {i.id: i for i in CopyTradeAccount.objects.all()}
+                self.version = version
+                logger.debug(
+                    f'Loaded {len(self._accounts)} copy trade accounts, {version=}'
+                )
+        return self._accounts
+
+    def accounts(self) -> list[CopyTradeAccount]:
+        return [i for i in self._load().values() if i.is_active]
+
+    def get(self, account_id: int) -> CopyTradeAccount:
+        account = self._load().get(account_id)
+        if not account:
+            raise CopyTradeAccount.DoesNotExist(
+                f'Copy trade account {account_id} not found'
+            )
+        return account
+
+    def invalidate(self) -> None:
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, 1, timeout=None)
+        logger.debug('Invalidated copy trade accounts')
+
+
+followers = FollowerRegistry()
@@ -11,6 +11,7 @@ from exchange_binance.models import (
     Symbol, Position, Order, MainSettings, CopyTradeAccount, PositionSettings,
     MasterAccount
 )
+from exchange_binance.position_index import open_positions
 from general.exceptions import CustomAPIException
 
 
@@ -19,7 +20,8 @@ logger = logging.getLogger(__name__)
 
 class DummyStatusSerializer(serializers.Serializer):
     position_id = serializers.IntegerField()
-    status = serializers.ChoiceField(choices=['success', 'failed'])
+    account_id = serializers.IntegerField(required=False)
+    status = serializers.ChoiceField(choices=['success', 'failed', 'pending'])
     # detail = serializers.CharField(required=False)
 
 
@@ -68,7 +70,7 @@ class CopyTradeAccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = CopyTradeAccount
         fields = [
-            'id', 'name', 'api_key', 'api_secret', 'proxy', 'use_proxy'
+            'id', 'name', 'api_key', 'api_secret', 'proxy', 'use_proxy', 'is_active'
         ]
         read_only_fields = ['id']
 
@@ -282,7 +284,7 @@ class OpenPositionSerializer(serializers.Serializer):
                 symbol = Symbol.objects.get(symbol=i.symbol)
                 if not symbol.is_active:
                     raise CustomAPIException('symbol', 'Symbol is not active')
-                if symbol.get_last_open_position():
+                if open_positions.is_open(symbol.symbol):
                     raise CustomAPIException('symbol', 'Position already open')
             except Symbol.DoesNotExist:
                 raise CustomAPIException('symbol', 'Symbol not found')
@@ -315,7 +317,7 @@ class OpenPositionSerializer(serializers.Serializer):
                         'Trailing stop price rate must be between 0.1 and 10'
                     )
             symbol = Symbol.objects.get(symbol=i.symbol)
-            if symbol.get_last_open_position():
+            if open_positions.is_open(symbol.symbol):
                 raise CustomAPIException('symbol', 'Position already open')
             return data
         except CustomAPIException as e:
@@ -341,7 +343,7 @@ class SignalSerializer(serializers.Serializer):
                 symbol = Symbol.objects.get(symbol=i.symbol)
                 if not symbol.is_active:
                     raise CustomAPIException('symbol', 'Symbol is not active')
-                if symbol.get_last_open_position():
+                if open_positions.is_open(symbol.symbol):
                     raise CustomAPIException('symbol', 'Position already open')
             except Symbol.DoesNotExist:
                 raise CustomAPIException('symbol', 'Symbol not found')
@@ -372,9 +374,7 @@ def available_positions_count(side: str, amount: int = 1) -> int:
     logger.debug(f'Position limit: {limit}', extra=extra)
     if not limit:
         return amount
-    open_positions_count = (
-        Position.objects.filter(is_open=True, position_side=side).count()
-    )
+    open_positions_count = open_positions.count(side)
     logger.debug(f'Open positions count: {open_positions_count}', extra=extra)
     can_open_positions_count = limit - open_positions_count
     logger.debug(f'Can open positions count: {can_open_positions_count}', extra=extra)
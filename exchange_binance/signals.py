@@ -1,12 +1,16 @@
 import logging
 import os
 from django.core.cache import cache
-from django.db.models.signals import post_migrate, post_save
+from django.db import transaction
+from django.db.models.signals import post_migrate, post_save, post_delete
 from django.dispatch import receiver
 from exchange_binance.models import (
-    MainSettings, Position, PositionSettings, MasterAccount
+    MainSettings, Position, PositionSettings, MasterAccount, CopyTradeAccount
 )
 from exchange_binance import tasks
+from exchange_binance.registry import followers
+from exchange_binance.credentials import binance
+from exchange_binance.position_index import open_positions
 
 
 logger = logging.getLogger(__name__)
@@ -47,3 +51,34 @@ def create_position(sender, instance, created, **kwargs):
     else:
         if not instance.is_open:
             tasks.cancel_all_open_orders.delay(instance.symbol.symbol)
+
+
+@receiver(post_save, sender=Position)
+def sync_open_positions(sender, instance, **kwargs):
+    transaction.on_commit(lambda: open_positions.sync(instance))
+
+
+@receiver(post_delete, sender=Position)
+def remove_open_position(sender, instance, **kwargs):
+    transaction.on_commit(lambda: open_positions.remove(instance))
+
+
+def is_balance_update(update_fields) -> bool:
+    if not update_fields:
+        return False
+    return set(update_fields) <= {*CopyTradeAccount.balance_fields, 'updated_at'}
+
+
+@receiver(post_save, sender=CopyTradeAccount)
+@receiver(post_delete, sender=CopyTradeAccount)
+def invalidate_copy_trade_accounts(sender, instance, **kwargs):
+    if is_balance_update(kwargs.get('update_fields')):
+        return
+    transaction.on_commit(followers.invalidate)
+
+
+@receiver(post_save, sender=MasterAccount)
+def invalidate_master_account_credentials(sender, instance, **kwargs):
+    if is_balance_update(kwargs.get('update_fields')):
+        return
+    transaction.on_commit(binance.invalidate)
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import websockets
+from django import db
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from exchange_binance.models import CopyTradeAccount, CopyTradeOrder
+from exchange_binance.registry import followers
+from exchange_binance.clients import pool
+from general.data import DataOrder
+
+
+logger = logging.getLogger(__name__)
+
+FOLLOWER_STREAMS_KEY = 'follower_streams'
+FOLLOWER_STREAMS_TIMEOUT = 60
+# binance closes a connection with more than 200 streams or 10 incoming messages per second
+MAX_STREAMS_PER_CONNECTION = 200
+SUBSCRIBE_BATCH_SIZE = 50
+SUBSCRIBE_INTERVAL = 0.2
+LISTEN_KEY_RENEW_INTERVAL = 1800
+# fill fields of ORDER_TRADE_UPDATE that DataOrder does not map
+FILL_FIELDS = {
+    'x': ('execution_type', str),
+    'z': ('filled_accum_qty', float),
+    'n': ('commission', float),
+    'N': ('commission_asset', str),
+    't': ('trade_id', int),
+    'm': ('is_maker', bool),
+}
+
+
+def is_running() -> bool:
+    return cache.get(FOLLOWER_STREAMS_KEY) is not None
+
+
+def get_stream_url() -> str:
+    if settings.BINANCE_WS_URL:
+        url = settings.BINANCE_WS_URL.rstrip('/')
+        return url[:-3] + '/stream' if url.endswith('/ws') else f'{url}/stream'
+    return 'wss://fstream.binance.com/stream'
+
+
+class StreamConnection():
+    def __init__(self, manager: 'FollowerStreamManager', number: int) -> None:
+        self.manager = manager
+        self.name = f'follower_streams_{number}'
+        self.extra = {'symbol': self.name}
+        self.listen_keys: set[str] = set()
+        self.pending = {'SUBSCRIBE': set(), 'UNSUBSCRIBE': set()}
+        self.wakeup = asyncio.Event()
+        self.ws = None
+        self.request_id = 0
+        self.messages = 0
+
+    @property
+    def free(self) -> int:
+        return MAX_STREAMS_PER_CONNECTION - len(self.listen_keys)
+
+    def subscribe(self, listen_keys: list[str]) -> None:
+        self.listen_keys.update(listen_keys)
+        self.pending['UNSUBSCRIBE'].difference_update(listen_keys)
+        self.pending['SUBSCRIBE'].update(listen_keys)
+        self.wakeup.set()
+
+    def unsubscribe(self, listen_keys: list[str]) -> None:
+        self.listen_keys.difference_update(listen_keys)
+        self.pending['SUBSCRIBE'].difference_update(listen_keys)
+        self.pending['UNSUBSCRIBE'].update(listen_keys)
+        self.wakeup.set()
+
+    async def _send_pending(self, ws) -> None:
+        # requests are batched and paced to stay under the incoming message limit
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            for method, listen_keys in self.pending.items():
+                while listen_keys:
+                    params = [listen_keys.pop() for _ in range(min(SUBSCRIBE_BATCH_SIZE, len(listen_keys)))]
+                    self.request_id += 1
+                    await ws.send(json.dumps({'method': method, 'params': params, 'id': self.request_id}))
+                    await asyncio.sleep(SUBSCRIBE_INTERVAL)
+
+    async def run(self) -> None:
+        delay = 1
+        while True:
+            try:
+                async with websockets.connect(
+                    get_stream_url(), ping_interval=None, max_queue=None
+                ) as ws:
+                    self.ws = ws
+                    logger.info(
+                        f'Connected, subscribing {len(self.listen_keys)} streams',
+                        extra=self.extra
+                    )
+                    self.pending['UNSUBSCRIBE'].clear()
+                    self.subscribe(list(self.listen_keys))
+                    sender = asyncio.create_task(self._send_pending(ws))
+                    delay = 1
+                    try:
+                        async for message in ws:
+                            self.messages += 1
+                            self.manager.dispatch(message)
+                    finally:
+                        sender.cancel()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f'Connection lost: {e!r}. Reconnecting in {delay}s', extra=self.extra)
+            finally:
+                self.ws = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+class FollowerStreamManager():
+    def __init__(self) -> None:
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.FOLLOWER_STREAMS_MAX_WORKERS,
+            thread_name_prefix='follower_streams'
+        )
+        self.rest = asyncio.Semaphore(settings.FOLLOWER_STREAMS_MAX_WORKERS)
+        self.accounts: dict[int, CopyTradeAccount] = {}
+        self.listen_keys: dict[int, str] = {}
+        self.key_accounts: dict[str, int] = {}
+        self.key_connections: dict[str, StreamConnection] = {}
+        self.renewed_at: dict[int, float] = {}
+        self.connections: list[StreamConnection] = []
+        self.tasks: list[asyncio.Task] = []
+        self.orders: dict[int, dict] = {}
+        self.balances: dict[int, float] = {}
+        self.stats = {'events': 0, 'orders': 0, 'balances': 0, 'unmatched': 0}
+        self.extra = {'symbol': 'follower_streams'}
+
+    async def _call(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def _new_listen_key(self, account: CopyTradeAccount) -> str | None:
+        async with self.rest:
+            try:
+                result = await self._call(pool.for_account(account).new_listen_key)
+                return result['listenKey']
+            except Exception as e:
+                logger.warning(
+                    f'Can not get listen key: {e}', extra={'account': account.id, 'symbol': account.name}
+                )
+
+    def _get_connection(self) -> StreamConnection:
+        for connection in self.connections:
+            if connection.free > 0:
+                return connection
+        connection = StreamConnection(self, len(self.connections))
+        self.connections.append(connection)
+        self.tasks.append(asyncio.create_task(connection.run()))
+        return connection
+
+    async def add(self, account: CopyTradeAccount) -> None:
+        listen_key = await self._new_listen_key(account)
+        if not listen_key or account.id not in self.accounts:
+            return
+        old = self.listen_keys.get(account.id)
+        if old and old != listen_key:
+            self._unsubscribe(old)
+        self.listen_keys[account.id] = listen_key
+        self.key_accounts[listen_key] = account.id
+        self.renewed_at[account.id] = time.monotonic()
+        if listen_key not in self.key_connections:
+            connection = self._get_connection()
+            self.key_connections[listen_key] = connection
+            connection.subscribe([listen_key])
+
+    def _unsubscribe(self, listen_key: str) -> None:
+        self.key_accounts.pop(listen_key, None)
+        connection = self.key_connections.pop(listen_key, None)
+        if connection:
+            connection.unsubscribe([listen_key])
+
+    async def remove(self, account_id: int) -> None:
+        account = self.accounts.pop(account_id)
+        listen_key = self.listen_keys.pop(account_id, None)
+        self.renewed_at.pop(account_id, None)
+        if not listen_key:
+            return
+        self._unsubscribe(listen_key)
+        async with self.rest:
+            try:
+                await self._call(pool.for_account(account).close_listen_key, listen_key)
+            except Exception as e:
+                logger.debug(f'Can not close listen key: {e}', extra={'account': account_id})
+
+    def _load_accounts(self) -> dict[int, CopyTradeAccount]:
+        db.close_old_connections()
+        return {i.id: i for i in followers.accounts() if i.api_key and i.api_secret}
+
+    async def sync_accounts(self) -> None:
+        while True:
+            try:
+                accounts = await self._call(self._load_accounts)
+                removed = set(self.accounts) - set(accounts)
+                removed.update(
+                    k for k, v in accounts.items()
+                    if k in self.accounts and self.accounts[k].api_key != v.api_key
+                )
+                for account_id in removed:
+                    await self.remove(account_id)
+                added = [i for i in accounts.values() if i.id not in self.accounts]
+                self.accounts.update(accounts)
+                if added:
+                    await asyncio.gather(*(self.add(i) for i in added))
+                    logger.info(
+                        f'Streaming {len(self.listen_keys)} of {len(self.accounts)} accounts '
+                        f'on {len(self.connections)} connections',
+                        extra=self.extra
+                    )
+                # accounts whose listen key could not be created are retried
+                missing = [i for i in self.accounts.values() if i.id not in self.listen_keys]
+                if missing and not added:
+                    await asyncio.gather(*(self.add(i) for i in missing))
+            except Exception as e:
+                logger.exception(e, extra=self.extra)
+            await asyncio.sleep(settings.FOLLOWER_STREAMS_SYNC_INTERVAL)
+
+    async def _renew(self, account_id: int) -> None:
+        account = self.accounts.get(account_id)
+        listen_key = self.listen_keys.get(account_id)
+        if not account or not listen_key:
+            return
+        async with self.rest:
+            try:
+                await self._call(pool.for_account(account).renew_listen_key, listen_key)
+                self.renewed_at[account_id] = time.monotonic()
+                return
+            except Exception as e:
+                logger.warning(f'Can not renew listen key: {e}', extra={'account': account_id})
+        await self.add(account)
+
+    async def keepalive(self) -> None:
+        # renewals are spread over the interval instead of running at once
+        while True:
+            await asyncio.sleep(10)
+            deadline = time.monotonic() - LISTEN_KEY_RENEW_INTERVAL
+            due = [k for k, v in self.renewed_at.items() if v < deadline]
+            if due:
+                await asyncio.gather(*(self._renew(i) for i in due))
+
+    def dispatch(self, message: str) -> None:
+        try:
+            message = json.loads(message)
+        except json.decoder.JSONDecodeError:
+            logger.error(f'Can not decode message. {message=}', extra=self.extra)
+            return
+        data = message.get('data')
+        account_id = self.key_accounts.get(message.get('stream'))
+        if not data or not account_id:
+            return
+        self.stats['events'] += 1
+        if data.get('e') == 'ORDER_TRADE_UPDATE':
+            o = data['o']
+            fields = DataOrder(**o).to_dict()
+            fields.pop('symbol', None)
+            for key, (name, cast) in FILL_FIELDS.items():
+                if key in o:
+                    fields[name] = cast(o[key])
+            order = self.orders.setdefault(
+                fields['order_id'], {'fields': {}, 'received': time.monotonic()}
+            )
+            order['fields'].update(fields)
+        elif data.get('e') == 'ACCOUNT_UPDATE':
+            for i in data['a'].get('B', []):
+                if i.get('a') == 'USDT':
+                    self.balances[account_id] = float(i['wb'])
+        elif data.get('e') == 'listenKeyExpired':
+            logger.warning('Listen key expired', extra={'account': account_id})
+            self.renewed_at[account_id] = 0
+
+    def write_orders(self, orders: dict[int, dict]) -> dict[int, dict]:
+        db.close_old_connections()
+        existing = set(
+            CopyTradeOrder.objects.filter(order_id__in=list(orders))
+            .values_list('order_id', flat=True)
+        )
+        groups: dict[tuple, list[CopyTradeOrder]] = {}
+        for order_id in existing:
+            fields = orders[order_id]['fields']
+            update_fields = tuple(sorted(set(fields) - {'order_id'}))
+            groups.setdefault(update_fields, []).append(CopyTradeOrder(**fields))
+        for update_fields, objs in groups.items():
+            CopyTradeOrder.objects.bulk_update(objs, update_fields)
+        self.stats['orders'] += len(existing)
+        # the copy task may not have saved the order yet, keep it for a while
+        deadline = time.monotonic() - settings.FOLLOWER_STREAMS_PENDING_TTL
+        pending = {}
+        for order_id, order in orders.items():
+            if order_id in existing:
+                continue
+            if order['received'] > deadline:
+                pending[order_id] = order
+            else:
+                self.stats['unmatched'] += 1
+        return pending
+
+    def write_balances(self, balances: dict[int, float]) -> None:
+        db.close_old_connections()
+        now = timezone.now()
+        CopyTradeAccount.objects.bulk_update(
+            [
+                CopyTradeAccount(id=k, wallet_balance=v, updated_at=now)
+                for k, v in balances.items()
+            ],
+            ['wallet_balance', 'updated_at']
+        )
+        self.stats['balances'] += len(balances)
+
+    async def flush(self) -> None:
+        while True:
+            await asyncio.sleep(settings.FOLLOWER_STREAMS_FLUSH_INTERVAL)
+            try:
+                orders, self.orders = self.orders, {}
+                balances, self.balances = self.balances, {}
+                if orders:
+                    pending = await self._call(self.write_orders, orders)
+                    for order_id, order in pending.items():
+                        # a newer event of the same order has arrived meanwhile
+                        if order_id in self.orders:
+                            order['fields'].update(self.orders[order_id]['fields'])
+                        self.orders[order_id] = order
+                if balances:
+                    await self._call(self.write_balances, balances)
+            except Exception as e:
+                logger.exception(e, extra=self.extra)
+
+    def get_stats(self) -> dict:
+        return {
+            'accounts': len(self.accounts),
+            'streams': len(self.listen_keys),
+            'connections': [
+                {'streams': len(i.listen_keys), 'connected': bool(i.ws), 'messages': i.messages}
+                for i in self.connections
+            ],
+            'pending_orders': len(self.orders),
+            **self.stats,
+        }
+
+    async def heartbeat(self) -> None:
+        while True:
+            stats = self.get_stats()
+            await self._call(cache.set, FOLLOWER_STREAMS_KEY, stats, FOLLOWER_STREAMS_TIMEOUT)
+            logger.debug(f'Alive and running {stats}', extra=self.extra)
+            await asyncio.sleep(10)
+
+    async def run(self) -> None:
+        self.tasks += [
+            asyncio.create_task(self.sync_accounts()),
+            asyncio.create_task(self.keepalive()),
+            asyncio.create_task(self.flush()),
+            asyncio.create_task(self.heartbeat()),
+        ]
+        try:
+            while True:
+                await asyncio.sleep(1)
+                for task in self.tasks:
+                    if task.done() and not task.cancelled() and task.exception():
+                        raise task.exception()
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await self._call(cache.delete, FOLLOWER_STREAMS_KEY)
+            self.executor.shutdown(wait=False, cancel_futures=True)
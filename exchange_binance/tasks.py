@@ -2,37 +2,57 @@ import logging
 import threading
 import time
 import random
+import uuid
+from concurrent.futures import (
+    ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+)
 from types import SimpleNamespace as Namespace
 from django.conf import settings
+from django import db
+from django.db import transaction
 from django.core.cache import cache
+from django.utils import timezone
 # from celery.utils.log import get_task_logger
-from binance.um_futures import UMFutures
 from exchange_binance.models import (
-    Symbol, Position, Order, MainSettings, MasterAccount, CopyTradeAccount,
-    CopyTradeOrder
+    Symbol, Position, MainSettings, MasterAccount, CopyTradeAccount,
+    CopyTradeOrder, PositionSettings
 )
 from copy_trade.celery import app
-from general.utils import TaskLock
+from general.utils import TaskLock, connection, LIMIT_USAGE_KEY
 from exchange_binance.ws import WebSocketBinanceMarketPrice, WebSocketBinanceUserData
 from general.exceptions import AcquireLockException, LimitUsageException
 from exchange_binance import handlers
-from celery.signals import worker_ready
+from celery.signals import (
+    celeryd_init, worker_ready, worker_process_init, task_prerun, task_postrun
+)
 from exchange_binance.trade import (
-    BinanceTrade, BinanceOrder, BinanceCopyTrade, BinanceCopyTradeOrder
+    BinanceTrade, BinanceOrder, BinanceCopyTrade, BinanceCopyTradeOrder,
+    CLOSE_WITH_FOLLOWERS_PREFIX
 )
 from exchange_binance import calc
 from exchange_binance.credentials import binance
+from exchange_binance.registry import followers
+from exchange_binance.clients import pool
+from exchange_binance.ingest import order_writer
+from exchange_binance.position_index import open_positions
+from exchange_binance import latency
+from exchange_binance import streams
+from exchange_binance import lanes
+from exchange_binance import jobs
+from exchange_binance.limits import limiter, get_account_egress, PRIORITIES
 from general.data import DataOrder, DataPosition
 
 
 # logger = get_task_logger(__name__)
 logger = logging.getLogger(__name__)
 
+is_lane_worker = False
+
 
 @app.task
 def update_symbols() -> None:
     try:
-        client = UMFutures(key=binance.api_key, secret=binance.api_secret)
+        client = pool.master()
         result = client.exchange_info()
         brackets = client.leverage_brackets()
         brackets = {i['symbol']: i['brackets'] for i in brackets}
@@ -58,6 +78,7 @@ def update_symbols() -> None:
                     is_active=i['status'] == 'TRADING'
                 )
                 logger.info(f'Created binance symbol {symbol}')
+        calc.symbol_rules.compile(symbols)
     except Exception as e:
         logger.exception(e)
         raise e
@@ -67,15 +88,14 @@ def update_symbols() -> None:
 def get_limit_usage() -> None:
     try:
         with TaskLock('task_get_limit_usage'):
-            client = UMFutures(show_limit_usage=True)
-            result = client.time()
-            used_weight = int(result['limit_usage']['x-mbx-used-weight-1m'])
+            # every response through the client pool feeds the limiter
+            used_weight = limiter.get_usage()
             logger.trace(f'Limit usage: {used_weight}')
             if used_weight > settings.BINANCE_LIMIT_USAGE:
                 logger.warning(f'Limit usage is too high: {used_weight}')
-                cache.set('limit_usage_too_high', True, timeout=60)
+                connection.set(LIMIT_USAGE_KEY, 1, ex=60)
             else:
-                cache.delete('limit_usage_too_high')
+                connection.delete(LIMIT_USAGE_KEY)
     except AcquireLockException:
         logger.trace('Task get limit usage is now running')
     except Exception as e:
@@ -83,10 +103,10 @@ def get_limit_usage() -> None:
         raise e
 
 
-def update_account_balances(account) -> None:
+def fetch_account_balances(account) -> bool:
     extra = {'account': account.id, 'symbol': account.name}
     try:
-        client = UMFutures(key=account.api_key, secret=account.api_secret)
+        client = pool.for_account(account)
         result = client.sign_request('GET', url_path='/fapi/v3/account')
         data: dict = next((i for i in result['assets'] if i.get('asset') == 'USDT'))
         account.wallet_balance = float(data['walletBalance'])
@@ -94,7 +114,6 @@ def update_account_balances(account) -> None:
         account.available_balance = float(data['availableBalance'])
         account.cross_unrealized_pnl = float(data['crossUnPnl'])
         account.unrealized_profit = float(data['unrealizedProfit'])
-        account.save()
         logger.trace(
             f'Updated balances: wallet_balance={account.wallet_balance:.2f} '
             f'margin_balance={account.margin_balance:.2f} '
@@ -103,19 +122,60 @@ def update_account_balances(account) -> None:
             f'unrealized_profit={account.unrealized_profit:.2f}',
             extra=extra
         )
+        return True
     except Exception as e:
         logger.exception(e, extra=extra)
+        return False
+
+
+def is_balance_refresh_due(account: CopyTradeAccount, tick: int, streamed: bool) -> bool:
+    # accounts with open exposure are refreshed on every tick, idle ones are
+    # spread over the idle interval by their id so they do not come in bursts.
+    # With follower streams running wallet balances come from the stream and
+    # polling only reconciles the rest at the idle rate
+    if account.unrealized_profit and not streamed:
+        return True
+    ticks = max(
+        settings.BALANCE_REFRESH_IDLE_INTERVAL // settings.BALANCE_REFRESH_INTERVAL, 1
+    )
+    return (tick + account.id) % ticks == 0
 
 
 @app.task
-def update_balances():
+def update_balances() -> dict:
     try:
         with TaskLock('task_update_balances', use_limit_usage=True):
+            start = time.monotonic()
             master_account = MasterAccount.objects.first()
-            update_account_balances(master_account)
-            copy_trade_accounts = CopyTradeAccount.objects.all()
-            for account in copy_trade_accounts:
-                threading.Thread(target=update_account_balances, args=(account,)).start()
+            if fetch_account_balances(master_account):
+                master_account.save(update_fields=CopyTradeAccount.balance_fields + ['updated_at'])
+            tick = int(time.time() // settings.BALANCE_REFRESH_INTERVAL)
+            streamed = streams.is_running()
+            accounts = [
+                i for i in CopyTradeAccount.objects.all()
+                if is_balance_refresh_due(i, tick, streamed)
+            ]
+            updated = []
+            if accounts:
+                with ThreadPoolExecutor(
+                    max_workers=min(settings.BALANCE_REFRESH_MAX_WORKERS, len(accounts)),
+                    thread_name_prefix='update_balances'
+                ) as executor:
+                    for account, ok in zip(accounts, executor.map(fetch_account_balances, accounts)):
+                        if ok:
+                            account.updated_at = timezone.now()
+                            updated.append(account)
+            if updated:
+                CopyTradeAccount.objects.bulk_update(
+                    updated, CopyTradeAccount.balance_fields + ['updated_at']
+                )
+            result = {
+                'due': len(accounts),
+                'updated': len(updated),
+                'elapsed': round(time.monotonic() - start, 4)
+            }
+            logger.trace(f'Updated balances {result}')
+            return result
     except LimitUsageException:
         logger.warning('Update balances limit usage is too high. Task is skipped')
     except AcquireLockException:
@@ -126,47 +186,61 @@ def update_balances():
 
 
 @app.task
-def update_positions() -> None:
+def update_positions() -> dict:
     try:
         with TaskLock('task_update_positions', use_limit_usage=True):
-            client = UMFutures(key=binance.api_key, secret=binance.api_secret)
+            client = pool.master()
             positions = client.sign_request('GET', url_path='/fapi/v3/positionRisk')
             if not positions:
                 logger.trace('No open positions found')
-                return
+                return {}
+            start = time.monotonic()
+            stored = {
+                i.symbol_id: i for i in Position.objects.filter(is_open=True).order_by('id')
+            }
+            fields = set()
+            changed = []
             for i in positions:
                 p: DataPosition = DataPosition(**i)
                 p.position_side = 'LONG' if p.position_amt > 0 else 'SHORT'
                 p.side = 'BUY' if p.position_side == 'LONG' else 'SELL'
-                p.symbol: Symbol = Symbol.objects.filter(symbol=p.symbol).first()
-                if not p.symbol:
-                    logger.warning(f'Symbol {p.symbol} not found in database')
-                    continue
                 extra = dict(symbol=p.symbol, side=p.side)
-                position: Position = p.symbol.get_last_open_position()
-                if position:
-                    Position.objects.filter(id=position.id).update(**p.to_dict())
-                    extra.update(id=position.id)
-                    logger.trace(
-                        f'Updated position in database {p.position_amt=} '
-                        f'{p.entry_price=:.5f} {p.notional=:.2f} '
-                        f'{p.unrealized_profit=:.5f}',
-                        extra=extra
-                    )
-                else:
+                position: Position = stored.get(p.symbol)
+                if not position:
                     logger.critical(
                         'Found position in binance, but not in database '
                         f'{p.position_amt=} {p.entry_price=:.5f} {p.notional=:.2f} '
                         f'{p.unrealized_profit=:.5f}',
                         extra=extra
                     )
-                    # position = Position.objects.create(**p.to_dict())
-                    # extra.update(id=position.id)
-                    # logger.warning(
-                    #     f'Created position in database {p.position_amt=} '
-                    #     f'{p.entry_price=} {p.notional=}',
-                    #     extra=extra
-                    # )
+                    continue
+                diff = {
+                    k: v for k, v in p.to_dict().items()
+                    if k != 'symbol' and getattr(position, k) != v
+                }
+                if not diff:
+                    continue
+                for k, v in diff.items():
+                    setattr(position, k, v)
+                fields.update(diff)
+                changed.append(position)
+                extra.update(id=position.id)
+                logger.trace(
+                    f'Updated position in database {p.position_amt=} '
+                    f'{p.entry_price=:.5f} {p.notional=:.2f} '
+                    f'{p.unrealized_profit=:.5f}',
+                    extra=extra
+                )
+            if changed:
+                with transaction.atomic():
+                    Position.objects.bulk_update(changed, sorted(fields))
+            result = {
+                'updated': len(changed),
+                'received': len(positions),
+                'elapsed': round(time.monotonic() - start, 4)
+            }
+            logger.debug(f'Updated positions {result}')
+            return result
     except LimitUsageException:
         logger.warning('Update positions limit usage is too high. Task is skipped')
     except AcquireLockException:
@@ -180,30 +254,14 @@ def update_positions() -> None:
 def update_open_orders() -> None:
     try:
         with TaskLock('task_update_open_orders', use_limit_usage=True):
-            client = UMFutures(key=binance.api_key, secret=binance.api_secret)
+            client = pool.master()
             result = client.get_orders()
             if not result:
                 logger.trace('No open orders found')
                 return
             for i in result:
-                o: DataOrder = DataOrder(**i)
-                o.symbol: Symbol = Symbol.objects.get(symbol=o.symbol)
-                position: Position = o.symbol.get_last_open_position()
-                if position:
-                    o.position = position
-                extra = {'symbol': o.symbol, 'side': o.side, 'id': o.order_id}
-                if Order.objects.filter(order_id=o.order_id).exists():
-                    Order.objects.filter(order_id=o.order_id).update(**o.to_dict())
-                    logger.debug(
-                        f'Updated order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
-                        extra=extra
-                    )
-                else:
-                    Order.objects.create(**o.to_dict())
-                    logger.debug(
-                        f'Created order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
-                        extra=extra
-                    )
+                order_writer.add(DataOrder(**i))
+            order_writer.flush()
     except LimitUsageException:
         logger.warning('Update open orders limit usage is too high. Task is skipped')
     except AcquireLockException:
@@ -214,16 +272,50 @@ def update_open_orders() -> None:
 
 @worker_ready.connect
 def on_worker_ready(sender, **kwargs):
+    if sender.hostname.startswith(lanes.LANE_QUEUE_PREFIX):
+        return
     update_open_orders.apply_async()
 
 
+@celeryd_init.connect
+def on_celeryd_init(sender, **kwargs):
+    # runs before the pool forks, so every child knows which worker it belongs to
+    global is_lane_worker
+    is_lane_worker = sender.startswith(lanes.LANE_QUEUE_PREFIX)
+
+
+@worker_process_init.connect
+def on_worker_process_init(sender, **kwargs):
+    if not settings.BINANCE_CLIENT_POOL_PREWARM:
+        return
+    # with lanes the copy tasks run only in the lane workers, the others need the master
+    copies = is_lane_worker or not settings.COPY_LANES
+    threading.Thread(
+        target=lambda: pool.warm(followers.accounts() if copies else []), daemon=True
+    ).start()
+
+
+@task_prerun.connect
+def on_task_prerun(sender=None, task_id=None, task=None, **kwargs):
+    if jobs.is_job(task.request):
+        jobs.set_started(task_id, (task.request.timelimit or (None,))[0] or task.time_limit)
+
+
+@task_postrun.connect
+def on_task_postrun(sender=None, task_id=None, task=None, retval=None, state=None, **kwargs):
+    if jobs.is_job(task.request):
+        jobs.set_finished(task_id, state, retval)
+
+
 @app.task
 def run_websocket_binance_market_price() -> None:
     try:
         with TaskLock('task_run_websocket_binance_market_price'):
-            ws = WebSocketBinanceMarketPrice(testnet=binance.testnet, debug=False)
+            ws = WebSocketBinanceMarketPrice(
+                testnet=binance.testnet, debug=False, backpressure='drop_oldest'
+            )
             if ws.is_alive():
-                logger.debug('Alive and running', extra={'symbol': ws.name})
+                logger.debug(f'Alive and running {ws.get_stats()}', extra={'symbol': ws.name})
             else:
                 ws.kill()
                 ws.start()
@@ -258,9 +350,10 @@ def run_websocket_binance_user_data() -> None:
                     api_key=binance.api_key, api_secret=binance.api_secret
                 )
             if ws.is_alive():
-                logger.debug('Alive and running', extra={'symbol': ws.name})
+                logger.debug(f'Alive and running {ws.get_stats()}', extra={'symbol': ws.name})
             else:
                 ws.kill()
+                open_positions.load()
                 ws.start()
                 ws.add_handler(handlers.orders)
                 ws.add_handler(handlers.positions)
@@ -275,7 +368,7 @@ def run_websocket_binance_user_data() -> None:
 @app.task
 def cancel_all_open_orders(symbol: str) -> None:
     try:
-        with TaskLock(f'task_cancel_all_open_orders_{symbol}'):
+        with TaskLock(f'task_cancel_all_open_orders_{symbol}', name='task_cancel_all_open_orders'):
             BinanceOrder(symbol).cancel_all_open_orders()
     except AcquireLockException:
         logger.trace('Task cancel all open orders is now running')
@@ -287,7 +380,10 @@ def cancel_all_open_orders(symbol: str) -> None:
 @app.task
 def placing_orders_after_opening_position(position_id: int) -> None:
     try:
-        with TaskLock(f'placing_orders_after_opening_position_{position_id}'):
+        with TaskLock(
+            f'placing_orders_after_opening_position_{position_id}',
+            name='placing_orders_after_opening_position'
+        ):
             position = Position.objects.get(id=position_id)
             settings = position.settings
             trade = BinanceTrade(
@@ -295,12 +391,13 @@ def placing_orders_after_opening_position(position_id: int) -> None:
                 side=position.side,
                 quantity=position.quantity
             )
+            orders = []
             if settings.take_profit_rate:
                 price = position.get_take_profit_price(settings.take_profit_rate)
-                trade.place_take_profit_market_order(price)
+                orders.append(trade.get_take_profit_market_params(price))
             if settings.stop_loss_rate:
                 price = position.get_stop_loss_price(settings.stop_loss_rate)
-                trade.place_stop_loss_market_order(price)
+                orders.append(trade.get_stop_loss_market_params(price))
             if (
                 settings.trailing_stop_callback_rate and
                 settings.trailing_stop_activation_price_rate
@@ -308,9 +405,11 @@ def placing_orders_after_opening_position(position_id: int) -> None:
                 activation_price = position.get_trailing_stop_activation_price(
                     settings.trailing_stop_activation_price_rate
                 )
-                trade.place_trailing_stop_market_order(
+                orders.append(trade.get_trailing_stop_market_params(
                     settings.trailing_stop_callback_rate, activation_price
-                )
+                ))
+            if orders:
+                trade.place_batch_orders(orders)
     except AcquireLockException:
         logger.trace('Task placing orders after opening position is now running')
     except Exception as e:
@@ -320,14 +419,12 @@ def placing_orders_after_opening_position(position_id: int) -> None:
 
 @app.task
 def copy_trade_account(account_id: int, data: dict) -> None:
-    account = CopyTradeAccount.objects.get(id=account_id)
+    account = followers.get(account_id)
     symbol = data['s']
     leverage = data['l']
     extra = {'account': account.id, 'symbol': symbol}
     try:
-        client = UMFutures(key=account.api_key, secret=account.api_secret)
-        if account.use_proxy:
-            client.proxies = {'https': account.proxy, 'http': account.proxy}
+        client = pool.for_account(account)
         result = client.change_leverage(
             symbol,
             leverage,
@@ -339,92 +436,274 @@ def copy_trade_account(account_id: int, data: dict) -> None:
         raise e
 
 
+def copy_order(
+    account: CopyTradeAccount,
+    symbol: Symbol,
+    master_order: DataOrder,
+    coefficient: float,
+    stamps: dict = None
+) -> DataOrder | None:
+    copy_trade_order: DataOrder = None
+    extra = {'account': account.id, 'symbol': symbol}
+    quantity = round(master_order.orig_qty * coefficient, 3)
+    logger.info(
+        'Calculating quantity for copy trade: '
+        f'{master_order.orig_qty} * {coefficient} = {quantity}',
+        extra=extra
+    )
+    trade = BinanceCopyTrade(
+        account=account,
+        symbol=symbol,
+        side=master_order.side,
+        quantity=quantity,
+        working_type=master_order.working_type,
+        time_in_force=master_order.time_in_force,
+        stamps=stamps
+    )
+    if master_order.status == 'NEW':
+        if master_order.order_type == 'MARKET':
+            copy_trade_order = trade.place_market_order(
+                reduce_only=master_order.reduce_only
+            )
+        elif master_order.order_type == 'LIMIT':
+            copy_trade_order = trade.place_limit_order(
+                master_order.price, reduce_only=master_order.reduce_only
+            )
+        elif master_order.order_type == 'TAKE_PROFIT_MARKET':
+            copy_trade_order = trade.place_take_profit_market_order(
+                master_order.stop_price
+            )
+        elif master_order.order_type == 'STOP_MARKET':
+            copy_trade_order = trade.place_stop_loss_market_order(
+                master_order.stop_price
+            )
+        elif master_order.order_type == 'TRAILING_STOP_MARKET':
+            copy_trade_order = trade.place_trailing_stop_market_order(
+                master_order.price_rate,
+                master_order.activation_price
+            )
+    elif master_order.status == 'CANCELED':
+        try:
+            order = CopyTradeOrder.objects.get(
+                master_order_id=master_order.order_id,
+                copy_trade_account_id=account.id
+            )
+            BinanceCopyTradeOrder(
+                account, symbol.symbol, stamps).cancel_order(order.order_id)
+            extra.update(side=order.side, id=order.order_id)
+            logger.warning(
+                f'Canceled order, related to {master_order.order_id=}',
+                extra=extra
+            )
+        except CopyTradeOrder.DoesNotExist:
+            logger.critical(
+                f'Not found copy trade order for {master_order.order_id=}',
+                extra=extra
+            )
+    elif master_order.status == 'FILLED':
+        ...
+    elif master_order.status == 'EXPIRED':
+        ...
+    if copy_trade_order:
+        copy_trade_order.symbol = symbol
+        copy_trade_order.master_order_id = master_order.order_id
+        copy_trade_order.copy_trade_account = account
+        defaults = copy_trade_order.to_dict()
+        defaults.pop('order_id')
+        extra.update(side=copy_trade_order.side, id=copy_trade_order.order_id)
+        o, created = CopyTradeOrder.objects.update_or_create(
+            order_id=copy_trade_order.order_id,
+            defaults=defaults
+        )
+        if created:
+            logger.debug(
+                f'Created order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
+                extra=extra
+            )
+        else:
+            logger.debug(
+                f'Updated order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
+                extra=extra
+            )
+    return copy_trade_order
+
+
 @app.task
-def copy_trade_order(account_id: int, data: dict) -> None:
+def copy_trade_order(account_id: int, data: dict, stamps: dict = None) -> None:
     try:
+        stamps = dict(stamps or {}, task_start=latency.now())
         master_order: DataOrder = DataOrder(**data)
-        account = CopyTradeAccount.objects.get(id=account_id)
+        account = followers.get(account_id)
         symbol = Symbol.objects.get(symbol=master_order.symbol)
-        copy_trade_order: DataOrder = None
-        extra = {'account': account.id, 'symbol': symbol}
         coefficient = MainSettings.objects.values_list('coefficient', flat=True).first()
-        quantity = round(master_order.orig_qty * coefficient, 3)
-        logger.info(
-            'Calculating quantity for copy trade: '
-            f'{master_order.orig_qty} * {coefficient} = {quantity}',
-            extra=extra
+        copy_order(account, symbol, master_order, coefficient, stamps)
+        latency.record(account.id, symbol.symbol, stamps, get_account_egress(account))
+    except Exception as e:
+        logger.exception(e)
+        raise e
+
+
+def _copy_order_for_follower(
+    account: CopyTradeAccount,
+    symbol: Symbol,
+    master_order: DataOrder,
+    coefficient: float,
+    stamps: dict = None,
+    egress: str = None
+) -> dict:
+    extra = {'account': account.id, 'symbol': symbol}
+    start = time.monotonic()
+    stamps = dict(stamps or {})
+    try:
+        o: DataOrder = copy_order(account, symbol, master_order, coefficient, stamps)
+        latency.record(account.id, symbol.symbol, stamps, egress)
+        result = {'account_id': account.id, 'status': 'success'}
+        if o:
+            result['order_id'] = o.order_id
+    except Exception as e:
+        logger.exception(e, extra=extra)
+        result = {'account_id': account.id, 'status': 'failed', 'detail': str(e)}
+    result['elapsed'] = round(time.monotonic() - start, 3)
+    result['egress'] = egress
+    return result
+
+
+def _track_db_connection(opened: list) -> None:
+    # pool threads are reused between followers, so every thread keeps its
+    # connection until the fan-out is over instead of reconnecting per follower
+    opened.append(db.connections[db.DEFAULT_DB_ALIAS])
+
+
+def _close_db_connections(opened: list) -> None:
+    for conn in opened:
+        conn.inc_thread_sharing()
+        try:
+            conn.close()
+        finally:
+            conn.dec_thread_sharing()
+
+
+def get_egress_summary(detail: list[dict]) -> dict:
+    summary = {}
+    for i in detail:
+        egress = summary.setdefault(
+            i.get('egress'), {'followers': 0, 'succeeded': 0, 'max_elapsed': 0.0}
         )
-        trade = BinanceCopyTrade(
-            account=account,
-            symbol=symbol,
-            side=master_order.side,
-            quantity=quantity,
-            working_type=master_order.working_type,
-            time_in_force=master_order.time_in_force,
+        egress['followers'] += 1
+        egress['succeeded'] += i['status'] == 'success'
+        egress['max_elapsed'] = max(egress['max_elapsed'], i.get('elapsed', 0.0))
+    for egress in summary.values():
+        elapsed = egress['max_elapsed']
+        egress['throughput'] = round(egress['succeeded'] / elapsed, 2) if elapsed else 0
+    return summary
+
+
+def split_workers(groups: dict[str, list]) -> dict[str, int]:
+    # One cap for the whole fan-out, shared between egresses by the trade
+    # weight they have left, every egress gets at least one worker
+    budgets = {}
+    for egress in groups:
+        try:
+            used = limiter.get_usage(egress)
+        except Exception as e:
+            logger.warning(f'Weight limiter is unavailable: {e!r}')
+            used = 0
+        budgets[egress] = max(
+            int(settings.BINANCE_WEIGHT_LIMIT * PRIORITIES['trade']) - used, 0
         )
-        if master_order.status == 'NEW':
-            if master_order.order_type == 'MARKET':
-                copy_trade_order = trade.place_market_order(
-                    reduce_only=master_order.reduce_only
-                )
-            elif master_order.order_type == 'LIMIT':
-                copy_trade_order = trade.place_limit_order(
-                    master_order.price, reduce_only=master_order.reduce_only
-                )
-            elif master_order.order_type == 'TAKE_PROFIT_MARKET':
-                copy_trade_order = trade.place_take_profit_market_order(
-                    master_order.stop_price
-                )
-            elif master_order.order_type == 'STOP_MARKET':
-                copy_trade_order = trade.place_stop_loss_market_order(
-                    master_order.stop_price
-                )
-            elif master_order.order_type == 'TRAILING_STOP_MARKET':
-                copy_trade_order = trade.place_trailing_stop_market_order(
-                    master_order.price_rate,
-                    master_order.activation_price
-                )
-        elif master_order.status == 'CANCELED':
-            try:
-                order = CopyTradeOrder.objects.get(
-                    master_order_id=master_order.order_id)
-                BinanceCopyTradeOrder(
-                    account, symbol.symbol).cancel_order(order.order_id)
-                extra.update(side=order.side, id=order.order_id)
-                logger.warning(
-                    f'Canceled order, related to {master_order.order_id=}',
-                    extra=extra
-                )
-            except CopyTradeOrder.DoesNotExist:
-                logger.critical(
-                    f'Not found copy trade order for {master_order.order_id=}',
-                    extra=extra
-                )
-        elif master_order.status == 'FILLED':
-            ...
-        elif master_order.status == 'EXPIRED':
-            ...
-        if copy_trade_order:
-            copy_trade_order.symbol = symbol
-            copy_trade_order.master_order_id = master_order.order_id
-            copy_trade_order.copy_trade_account = account
-            defaults = copy_trade_order.to_dict()
-            defaults.pop('order_id')
-            extra.update(side=copy_trade_order.side, id=copy_trade_order.order_id)
-            o, created = CopyTradeOrder.objects.update_or_create(
-                order_id=copy_trade_order.order_id,
-                defaults=defaults
+    total = min(settings.COPY_TRADE_MAX_WORKERS, sum(len(i) for i in groups.values()))
+    workers = {egress: 1 for egress in groups}
+    spare = total - len(workers)
+    while spare > 0:
+        hungry = [i for i in groups if workers[i] < len(groups[i])]
+        if not hungry:
+            break
+        budget = sum(budgets[i] for i in hungry)
+        shares = {
+            i: spare * budgets[i] // budget if budget else spare // len(hungry)
+            for i in hungry
+        }
+        if not any(shares.values()):
+            shares[max(hungry, key=lambda i: budgets[i])] = 1
+        for egress, share in shares.items():
+            share = min(share, len(groups[egress]) - workers[egress], spare)
+            workers[egress] += share
+            spare -= share
+    return workers
+
+
+@app.task
+def copy_trade_orders(data: dict, stamps: dict = None, account_ids: list[int] = None) -> list[dict]:
+    try:
+        stamps = dict(stamps or {}, task_start=latency.now())
+        master_order: DataOrder = DataOrder(**data)
+        extra = {'symbol': master_order.symbol, 'id': master_order.order_id}
+        symbol = Symbol.objects.get(symbol=master_order.symbol)
+        coefficient = MainSettings.objects.values_list('coefficient', flat=True).first()
+        accounts = followers.accounts()
+        if account_ids is not None:
+            account_ids = set(account_ids)
+            accounts = [i for i in accounts if i.id in account_ids]
+        if not accounts:
+            return []
+        groups: dict[str, list[CopyTradeAccount]] = {}
+        for account in accounts:
+            groups.setdefault(get_account_egress(account), []).append(account)
+        timeout = settings.COPY_TRADE_FOLLOWER_TIMEOUT
+        # Every egress gets its own workers, so a slow proxy or an exhausted
+        # IP weight budget does not hold back followers behind other egresses.
+        # Followers beyond max_workers wait for a free thread, so the overall
+        # deadline grows with the number of waves, each capped by the timeout.
+        workers = split_workers(groups)
+        waves = 1
+        executors = []
+        futures = {}
+        opened = []
+        for egress, group in groups.items():
+            max_workers = workers[egress]
+            waves = max(waves, -(-len(group) // max_workers))
+            executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f'copy_trade_{egress}',
+                initializer=_track_db_connection, initargs=(opened,)
             )
-            if created:
-                logger.debug(
-                    f'Created order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
-                    extra=extra
-                )
-            else:
-                logger.debug(
-                    f'Updated order in database {o.status=} {o.orig_qty=} {o.orig_type=}',
-                    extra=extra
+            executors.append(executor)
+            for account in group:
+                future = executor.submit(
+                    _copy_order_for_follower,
+                    account, symbol, master_order, coefficient, stamps, egress
                 )
+                futures[future] = account
+        # A lane task must not return before every follower order is answered,
+        # the next event of the same lane would otherwise overtake it, so it
+        # waits for all of them and never cancels the queued ones.
+        in_lane = account_ids is not None
+        detail = []
+        try:
+            for future in as_completed(
+                futures, timeout=None if in_lane else timeout * waves + 1
+            ):
+                detail.append(future.result())
+        except FuturesTimeoutError:
+            for future, account in futures.items():
+                if not future.done():
+                    detail.append({
+                        'account_id': account.id,
+                        'status': 'timeout',
+                        'egress': get_account_egress(account)
+                    })
+        finally:
+            # after the deadline only the queued followers are cancelled, the ones
+            # in flight are waited for, so their connections can be closed here
+            for executor in executors:
+                executor.shutdown(wait=True, cancel_futures=not in_lane)
+            _close_db_connections(opened)
+        succeeded = len([i for i in detail if i['status'] == 'success'])
+        logger.info(
+            f'Copied {master_order.status} {master_order.order_type} order '
+            f'to {succeeded}/{len(accounts)} followers {get_egress_summary(detail)}',
+            extra=extra
+        )
+        return detail
     except Exception as e:
         logger.exception(e)
         raise e
@@ -500,55 +779,47 @@ def replacing_orders(
             side=position.side,
             quantity=position.quantity
         )
-        if 'take_profit_rate' in changed_fields:
-            order = position.orders.filter(
+        current = {
+            order.order_type: order for order in position.orders.filter(
                 status__in=['NEW', 'PARTIALLY_FILLED'],
-                order_type='TAKE_PROFIT_MARKET'
-            ).last()
-            if order:
-                order.cancel()
-                logger.debug('Current take profit order canceled', extra=extra)
-            else:
-                logger.debug('Current take profit order not found', extra=extra)
+                order_type__in=['TAKE_PROFIT_MARKET', 'STOP_MARKET', 'TRAILING_STOP_MARKET']
+            ).order_by('id')
+        }
+        replacements = []
+        if 'take_profit_rate' in changed_fields:
+            params = None
             if i.take_profit_rate:
                 price = position.get_take_profit_price(i.take_profit_rate)
-                trade.place_take_profit_market_order(price)
-            else:
-                logger.debug('Take profit was disabled', extra=extra)
+                params = trade.get_take_profit_market_params(price)
+            replacements.append((current.get('TAKE_PROFIT_MARKET'), params))
         if 'stop_loss_rate' in changed_fields:
-            order = position.orders.filter(
-                status__in=['NEW', 'PARTIALLY_FILLED'],
-                order_type='STOP_MARKET'
-            ).last()
-            if order:
-                order.cancel()
-                logger.debug('Current stop loss order canceled', extra=extra)
-            else:
-                logger.debug('Current stop loss order not found', extra=extra)
+            params = None
             if i.stop_loss_rate:
                 price = position.get_stop_loss_price(i.stop_loss_rate)
-                trade.place_stop_loss_market_order(price)
-            else:
-                logger.debug('Stop loss was disabled', extra=extra)
+                params = trade.get_stop_loss_market_params(price)
+            replacements.append((current.get('STOP_MARKET'), params))
         if 'trailing_stop_activation_price_rate' in changed_fields:
-            order = position.orders.filter(
-                status__in=['NEW', 'PARTIALLY_FILLED'],
-                order_type='TRAILING_STOP_MARKET'
-            ).last()
-            if order:
-                order.cancel()
-                logger.debug('Current trailing stop order canceled', extra=extra)
-            else:
-                logger.debug('Current trailing stop order not found', extra=extra)
+            params = None
             if i.trailing_stop_activation_price_rate:
                 activation_price = position.get_trailing_stop_activation_price(
                     i.trailing_stop_activation_price_rate
                 )
-                trade.place_trailing_stop_market_order(
+                params = trade.get_trailing_stop_market_params(
                     validated_data['trailing_stop_callback_rate'], activation_price
                 )
-            else:
-                logger.debug('Trailing stop was disabled', extra=extra)
+            replacements.append((current.get('TRAILING_STOP_MARKET'), params))
+        for order, params in replacements:
+            logger.debug(
+                f'Replacing order {order.order_id if order else None} '
+                f'with {params["type"] if params else None}',
+                extra=extra
+            )
+        trade.replace_orders(replacements)
+        # saved here so the settings follow the orders when the api does not wait
+        position_settings = PositionSettings.objects.get(position_id=position.id)
+        for field, value in validated_data.items():
+            setattr(position_settings, field, value)
+        position_settings.save()
         logger.info('Updated position settings successfully', extra=extra)
         return {'error': False}
     except Exception as e:
@@ -556,8 +827,70 @@ def replacing_orders(
         return {'error': True, 'detail': str(e)}
 
 
+def _close_position(position: Position, client_order_id: str = None) -> dict:
+    extra = dict(symbol=position.symbol, side=position.side, id=position.id)
+    logger.debug('Closing position', extra=extra)
+    try:
+        trade = BinanceTrade(
+            symbol=position.symbol,
+            side=position.side,
+            quantity=position.quantity
+        )
+        trade.place_market_order(reduce_only=True, client_order_id=client_order_id)
+        logger.warning(
+            f'Position closed successfully {position.unrealized_profit=}',
+            extra=extra
+        )
+        return {'position_id': position.id, 'status': 'success'}
+    except Exception as e:
+        logger.exception(e, extra=extra)
+        return {'position_id': position.id, 'status': 'failed', 'detail': str(e)}
+    finally:
+        db.connection.close()
+
+
+def _close_follower_positions(account: CopyTradeAccount, positions: dict[str, Position]) -> list[dict]:
+    # followers positions are not stored, so they are read from the exchange first
+    extra = {'account': account.id}
+    detail = []
+    try:
+        client = pool.for_account(account)
+        items = client.sign_request('GET', url_path='/fapi/v3/positionRisk')
+        for i in items:
+            p: DataPosition = DataPosition(**i)
+            position = positions.get(p.symbol)
+            if not position or not p.position_amt:
+                continue
+            extra.update(symbol=p.symbol)
+            try:
+                trade = BinanceCopyTrade(
+                    account=account,
+                    symbol=position.symbol,
+                    side='SELL' if p.position_amt > 0 else 'BUY',
+                    quantity=abs(p.position_amt),
+                    working_type='MARK_PRICE',
+                    time_in_force='GTC'
+                )
+                trade.place_market_order(reduce_only=True)
+                detail.append({'position_id': position.id, 'account_id': account.id, 'status': 'success'})
+            except Exception as e:
+                logger.exception(e, extra=extra)
+                detail.append({
+                    'position_id': position.id, 'account_id': account.id,
+                    'status': 'failed', 'detail': str(e)
+                })
+    except Exception as e:
+        logger.exception(e, extra=extra)
+        detail.append({'account_id': account.id, 'status': 'failed', 'detail': str(e)})
+    finally:
+        db.connection.close()
+    return detail
+
+
 @app.task
-def close_positions(position_id: int = None, unrealized_profit: bool = None) -> dict:
+def close_positions(
+    position_id: int = None, unrealized_profit: bool = None, followers_too: bool = False
+) -> dict:
     if position_id:
         positions = Position.objects.filter(id=position_id)
     else:
@@ -573,27 +906,40 @@ def close_positions(position_id: int = None, unrealized_profit: bool = None) ->
             logger.debug(
                 f'Found {positions.count()} open positions. Closing all positions'
             )
+    positions = list(positions)
+    if not positions:
+        return {'error': False, 'detail': []}
+    accounts = followers.accounts() if followers_too else []
+    by_symbol = {i.symbol_id: i for i in positions}
+    # master closes are not copied when the followers are closed here,
+    # otherwise every follower position would get two reduce only orders
+    prefix = CLOSE_WITH_FOLLOWERS_PREFIX if followers_too else None
+    # all reduce only orders are sent, the deadline only limits how long the
+    # response waits, whatever is not done by then is reported as pending
+    executor = ThreadPoolExecutor(
+        max_workers=min(settings.CLOSE_POSITIONS_MAX_WORKERS, len(positions) + len(accounts)),
+        thread_name_prefix='close_positions'
+    )
+    futures = {
+        executor.submit(
+            _close_position, i, f'{prefix}{uuid.uuid4().hex[:20]}' if prefix else None
+        ): {'position_id': i.id}
+        for i in positions
+    }
+    for account in accounts:
+        future = executor.submit(_close_follower_positions, account, by_symbol)
+        futures[future] = {'account_id': account.id}
     detail = []
-    for position in positions:
-        extra = dict(symbol=position.symbol, side=position.side, id=position.id)
-        logger.debug('Closing position', extra=extra)
-        try:
-            trade = BinanceTrade(
-                symbol=position.symbol,
-                side=position.side,
-                quantity=position.quantity
-            )
-            trade.place_market_order(reduce_only=True)
-            logger.warning(
-                f'Position closed successfully {position.unrealized_profit=}',
-                extra=extra
-            )
-            detail.append({'position_id': position.id, 'status': 'success'})
-        except Exception as e:
-            logger.exception(e, extra=extra)
-            detail.append(
-                {'position_id': position.id, 'status': 'failed', 'detail': str(e)}
-            )
+    try:
+        for future in as_completed(futures, timeout=settings.CLOSE_POSITIONS_TIMEOUT):
+            result = future.result()
+            detail.extend(result if isinstance(result, list) else [result])
+    except FuturesTimeoutError:
+        for future, key in futures.items():
+            if not future.done():
+                detail.append(dict(key, status='pending'))
+    finally:
+        executor.shutdown(wait=False)
     if all(i['status'] == 'success' for i in detail):
         return {'error': False, 'detail': detail}
     return {'error': True, 'detail': detail}
@@ -602,7 +948,7 @@ def close_positions(position_id: int = None, unrealized_profit: bool = None) ->
 @app.task
 def open_position_signal(symbol: str, side: str) -> None:
     try:
-        with TaskLock(f'task_open_position_{symbol}'):
+        with TaskLock(f'task_open_position_{symbol}', name='task_open_position'):
             symbol = Symbol.objects.get(symbol=symbol)
             symbol.leverage = settings.BINANCE_LEVERAGE
             symbol.save(update_fields=['leverage'])
@@ -658,7 +1004,7 @@ def open_position_manually(self, data: dict) -> dict:
 def price_change_percent_strategy(data: dict) -> dict:
     try:
         extra = {'side': data['side']}
-        client = UMFutures(key=binance.api_key, secret=binance.api_secret)
+        client = pool.master()
         symbol_percent: list[tuple[str, float]] = (
             sorted(
                 [
@@ -681,7 +1027,7 @@ def price_change_percent_strategy(data: dict) -> dict:
         symbols = []
         for symbol, _ in symbol_percent:
             extra.update(symbol=symbol)
-            if Position.objects.filter(symbol=symbol, is_open=True).exists():
+            if open_positions.is_open(symbol):
                 logger.warning('Position already opened. Skipping', extra=extra)
                 continue
             open_position_signal.delay(symbol, data['side'])
@@ -1,3 +1,117 @@
-from django.test import TestCase
+from types import SimpleNamespace as Namespace
+from unittest import mock
+from django.test import SimpleTestCase
+from exchange_binance import calc, trade
+from exchange_binance.models import Symbol
+from exchange_binance.views.api import get_job_response
+from general.exceptions import PlaceOrderException
 
-# Create your tests here.
+
+class ReplaceOrdersTest(SimpleTestCase):
+    def setUp(self):
+        self.calls = []
+        patches = [
+            mock.patch.object(trade.pool, 'master', return_value=mock.Mock()),
+            mock.patch.object(trade, 'quantity_to_precision', return_value='0.01'),
+            mock.patch.object(
+                trade.BinanceOrder, 'cancel_multiple_orders',
+                lambda _, order_ids: self.calls.append(('cancel', order_ids))
+            ),
+            mock.patch.object(
+                trade.BinanceTrade, 'place_batch_orders',
+                lambda _, orders: self.calls.append(('place', orders)) or [
+                    Namespace(order_id=i) for i, _ in enumerate(orders)
+                ]
+            ),
+        ]
+        for i in patches:
+            i.start()
+            self.addCleanup(i.stop)
+        self.trade = trade.BinanceTrade(Symbol(symbol='BTCUSDT'), 'BUY', 0.01)
+
+    def test_cancels_before_placing(self):
+        take_profit = {'type': 'TAKE_PROFIT_MARKET', 'side': 'SELL'}
+        stop_loss = {'type': 'STOP_MARKET', 'side': 'SELL'}
+        result = self.trade.replace_orders([
+            (Namespace(order_id=1), take_profit),
+            (Namespace(order_id=2), None),
+            (None, stop_loss),
+        ])
+        self.assertEqual(
+            self.calls, [('cancel', [1, 2]), ('place', [take_profit, stop_loss])]
+        )
+        self.assertEqual([i and i.order_id for i in result], [0, None, 1])
+
+    def test_only_cancels(self):
+        self.trade.replace_orders([(Namespace(order_id=1), None)])
+        self.assertEqual(self.calls, [('cancel', [1])])
+
+    def test_failed_placement_raises(self):
+        with mock.patch.object(trade.BinanceTrade, 'place_batch_orders', return_value=[None]):
+            with self.assertRaises(PlaceOrderException):
+                self.trade.replace_orders([(Namespace(order_id=1), {'type': 'STOP_MARKET'})])
+        self.assertEqual(self.calls, [('cancel', [1])])
+
+
+class JobResponseTest(SimpleTestCase):
+    def test_missing_job(self):
+        self.assertEqual(get_job_response(None).status_code, 404)
+
+    def test_statuses(self):
+        self.assertIsNone(get_job_response({'job_id': '1', 'status': 'SUCCESS'}))
+        self.assertEqual(get_job_response({'job_id': '1', 'status': 'FAILURE'}).status_code, 400)
+        self.assertEqual(get_job_response({'job_id': '1', 'status': 'PENDING'}).status_code, 202)
+
+
+class PriceToPrecisionTest(SimpleTestCase):
+    def setUp(self):
+        patch = mock.patch.object(
+            calc.symbol_rules, 'get', lambda symbol: calc.SymbolRules.from_data(symbol.data)
+        )
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def price(self, tick_size: str, price: float) -> str:
+        data = {
+            'symbol': 'BTCUSDT', 'pricePrecision': 8, 'quantityPrecision': 3,
+            'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': tick_size}]
+        }
+        return calc.price_to_precision(Symbol(symbol='BTCUSDT', data=data), price)
+
+    def test_exact_tick_multiples(self):
+        self.assertEqual(self.price('0.1', 0.3), '0.3')
+        self.assertEqual(self.price('0.10', 84412.3), '84412.3')
+        self.assertEqual(self.price('0.01', 1.15), '1.15')
+        self.assertEqual(self.price('0.00001', 1.00001), '1.00001')
+        self.assertEqual(self.price('1', 84410.0), '84410')
+        self.assertEqual(self.price('10', 84410.0), '84410')
+        self.assertEqual(self.price('0.05', 1.25), '1.25')
+        self.assertEqual(self.price('0.1', 0.0), '0')
+        for i in range(0, 1000000, 37):
+            self.assertEqual(self.price('0.01', i / 100), f'{i / 100:.2f}'.rstrip('0').rstrip('.'))
+
+    def test_just_below_tick(self):
+        self.assertEqual(self.price('0.1', 0.29999), '0.2')
+        self.assertEqual(self.price('0.10', 84412.39999), '84412.3')
+        self.assertEqual(self.price('1', 84409.999), '84409')
+        self.assertEqual(self.price('10', 84409.99), '84400')
+        self.assertEqual(self.price('1', 0.9999999), '0')
+        self.assertEqual(self.price('0.00001', 1.0000099), '1')
+        self.assertEqual(self.price('0.05', 1.2499), '1.2')
+
+    def test_scientific_tick(self):
+        self.assertEqual(self.price('1E-8', 0.000123456789), '0.00012345')
+        self.assertEqual(self.price('1e-8', 0.00000003), '0.00000003')
+        self.assertEqual(self.price('1E-8', 1.5e-07), '0.00000015')
+        self.assertEqual(self.price('1E+1', 84412.37), '84410')
+
+    def test_large_prices(self):
+        self.assertEqual(self.price('0.01', 123456789012.34567), '123456789012.34')
+        self.assertEqual(self.price('0.1', 999999999999.9), '999999999999.9')
+        self.assertEqual(self.price('1', 1e22), '10000000000000000000000')
+        self.assertEqual(self.price('100', 1.23456789e15), '1234567890000000')
+
+    def test_string_and_negative(self):
+        self.assertEqual(self.price('0.1', '100.50'), '100.5')
+        self.assertEqual(self.price('0.1', -0.3), '-0.3')
+        self.assertEqual(self.price('0.1', -1.29), '-1.2')
@@ -1,20 +1,25 @@
 import logging
-from binance.um_futures import UMFutures
-from binance.error import Error
+from binance.error import Error, ClientError
 from django.conf import settings
 from general.exceptions import PlaceOrderException, CancelOrderException
 from exchange_binance.calc import price_to_precision, quantity_to_precision
-from exchange_binance.credentials import binance
+from exchange_binance.clients import pool
+from exchange_binance.ws import WebSocketBinanceOrderApi
+from exchange_binance import latency
 from exchange_binance.models import Symbol, CopyTradeAccount
 from general.data import DataOrder
 
 
 logger = logging.getLogger(__name__)
 
+BATCH_ORDERS_LIMIT = 5
+# master closes with this client order id prefix are not copied, the followers are closed directly
+CLOSE_WITH_FOLLOWERS_PREFIX = 'close_followers_'
+
 
 class BinanceTrade():
     def __init__(self, symbol: Symbol, side: str, quantity: float):
-        self.client = UMFutures(key=binance.api_key, secret=binance.api_secret)
+        self.client = pool.master()
         self.symbol = symbol
         self.side = side
         self.quantity = quantity_to_precision(symbol, quantity)
@@ -23,6 +28,9 @@ class BinanceTrade():
         self.recv_window = settings.BINANCE_RECV_WINDOW
         self.extra = {'symbol': self.symbol, 'side': self.side}
 
+    def _new_order(self, **params) -> dict:
+        return self.client.new_order(**params)
+
     def get_side(self) -> str:
         if hasattr(self, 'account'):
             return self.side
@@ -47,7 +55,7 @@ class BinanceTrade():
             raise PlaceOrderException(e) from None
 
     def place_market_order(
-        self, quantity: float = None, reduce_only: bool = False
+        self, quantity: float = None, reduce_only: bool = False, client_order_id: str = None
     ) -> DataOrder:
         try:
             params = dict(
@@ -62,6 +70,8 @@ class BinanceTrade():
             if quantity:
                 quantity = quantity_to_precision(self.symbol, quantity)
                 params['quantity'] = quantity
+            if client_order_id:
+                params['newClientOrderId'] = client_order_id
             if reduce_only:
                 params['reduceOnly'] = True
                 params['side'] = self.get_side()
@@ -69,7 +79,7 @@ class BinanceTrade():
                     f'Closing position quantity={params["quantity"]}',
                     extra=self.extra
                 )
-            result = self.client.new_order(**params)
+            result = self._new_order(**params)
             o: DataOrder = DataOrder(**result)
             self.extra.update(id=o.order_id)
             logger.info(
@@ -110,7 +120,7 @@ class BinanceTrade():
                     f'Closing position quantity={params["quantity"]}',
                     extra=self.extra
                 )
-            result = self.client.new_order(**params)
+            result = self._new_order(**params)
             o: DataOrder = DataOrder(**result)
             self.extra.update(id=o.order_id, side=o.side)
             logger.info(
@@ -126,19 +136,22 @@ class BinanceTrade():
             )
             raise PlaceOrderException(e) from None
 
+    def get_stop_loss_market_params(self, price: float) -> dict:
+        return dict(
+            symbol=self.symbol,
+            side=self.get_side(),
+            type='STOP_MARKET',
+            closePosition=True,
+            stopPrice=price_to_precision(self.symbol, price),
+            workingType=self.working_type,
+            recvWindow=self.recv_window
+        )
+
     def place_stop_loss_market_order(self, price: float) -> DataOrder:
         try:
-            price = price_to_precision(self.symbol, price)
-            side = self.get_side()
-            result = self.client.new_order(
-                symbol=self.symbol,
-                side=side,
-                type='STOP_MARKET',
-                closePosition=True,
-                stopPrice=price,
-                workingType=self.working_type,
-                recvWindow=self.recv_window
-            )
+            params = self.get_stop_loss_market_params(price)
+            price, side = params['stopPrice'], params['side']
+            result = self._new_order(**params)
             o: DataOrder = DataOrder(**result)
             self.extra.update(id=o.order_id, side=side)
             logger.info(
@@ -153,27 +166,32 @@ class BinanceTrade():
             )
             raise PlaceOrderException(e) from None
 
+    def get_take_profit_market_params(
+        self, price: float, quantity: float = None, reduce_only: bool = False
+    ) -> dict:
+        params = dict(
+            symbol=self.symbol,
+            side=self.get_side(),
+            type='TAKE_PROFIT_MARKET',
+            closePosition=True,
+            stopPrice=price_to_precision(self.symbol, price),
+            workingType=self.working_type,
+            recvWindow=self.recv_window
+        )
+        if quantity:
+            params['quantity'] = quantity_to_precision(self.symbol, quantity)
+        if reduce_only:
+            params['reduceOnly'] = True
+        return params
+
     def place_take_profit_market_order(
         self, price: float, quantity: float = None, reduce_only: bool = False
     ) -> DataOrder:
         try:
-            price = price_to_precision(self.symbol, price)
-            side = self.get_side()
-            params = dict(
-                symbol=self.symbol,
-                side=side,
-                type='TAKE_PROFIT_MARKET',
-                closePosition=True,
-                stopPrice=price,
-                workingType=self.working_type,
-                recvWindow=self.recv_window
-            )
-            if quantity:
-                quantity = quantity_to_precision(self.symbol, quantity)
-                params['quantity'] = quantity
-            if reduce_only:
-                params['reduceOnly'] = True
-            result = self.client.new_order(**params)
+            params = self.get_take_profit_market_params(price, quantity, reduce_only)
+            price, side = params['stopPrice'], params['side']
+            quantity = params.get('quantity', quantity)
+            result = self._new_order(**params)
             o: DataOrder = DataOrder(**result)
             self.extra.update(id=o.order_id, side=side)
             logger.info(
@@ -190,22 +208,26 @@ class BinanceTrade():
             )
             raise PlaceOrderException(e) from None
 
+    def get_trailing_stop_market_params(
+            self, callback_rate: float, activation_price: float) -> dict:
+        return dict(
+            symbol=self.symbol,
+            side=self.get_side(),
+            type='TRAILING_STOP_MARKET',
+            quantity=self.quantity,
+            callbackRate=round(callback_rate, 1),
+            activationPrice=price_to_precision(self.symbol, activation_price),
+            workingType=self.working_type,
+            recvWindow=self.recv_window
+        )
+
     def place_trailing_stop_market_order(
             self, callback_rate: float, activation_price: float) -> DataOrder:
         try:
-            callback_rate = round(callback_rate, 1)
-            activation_price = price_to_precision(self.symbol, activation_price)
-            side = self.get_side()
-            result = self.client.new_order(
-                symbol=self.symbol,
-                side=side,
-                type='TRAILING_STOP_MARKET',
-                quantity=self.quantity,
-                callbackRate=callback_rate,
-                activationPrice=activation_price,
-                workingType=self.working_type,
-                recvWindow=self.recv_window
-            )
+            params = self.get_trailing_stop_market_params(callback_rate, activation_price)
+            callback_rate = params['callbackRate']
+            activation_price, side = params['activationPrice'], params['side']
+            result = self._new_order(**params)
             o: DataOrder = DataOrder(**result)
             self.extra.update(id=o.order_id, side=side)
             logger.info(
@@ -222,17 +244,84 @@ class BinanceTrade():
             )
             raise PlaceOrderException(e) from None
 
+    def place_batch_orders(self, orders: list[dict]) -> list[DataOrder | None]:
+        # binance accepts up to five orders per call, a rejected order
+        # does not fail the others and is returned as None in its place
+        result = []
+        for i in range(0, len(orders), BATCH_ORDERS_LIMIT):
+            chunk = orders[i:i + BATCH_ORDERS_LIMIT]
+            try:
+                items = self._new_batch_order(chunk)
+            except Error as e:
+                logger.error(
+                    f'Failed to place batch of {len(chunk)} orders. {e.error_message}',
+                    extra=self.extra
+                )
+                raise PlaceOrderException(e) from None
+            for params, item in zip(chunk, items):
+                extra = dict(self.extra, side=params['side'])
+                if 'code' in item:
+                    logger.error(
+                        f'Failed to place {params["type"]} order in batch. {item["msg"]}',
+                        extra=extra
+                    )
+                    result.append(None)
+                    continue
+                o: DataOrder = DataOrder(**item)
+                extra.update(id=o.order_id)
+                logger.info(
+                    f'Placed order in batch {o.status=} {o.stop_price=} '
+                    f'{o.orig_qty=} {o.orig_type=}',
+                    extra=extra
+                )
+                result.append(o)
+        return result
+
+    def replace_orders(self, replacements: list[tuple]) -> list[DataOrder | None]:
+        # replacements are (current order or None, new order params or None).
+        # Binance cannot modify TP, SL and trailing stop orders, so the current
+        # orders are cancelled in one batch and only then the new ones are placed,
+        # an old and a new protective order are never live together
+        result = [None] * len(replacements)
+        cancels = [order.order_id for order, _ in replacements if order]
+        places = [(index, params) for index, (_, params) in enumerate(replacements) if params]
+        if cancels:
+            BinanceOrder(str(self.symbol)).cancel_multiple_orders(cancels)
+        if places:
+            placed = self.place_batch_orders([i[1] for i in places])
+            for (index, params), o in zip(places, placed):
+                result[index] = o
+        failed = len([i for i, _ in places if result[i] is None])
+        if failed:
+            raise PlaceOrderException(f'Failed to place {failed} of {len(places)} orders')
+        return result
+
+    def _new_batch_order(self, orders: list[dict]) -> list[dict]:
+        # every value of a batch order is sent as a string, booleans in lower case
+        batch = [
+            {
+                k: str(v).lower() if isinstance(v, bool) else str(v)
+                for k, v in params.items() if k != 'recvWindow'
+            }
+            for params in orders
+        ]
+        # new_batch_order of the connector takes no recvWindow
+        return self.client.sign_request(
+            'POST', '/fapi/v1/batchOrders',
+            {'batchOrders': batch, 'recvWindow': self.recv_window}, True
+        )
+
 
 class BinanceOrder():
     def __init__(self, symbol: str) -> None:
-        self.client = UMFutures(
-            key=binance.api_key,
-            secret=binance.api_secret
-        )
+        self.client = pool.master()
         self.symbol = symbol
         self.recv_window = settings.BINANCE_RECV_WINDOW
         self.extra = {'symbol': symbol}
 
+    def _cancel_order(self, **params) -> dict:
+        return self.client.cancel_order(**params)
+
     def cancel_all_open_orders(self, symbol: str = '') -> None:
         try:
             if not symbol:
@@ -279,7 +368,7 @@ class BinanceOrder():
         try:
             if not symbol:
                 symbol = self.symbol
-            result = self.client.cancel_order(
+            result = self._cancel_order(
                 symbol=symbol,
                 orderId=order_id,
                 recvWindow=self.recv_window
@@ -295,14 +384,27 @@ class BinanceOrder():
 
 
 class BinanceCopyTradeOrder(BinanceOrder):
-    def __init__(self, account: CopyTradeAccount, symbol: str) -> None:
-        self.client = UMFutures(key=account.api_key, secret=account.api_secret)
-        if account.use_proxy:
-            self.client.proxies = {'https': account.proxy, 'http': account.proxy}
+    def __init__(
+        self, account: CopyTradeAccount, symbol: str, stamps: dict = None
+    ) -> None:
+        self.client = pool.for_account(account)
+        self.stamps = stamps
+        self.ws_api = None
+        if settings.COPY_TRADE_TRANSPORT == 'ws':
+            self.ws_api = WebSocketBinanceOrderApi.connect(account)
         self.symbol = symbol
         self.recv_window = settings.BINANCE_RECV_WINDOW
         self.extra = {'account': account.id, 'symbol': symbol}
 
+    def _cancel_order(self, **params) -> dict:
+        latency.stamp(self.stamps, 'sent')
+        try:
+            if self.ws_api:
+                return self.ws_api.cancel_order(**params)
+            return super()._cancel_order(**params)
+        finally:
+            latency.stamp(self.stamps, 'ack')
+
 
 class BinanceCopyTrade(BinanceTrade):
     def __init__(
@@ -312,11 +414,14 @@ class BinanceCopyTrade(BinanceTrade):
         side: str,
         quantity: float,
         working_type: str,
-        time_in_force: str
+        time_in_force: str,
+        stamps: dict = None
     ) -> None:
-        self.client = UMFutures(key=account.api_key, secret=account.api_secret)
-        if account.use_proxy:
-            self.client.proxies = {'https': account.proxy, 'http': account.proxy}
+        self.client = pool.for_account(account)
+        self.stamps = stamps
+        self.ws_api = None
+        if settings.COPY_TRADE_TRANSPORT == 'ws':
+            self.ws_api = WebSocketBinanceOrderApi.connect(account)
         self.account = account
         self.symbol = symbol
         self.side = side
@@ -325,3 +430,28 @@ class BinanceCopyTrade(BinanceTrade):
         self.time_in_force = time_in_force
         self.recv_window = settings.BINANCE_RECV_WINDOW
         self.extra = {'account': account.id, 'symbol': symbol, 'side': side}
+
+    def _new_order(self, **params) -> dict:
+        latency.stamp(self.stamps, 'sent')
+        try:
+            if self.ws_api:
+                return self.ws_api.place_order(**params)
+            return super()._new_order(**params)
+        finally:
+            latency.stamp(self.stamps, 'ack')
+
+    def _new_batch_order(self, orders: list[dict]) -> list[dict]:
+        latency.stamp(self.stamps, 'sent')
+        try:
+            if not self.ws_api:
+                return super()._new_batch_order(orders)
+            # the websocket api has no batch method
+            result = []
+            for params in orders:
+                try:
+                    result.append(self.ws_api.place_order(**params))
+                except ClientError as e:
+                    result.append({'code': e.error_code, 'msg': e.error_message})
+            return result
+        finally:
+            latency.stamp(self.stamps, 'ack')
@@ -5,7 +5,8 @@ from exchange_binance.views.api import (
     OrderAPIView, OrderListAPIView, MainSettingsAPIView, CopyTradeAccountViewSet,
     IncreasePositionAPIView, CloseAllPositionsAPIView,
     CloseAllProfitablePositionsAPIView, MasterAccountBalanceViewAPIView,
-    MasterAccountCredentialsViewAPIView, PriceChangePercentStrategyAPIView
+    MasterAccountCredentialsViewAPIView, PriceChangePercentStrategyAPIView,
+    LatencyAPIView, LockMetricsAPIView, JobAPIView
 )
 
 
@@ -22,6 +23,9 @@ urlpatterns = [
     path('master_account_balances', MasterAccountBalanceViewAPIView.as_view(), name='master_account_balances'),
     path('master_account_credentials', MasterAccountCredentialsViewAPIView.as_view(), name='master_account_credentials'),
     path('price_change_percent_strategy', PriceChangePercentStrategyAPIView.as_view(), name='price_change_percent_strategy'),
+    path('latency', LatencyAPIView.as_view(), name='latency'),
+    path('locks', LockMetricsAPIView.as_view(), name='locks'),
+    path('jobs/<str:job_id>', JobAPIView.as_view(), name='jobs_detail'),
 ]
 
 router = DefaultRouter(trailing_slash=False)
@@ -1,4 +1,5 @@
 import logging
+from django.conf import settings
 from exchange_binance.models import (
     Symbol, Position, Order, MainSettings, MasterAccount, CopyTradeAccount, PositionSettings
 )
@@ -16,18 +17,57 @@ from rest_framework import status
 from django.shortcuts import get_object_or_404
 from rest_framework import viewsets
 from rest_framework_simplejwt.views import TokenObtainPairView
-from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiExample
-from celery.exceptions import TimeLimitExceeded
+from drf_spectacular.utils import (
+    extend_schema, extend_schema_view, OpenApiExample, OpenApiParameter
+)
 from exchange_binance import tasks
+from exchange_binance.credentials import binance
+from exchange_binance import latency
+from exchange_binance import jobs
+from general.utils import get_lock_metrics, reset_lock_metrics
 
 
 logger = logging.getLogger(__name__)
 
 
+def is_followers_requested(request) -> bool:
+    return request.query_params.get('followers', '').lower() in ('1', 'true')
+
+
+def run_job(request, task, *args, **kwargs) -> dict | None:
+    # the web worker only waits a bounded time, a slower task is
+    # answered with its job id and can be polled at api/jobs/<job_id>
+    wait = settings.API_JOB_WAIT
+    try:
+        wait = min(float(request.query_params.get('wait', wait)), wait)
+    except ValueError:
+        pass
+    return jobs.wait(jobs.submit(task, *args, **kwargs), wait)
+
+
+def get_job_response(job: dict | None) -> Response | None:
+    if job is None:
+        # the cache entry is missing or has expired
+        return Response(
+            {'detail': 'Job not found or expired.'}, status=status.HTTP_404_NOT_FOUND
+        )
+    if job['status'] == 'SUCCESS':
+        return None
+    if job['status'] == 'FAILURE':
+        return Response({'detail': job.get('detail')}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(
+        {'job_id': job['job_id'], 'status': job['status']}, status=status.HTTP_202_ACCEPTED
+    )
+
+
 class CustomTokenObtainPairView(TokenObtainPairView):
     serializer_class = CustomTokenObtainPairSerializer
 
 
+followers_parameter = OpenApiParameter(
+    'followers', bool,
+    description='Also close the positions of the followers in the same symbols'
+)
 example_delete_400 = OpenApiExample(
     name='',
     description='',
@@ -66,7 +106,11 @@ class MasterAccountCredentialsViewAPIView(APIView):
             master_account, data=request.data, partial=True
         )
         if serializer.is_valid():
-            serializer.save()
+            master_account = binance.rotate(
+                serializer.validated_data['api_key'],
+                serializer.validated_data['api_secret']
+            )
+            serializer = MasterAccountCredentialsSerializer(master_account)
             return Response(serializer.data, status=status.HTTP_200_OK)
         logger.warning(serializer.errors)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -226,16 +270,20 @@ class PositionSettingsAPIView(APIView):
                 if getattr(settings, field) != value:
                     changed_fields.append(field)
             if changed_fields:
-                result: dict = tasks.replacing_orders.delay(
+                job = run_job(
+                    request, tasks.replacing_orders,
                     settings.position.id, changed_fields, serializer.validated_data
-                ).get()
+                )
+                if response := get_job_response(job):
+                    return response
+                result: dict = job['result']
                 if result.get('error'):
                     return Response(
                         {'detail': result['detail']},
                         status=status.HTTP_400_BAD_REQUEST
                     )
-                serializer.save()
-                return Response(serializer.data, status=status.HTTP_200_OK)
+                settings.refresh_from_db()
+                return Response(PositionSettingsSerializer(settings).data, status=status.HTTP_200_OK)
             else:
                 return Response(
                     {'detail': 'No changes detected.'},
@@ -297,6 +345,7 @@ class OrderAPIView(APIView):
     ),
     delete=extend_schema(
         summary='Close all positions',
+        parameters=[followers_parameter],
         responses={
             200: DummyClosePositionsSerializer,
             400: DummyClosePositionsSerializer
@@ -316,9 +365,12 @@ class PositionAPIView(APIView):
         position = get_object_or_404(self.queryset.all(), pk=id)
         serializer = ClosePositionPartialSerializer(data=request.data)
         if serializer.is_valid():
-            result: dict = tasks.place_market_or_limit_order.delay(
-                position.id, serializer.validated_data
-            ).get()
+            job = run_job(
+                request, tasks.place_market_or_limit_order, position.id, serializer.validated_data
+            )
+            if response := get_job_response(job):
+                return response
+            result: dict = job['result']
             if result.get('error'):
                 return Response({'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST)
             return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
@@ -327,7 +379,13 @@ class PositionAPIView(APIView):
 
     def delete(self, request, id=None):
         position = get_object_or_404(self.queryset.all(), pk=id)
-        result: dict = tasks.close_positions.delay(position_id=position.id).get()
+        job = run_job(
+            request, tasks.close_positions,
+            position_id=position.id, followers_too=is_followers_requested(request)
+        )
+        if response := get_job_response(job):
+            return response
+        result: dict = job['result']
         if result.get('error'):
             return Response({'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
@@ -347,9 +405,12 @@ class IncreasePositionAPIView(APIView):
         position = get_object_or_404(self.queryset.all(), pk=id)
         serializer = IncreasePositionSerializer(data=request.data)
         if serializer.is_valid():
-            result: dict = tasks.increase_position.delay(
-                position.id, serializer.validated_data
-            ).get()
+            job = run_job(
+                request, tasks.increase_position, position.id, serializer.validated_data
+            )
+            if response := get_job_response(job):
+                return response
+            result: dict = job['result']
             if result.get('error'):
                 return Response({'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST)
             return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
@@ -361,6 +422,7 @@ class IncreasePositionAPIView(APIView):
 @extend_schema_view(
     delete=extend_schema(
         summary='Close all positions',
+        parameters=[followers_parameter],
         responses={
             200: DummyClosePositionsSerializer,
             400: DummyClosePositionsSerializer
@@ -370,7 +432,12 @@ class IncreasePositionAPIView(APIView):
 )
 class CloseAllPositionsAPIView(APIView):
     def delete(self, request):
-        result: dict = tasks.close_positions.delay().get()
+        job = run_job(
+            request, tasks.close_positions, followers_too=is_followers_requested(request)
+        )
+        if response := get_job_response(job):
+            return response
+        result: dict = job['result']
         if result.get('error'):
             return Response({'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
@@ -380,6 +447,7 @@ class CloseAllPositionsAPIView(APIView):
 @extend_schema_view(
     delete=extend_schema(
         summary='Close all profitable positions',
+        parameters=[followers_parameter],
         responses={
             200: DummyClosePositionsSerializer,
             400: DummyClosePositionsSerializer
@@ -389,7 +457,13 @@ class CloseAllPositionsAPIView(APIView):
 )
 class CloseAllProfitablePositionsAPIView(APIView):
     def delete(self, request):
-        result: dict = tasks.close_positions.delay(unrealized_profit=True).get()
+        job = run_job(
+            request, tasks.close_positions,
+            unrealized_profit=True, followers_too=is_followers_requested(request)
+        )
+        if response := get_job_response(job):
+            return response
+        result: dict = job['result']
         if result.get('error'):
             return Response({'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST)
         return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
@@ -429,13 +503,10 @@ class PositionListAPIView(APIView):
     def post(self, request, *args, **kwargs):
         serializer = OpenPositionSerializer(data=request.data)
         if serializer.is_valid():
-            try:
-                result: dict = tasks.open_position_manually.delay(serializer.validated_data).get()
-            except TimeLimitExceeded:
-                return Response(
-                    {'detail': 'Timeout error'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            job = run_job(request, tasks.open_position_manually, serializer.validated_data)
+            if response := get_job_response(job):
+                return response
+            result: dict = job['result']
             if result.get('error'):
                 return Response({'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST)
             return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
@@ -468,10 +539,10 @@ class PriceChangePercentStrategyAPIView(APIView):
     def post(self, request):
         serializer = PriceChangePercentStrategySerializer(data=request.data)
         if serializer.is_valid():
-            result: dict = (
-                tasks.price_change_percent_strategy
-                .delay(serializer.validated_data).get()
-            )
+            job = run_job(request, tasks.price_change_percent_strategy, serializer.validated_data)
+            if response := get_job_response(job):
+                return response
+            result: dict = job['result']
             if result.get('error'):
                 return Response(
                     {'detail': result['detail']}, status=status.HTTP_400_BAD_REQUEST
@@ -479,3 +550,100 @@ class PriceChangePercentStrategyAPIView(APIView):
             return Response({'detail': result['detail']}, status=status.HTTP_200_OK)
         logger.warning(serializer.errors)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+@extend_schema(tags=['latency'])
+@extend_schema_view(
+    get=extend_schema(
+        summary='Copy trade latency percentiles per follower and per symbol',
+        parameters=[
+            OpenApiParameter(
+                'scope', str,
+                description='Filter by scope, e.g. "account", "account:1", "symbol:BTCUSDT", "egress"'
+            )
+        ],
+        examples=[
+            OpenApiExample(
+                name='',
+                description='',
+                value={
+                    'account:1': {
+                        'total': {
+                            'count': 120, 'avg': 85.2, 'p50': 70.4,
+                            'p95': 180.0, 'p99': 420.5
+                        }
+                    }
+                },
+                status_codes=['200']
+            )
+        ]
+    ),
+    delete=extend_schema(
+        summary='Reset copy trade latency histograms',
+    )
+)
+class LatencyAPIView(APIView):
+    def get(self, request):
+        return Response(latency.get_report(request.query_params.get('scope', '')))
+
+    def delete(self, request):
+        latency.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@extend_schema(tags=['locks'])
+@extend_schema_view(
+    get=extend_schema(
+        summary='Task lock contention and wait time per lock',
+        examples=[
+            OpenApiExample(
+                name='',
+                description='',
+                value={
+                    'copy_trade_orders': {
+                        'acquired': 240, 'contended': 12, 'timeouts': 0,
+                        'limited': 0, 'avg_wait_ms': 35.4
+                    }
+                },
+                status_codes=['200']
+            )
+        ]
+    ),
+    delete=extend_schema(
+        summary='Reset task lock metrics',
+    )
+)
+class LockMetricsAPIView(APIView):
+    def get(self, request):
+        return Response(get_lock_metrics())
+
+    def delete(self, request):
+        reset_lock_metrics()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@extend_schema(tags=['jobs'])
+@extend_schema_view(
+    get=extend_schema(
+        summary='Status and result of a task started by the api',
+        examples=[
+            OpenApiExample(
+                name='',
+                description='',
+                value={
+                    'job_id': '2f6c1f3e-7d1a-4c5e-9a0b-6f1d2e3c4b5a',
+                    'task': 'exchange_binance.tasks.close_positions',
+                    'status': 'SUCCESS',
+                    'result': {'error': False, 'detail': []}
+                },
+                status_codes=['200']
+            )
+        ]
+    )
+)
+class JobAPIView(APIView):
+    def get(self, request, job_id=None):
+        job = jobs.get(job_id)
+        if job is None:
+            return get_job_response(job)
+        return Response(job)
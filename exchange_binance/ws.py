@@ -5,14 +5,21 @@ from websocket._exceptions import (
 )
 import json
 import ctypes
+import queue
 import threading
 import time
 import hashlib
 import hmac
+import uuid
 from urllib.parse import urlencode
 from typing import Callable
-from binance.um_futures import UMFutures
+from django.conf import settings
+from django.core.cache import cache
+from binance.error import ClientError
 from exchange_binance.credentials import binance
+from exchange_binance.clients import pool
+from exchange_binance.limits import order_limiter, is_protective
+from exchange_binance import latency
 
 
 logger = logging.getLogger(__name__)
@@ -21,6 +28,8 @@ logger = logging.getLogger(__name__)
 class SingletonMeta(type):
     def __new__(mcs, name, bases, attrs):
         attrs['_instances'] = {}
+        # reentrant, connect holds it while creating the instance
+        attrs['_lock'] = threading.RLock()
         return super().__new__(mcs, name, bases, attrs)
 
     def __call__(cls, *args, **kwargs):
@@ -29,10 +38,11 @@ class SingletonMeta(type):
             id = account.id
         else:
             id = 0
-        if id not in cls._instances:
-            instance = super().__call__(*args, **kwargs)
-            cls._instances[id] = instance
-        return cls._instances[id]
+        with cls._lock:
+            if id not in cls._instances:
+                instance = super().__call__(*args, **kwargs)
+                cls._instances[id] = instance
+            return cls._instances[id]
 
 
 class WebSocketBinance(metaclass=SingletonMeta):
@@ -46,8 +56,17 @@ class WebSocketBinance(metaclass=SingletonMeta):
         self.handlers = []
         self.name = self.__class__.__name__
         self.threads: dict = {}
-        self.methods_names = ['run_forever']
+        self.methods_names = ['run_forever', 'process_queue']
         self.extra = {'symbol': self.name}
+        # block: the receive loop waits for free space, nothing is dropped
+        # drop_oldest: the oldest frame is discarded to make room
+        self.backpressure = kwargs.get('backpressure', 'block')
+        self.queue = queue.Queue(
+            maxsize=kwargs.get('queue_size', settings.WEBSOCKET_QUEUE_SIZE)
+        )
+        self.stats_lock = threading.Lock()
+        self.dropped = 0
+        self.latency: dict[str, dict] = {}
 
     def _message_handler(self, message: str) -> None | dict:
         try:
@@ -77,6 +96,8 @@ class WebSocketBinance(metaclass=SingletonMeta):
         logger.info(f'Connected to {url}', extra=self.extra)
 
     def _get_url(self) -> str:
+        if settings.BINANCE_WS_URL:
+            return settings.BINANCE_WS_URL
         if self.testnet:
             url = 'wss://fstream.binancefuture.com/ws'
         else:
@@ -96,8 +117,9 @@ class WebSocketBinance(metaclass=SingletonMeta):
                         message = self.ws.recv()
                         data = self._message_handler(message)
                         if data:
-                            for handler in self.handlers:
-                                handler(data)
+                            if isinstance(data, dict):
+                                data['_received'] = latency.now()
+                            self._enqueue(data)
                     except WebSocketPayloadException as e:
                         logger.error(e, extra=self.extra)
                     except WebSocketException:
@@ -115,6 +137,79 @@ class WebSocketBinance(metaclass=SingletonMeta):
             self.ws.close()
             logger.info('Stopped', extra=self.extra)
 
+    def _enqueue(self, data: dict) -> None:
+        if self.backpressure == 'drop_oldest':
+            while True:
+                try:
+                    self.queue.put_nowait(data)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        with self.stats_lock:
+                            self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while self.is_run:
+            try:
+                self.queue.put(data, timeout=1)
+                return
+            except queue.Full:
+                logger.warning(
+                    f'Queue is full, {self.queue.maxsize} messages waiting',
+                    extra=self.extra
+                )
+
+    def _handle(self, data: dict) -> None:
+        for handler in self.handlers:
+            start = time.perf_counter()
+            try:
+                handler(data)
+            except Exception as e:
+                # later handlers rely on the earlier ones, e.g. copy_trade on orders
+                logger.exception(e, extra=self.extra)
+                return
+            finally:
+                elapsed = time.perf_counter() - start
+                with self.stats_lock:
+                    latency = self.latency.setdefault(
+                        handler.__name__, {'count': 0, 'total': 0.0, 'max': 0.0}
+                    )
+                    latency['count'] += 1
+                    latency['total'] += elapsed
+                    latency['max'] = max(latency['max'], elapsed)
+
+    def process_queue(self) -> None:
+        published_at = time.monotonic()
+        while self.is_run:
+            try:
+                data = self.queue.get(timeout=1)
+                self._handle(data)
+            except queue.Empty:
+                pass
+            if time.monotonic() - published_at > 10:
+                published_at = time.monotonic()
+                cache.set(f'websocket_stats_{self.name}', self.get_stats(), timeout=60)
+        else:
+            logger.info('Stopped', extra=self.extra)
+
+    def get_stats(self) -> dict:
+        with self.stats_lock:
+            handlers = {
+                name: {
+                    'count': i['count'],
+                    'avg_ms': round(i['total'] / i['count'] * 1000, 3) if i['count'] else 0,
+                    'max_ms': round(i['max'] * 1000, 3)
+                }
+                for name, i in self.latency.items()
+            }
+            return {
+                'queue_depth': self.queue.qsize(),
+                'queue_size': self.queue.maxsize,
+                'dropped': self.dropped,
+                'handlers': handlers
+            }
+
     def launch(self):
         try:
             for method in self.methods_names:
@@ -169,18 +264,10 @@ class WebSocketBinance(metaclass=SingletonMeta):
 class WebSocketBinanceUserData(WebSocketBinance):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
-        self.methods_names = ['run_forever', 'keepalive']
+        self.methods_names = ['run_forever', 'process_queue', 'keepalive']
 
     def new_listen_key(self):
-        if binance.testnet:
-            base_url = 'https://testnet.binancefuture.com'
-        else:
-            base_url = 'https://fapi.binance.com'
-        self.client = UMFutures(
-            key=binance.api_key,
-            secret=binance.api_secret,
-            base_url=base_url
-        )
+        self.client = pool.master()
         listen_key = self.client.new_listen_key().get('listenKey')
         logger.info(f'Listen key: {listen_key}', extra=self.extra)
         return listen_key
@@ -252,9 +339,11 @@ class WebSocketBinanceApi(WebSocketBinance):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         # self.methods_names = ['run_forever', 'keepalive', 'position_information_v2']
-        self.methods_names = ['run_forever', 'keepalive']
+        self.methods_names = ['run_forever', 'process_queue', 'keepalive']
 
     def _get_url(self) -> str:
+        if settings.BINANCE_WS_API_URL:
+            return settings.BINANCE_WS_API_URL
         if self.testnet:
             url = 'wss://testnet.binancefuture.com/ws-fapi/v1'
         else:
@@ -356,3 +445,101 @@ class WebSocketBinanceApi(WebSocketBinance):
             data = self._get_position_information_v2()
             self.ws.send(json.dumps(data))
             time.sleep(0.5)
+
+
+class WebSocketBinanceOrderApi(WebSocketBinanceApi):
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.methods_names = ['run_forever']
+        self.account = kwargs['account']
+        self.timeout = settings.COPY_TRADE_FOLLOWER_TIMEOUT
+        self.send_lock = threading.Lock()
+        self.events: dict[str, threading.Event] = {}
+        self.responses: dict[str, dict] = {}
+        self.extra = {'account': self.account.id, 'symbol': self.name}
+
+    @classmethod
+    def connect(cls, account) -> 'WebSocketBinanceOrderApi':
+        # copy threads of one account may connect at the same time
+        with cls._lock:
+            ws = cls(account=account)
+            ws.account = account
+            if not ws.is_run:
+                ws.start()
+        return ws
+
+    def init(self):
+        url = self._get_url()
+        self._connect(url)
+
+    def _message_handler(self, message: str) -> None:
+        try:
+            message = json.loads(message)
+        except json.decoder.JSONDecodeError:
+            logger.error(f'Can not decode message. {message=}', extra=self.extra)
+            return
+        event = self.events.get(message.get('id'))
+        if not event:
+            logger.warning(f'Unexpected message: {message}', extra=self.extra)
+            return
+        self.responses[message['id']] = message
+        event.set()
+
+    def _sign(self, params: dict) -> dict:
+        payload = {}
+        for key, value in params.items():
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = 'true' if value else 'false'
+            elif not isinstance(value, int):
+                value = str(value)
+            payload[key] = value
+        params = payload
+        params.update(apiKey=self.account.api_key, timestamp=int(time.time() * 1000))
+        query_string = urlencode(sorted(params.items()))
+        params['signature'] = hmac.new(
+            self.account.api_secret.encode('utf-8'),
+            query_string.encode('utf-8'),
+            hashlib.sha256
+        ).hexdigest()
+        return params
+
+    def request(self, method: str, params: dict) -> dict:
+        deadline = time.monotonic() + self.timeout
+        while not self.ws.connected:
+            if time.monotonic() > deadline:
+                raise ClientError(None, None, 'WebSocket API is not connected', {})
+            time.sleep(0.01)
+        if method in ('order.place', 'order.modify'):
+            order_limiter.acquire(self.account.api_key, 1, is_protective(params))
+        request_id = uuid.uuid4().hex
+        event = threading.Event()
+        self.events[request_id] = event
+        try:
+            data = {'id': request_id, 'method': method, 'params': self._sign(params)}
+            with self.send_lock:
+                self.ws.send(json.dumps(data))
+            if not event.wait(deadline - time.monotonic()):
+                raise ClientError(None, None, f'No response to {method}', {})
+            response = self.responses.pop(request_id)
+        finally:
+            self.events.pop(request_id, None)
+            self.responses.pop(request_id, None)
+        if response.get('rateLimits'):
+            order_limiter.update_from_rate_limits(self.account.api_key, response['rateLimits'])
+        if response.get('status') != 200:
+            error = response.get('error', {})
+            raise ClientError(
+                response.get('status'), error.get('code'), error.get('msg'), {}
+            )
+        return response['result']
+
+    def place_order(self, **params) -> dict:
+        return self.request('order.place', params)
+
+    def cancel_order(self, **params) -> dict:
+        return self.request('order.cancel', params)
+
+    def modify_order(self, **params) -> dict:
+        return self.request('order.modify', params)
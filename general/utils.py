@@ -2,10 +2,10 @@ import logging
 import json
 import re
 import time
+import uuid
 from typing import Optional
 from datetime import datetime
 from django.utils.safestring import mark_safe
-from django.core.cache import cache
 from django_redis import get_redis_connection
 from general.exceptions import AcquireLockException, LimitUsageException
 
@@ -14,6 +14,49 @@ logger = logging.getLogger(__name__)
 connection = get_redis_connection('default')
 
 
+LIMIT_USAGE_KEY = 'limit_usage_too_high'
+LOCK_METRICS_KEY = 'task_lock_metrics'
+# KEYS: lock, limit usage flag, metrics. ARGV: token, lease ms or 0 without expiry, check limit usage.
+# Returns 1 when acquired, 0 when the lock is held and -1 when limit usage is too high
+LOCK_ACQUIRE_SCRIPT = """
+if ARGV[3] == '1' and redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('HINCRBY', KEYS[3], 'limited', 1)
+    return -1
+end
+local acquired
+if ARGV[2] == '0' then
+    acquired = redis.call('SET', KEYS[1], ARGV[1], 'NX')
+else
+    acquired = redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2])
+end
+if acquired then
+    redis.call('HINCRBY', KEYS[3], 'acquired', 1)
+    return 1
+end
+return 0
+"""
+# KEYS: lock, waiters list. ARGV: token
+LOCK_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('DEL', KEYS[2])
+    redis.call('LPUSH', KEYS[2], 1)
+    redis.call('PEXPIRE', KEYS[2], 1000)
+    return 1
+end
+return 0
+"""
+LOCK_EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+lock_acquire_script = connection.register_script(LOCK_ACQUIRE_SCRIPT)
+lock_release_script = connection.register_script(LOCK_RELEASE_SCRIPT)
+lock_extend_script = connection.register_script(LOCK_EXTEND_SCRIPT)
+
+
 class TaskLock():
     def __init__(
         self,
@@ -21,55 +64,107 @@ class TaskLock():
         use_limit_usage: bool = False,
         timeout: Optional[int] = 10,
         blocking: bool = False,
-        blocking_timeout: Optional[int] = 1
+        blocking_timeout: Optional[int] = 1,
+        name: Optional[str] = None
     ) -> None:
         self.key = key
         self.timeout = timeout
         self.blocking = blocking
         self.blocking_timeout = blocking_timeout
-        self.sleep = 0.001,
         self.use_limit_usage = use_limit_usage
-
-    def limit_usage(self) -> bool:
-        if self.use_limit_usage:
-            return cache.get('limit_usage_too_high')
-        return False
+        self.token = uuid.uuid4().hex
+        self.waiters_key = f'{key}:waiters'
+        # locks with per symbol or per position keys share the metrics of their name
+        self.metrics_key = f'{LOCK_METRICS_KEY}:{name or key}'
+
+    def do_acquire(self) -> int:
+        return lock_acquire_script(
+            keys=[self.key, LIMIT_USAGE_KEY, self.metrics_key],
+            args=[self.token, int((self.timeout or 0) * 1000), int(self.use_limit_usage)]
+        )
+
+    def _wait(self, stop_trying_at: Optional[float]) -> None:
+        # the holder pushes to the waiters list on release, the wait is also
+        # capped by the lease so an expired lock is retried without a release
+        ttl = connection.pttl(self.key)
+        # -1 is a lock without expiry, it is only freed by a release
+        wait = 1 if ttl == -1 else max(ttl / 1000, 0.01)
+        if stop_trying_at:
+            wait = min(wait, stop_trying_at - time.monotonic())
+        if wait > 0:
+            connection.blpop([self.waiters_key], timeout=max(wait, 0.01))
 
     def acquire(self) -> bool:
+        started_at = time.monotonic()
+        result = self.do_acquire()
+        if result == -1:
+            raise LimitUsageException('Limit usage is too high')
+        if result == 1:
+            return True
         if not self.blocking:
-            return self.do_acquire()
+            connection.hincrby(self.metrics_key, 'contended', 1)
+            return False
         stop_trying_at = None
         if self.blocking_timeout:
-            stop_trying_at = time.monotonic() + self.blocking_timeout
-        while True:
-            if self.do_acquire():
-                return True
-            if not self.blocking:
-                return False
-            if stop_trying_at and time.monotonic() > stop_trying_at:
-                return False
-            time.sleep(self.sleep)
-
-    def do_acquire(self) -> bool:
-        if connection.set(self.key, 1, nx=True, ex=self.timeout):
-            return True
-        return False
+            stop_trying_at = started_at + self.blocking_timeout
+        while result == 0:
+            if stop_trying_at and time.monotonic() >= stop_trying_at:
+                break
+            self._wait(stop_trying_at)
+            result = self.do_acquire()
+            if result == -1:
+                raise LimitUsageException('Limit usage is too high')
+        pipe = connection.pipeline(transaction=False)
+        pipe.hincrby(self.metrics_key, 'contended', 1)
+        pipe.hincrbyfloat(self.metrics_key, 'wait_ms', (time.monotonic() - started_at) * 1000)
+        if result != 1:
+            pipe.hincrby(self.metrics_key, 'timeouts', 1)
+        pipe.execute()
+        return result == 1
+
+    def extend(self, timeout: Optional[int] = None) -> bool:
+        timeout = timeout or self.timeout
+        if not timeout:
+            raise ValueError('A lock without expiry cannot be extended')
+        return lock_extend_script(
+            keys=[self.key], args=[self.token, int(timeout * 1000)]
+        ) == 1
 
     def release(self) -> bool:
-        return connection.delete(self.key) == 1
+        return lock_release_script(keys=[self.key, self.waiters_key], args=[self.token]) == 1
 
     def locked(self) -> bool:
         return connection.exists(self.key) == 1
 
     def __enter__(self):
-        if self.limit_usage():
-            raise LimitUsageException('Limit usage is too high')
         if self.acquire():
             return self
         raise AcquireLockException('Failed to acquire lock')
 
     def __exit__(self, exc_type, exc_value, traceback):
-        self.release()
+        if not self.release():
+            logger.warning(f'Lock {self.key} expired before release')
+
+
+def get_lock_metrics() -> dict:
+    metrics = {}
+    for key in connection.scan_iter(match=f'{LOCK_METRICS_KEY}:*', count=1000):
+        data = {k.decode(): float(v) for k, v in connection.hgetall(key).items()}
+        contended = data.get('contended', 0)
+        metrics[key.decode().split(':', 1)[1]] = {
+            'acquired': int(data.get('acquired', 0)),
+            'contended': int(contended),
+            'timeouts': int(data.get('timeouts', 0)),
+            'limited': int(data.get('limited', 0)),
+            'avg_wait_ms': round(data.get('wait_ms', 0) / contended, 3) if contended else 0.0,
+        }
+    return dict(sorted(metrics.items()))
+
+
+def reset_lock_metrics() -> None:
+    keys = list(connection.scan_iter(match=f'{LOCK_METRICS_KEY}:*', count=1000))
+    if keys:
+        connection.delete(*keys)
 
 
 def get_pretty_dict(data) -> str: